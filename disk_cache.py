@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于本地磁盘的内容寻址结果缓存
+
+以请求内容的哈希为键，每条结果保存为一个JSON文件；总大小超过上限时
+按最近访问时间淘汰最旧的条目，有效期（max_age）从写入时开始计算，读取不会延长。用于缓存大纲生成等耗时且结果可复用的调用。
+"""
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+
+class DiskCache:
+    """内容寻址的磁盘缓存（线程安全）
+
+    文件布局：<directory>/<key前2位>/<key>.json，启动时扫描目录重建索引，
+    因此多次重启之间缓存保持有效。文件的mtime为写入时间，atime为最近访问时间。
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024,
+                 max_age: Optional[float] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries: dict[str, list] = {}  # key -> [size, last_access, written_at]
+        self._total_bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "errors": 0}
+        self._scan()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _scan(self):
+        """扫描已有缓存文件，重建大小与访问时间索引"""
+        if not os.path.isdir(self.directory):
+            return
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                self._entries[name[:-5]] = [stat.st_size, stat.st_atime, stat.st_mtime]
+                self._total_bytes += stat.st_size
+        self._evict_locked()
+
+    def get(self, key: str) -> Optional[dict]:
+        """读取缓存结果，不存在或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if self.max_age is not None and time.time() - entry[2] > self.max_age:
+                self._remove_locked(key)
+                self._stats["misses"] += 1
+                return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self._stats["errors"] += 1
+                self._stats["misses"] += 1
+                self._remove_locked(key)
+            return None
+
+        now = time.time()
+        with self._lock:
+            self._stats["hits"] += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                return value
+            entry[1] = now
+            written_at = entry[2]
+        try:
+            # 记录访问时间（atime），写入时间（mtime）保持不变，重启后仍按最近访问淘汰、按写入时间过期
+            os.utime(self._path(key), (now, written_at))
+        except OSError:
+            pass
+        return value
+
+    def put(self, key: str, value: dict):
+        """写入缓存（先写临时文件再替换），超出容量时淘汰最久未访问的条目"""
+        path = self._path(key)
+        payload = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if len(payload) > self.max_bytes:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except OSError:
+            with self._lock:
+                self._stats["errors"] += 1
+            return
+
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None:
+                self._total_bytes -= previous[0]
+            now = time.time()
+            self._entries[key] = [len(payload), now, now]
+            self._total_bytes += len(payload)
+            self._stats["writes"] += 1
+            self._evict_locked()
+
+    def _remove_locked(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._total_bytes -= entry[0]
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict_locked(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        for key in sorted(self._entries, key=lambda k: self._entries[k][1]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._remove_locked(key)
+            self._stats["evictions"] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes
+            }
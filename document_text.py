@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文档文本提取与压缩
+
+在上传前从 txt/md/docx/pdf 中提取纯文本并统计字数，超过讯飞智文的字数限制时
+按需截断或压缩，使大纲生成可以直接提交文本而不必上传整个文件。
+"""
+import io
+import re
+import zipfile
+from typing import Optional
+from xml.etree import ElementTree
+
+try:
+    import pypdf  # 可选依赖：pip install pypdf，未安装时pdf文档仍按原文件上传
+    PDF_TEXT_AVAILABLE = True
+except ImportError:
+    PDF_TEXT_AVAILABLE = False
+
+DEFAULT_MAX_CHARS = 8000
+OVERFLOW_POLICIES = ("error", "truncate", "condense")
+
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_SENTENCE_END = re.compile(r"(?<=[。！？!?；;.])")
+
+
+class DocumentTooLong(ValueError):
+    """文档字数超过限制"""
+
+    def __init__(self, chars: int, max_chars: int):
+        super().__init__(f"文档约 {chars} 字，超过 {max_chars} 字限制；"
+                         f"可设置 overflow 为 truncate（截断）或 condense（压缩）后重试")
+        self.chars = chars
+        self.max_chars = max_chars
+
+
+def _decode_text(data: bytes) -> str:
+    for encoding in ("utf-8-sig", "gb18030"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
+
+def _docx_text(data: bytes) -> str:
+    """从docx的word/document.xml中按段落提取文本，标题段落以#标记"""
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
+    paragraphs = []
+    for paragraph in root.iter(f"{_WORD_NS}p"):
+        text = "".join(node.text or "" for node in paragraph.iter(f"{_WORD_NS}t")).strip()
+        if not text:
+            continue
+        style = paragraph.find(f"{_WORD_NS}pPr/{_WORD_NS}pStyle")
+        style_name = style.get(f"{_WORD_NS}val", "") if style is not None else ""
+        if style_name.lower().startswith(("heading", "title")) or style_name.startswith("标题"):
+            text = f"# {text}"
+        paragraphs.append(text)
+    return "\n".join(paragraphs)
+
+
+def _pdf_text(data: bytes) -> str:
+    reader = pypdf.PdfReader(io.BytesIO(data))
+    return "\n".join((page.extract_text() or "").strip() for page in reader.pages)
+
+
+def extract_text(data, extension: str) -> Optional[str]:
+    """提取文档纯文本，不支持的格式（doc、未安装pypdf时的pdf）或解析失败时返回None"""
+    extension = extension.lower().lstrip(".")
+    data = bytes(data)
+    try:
+        if extension in ("txt", "md"):
+            text = _decode_text(data)
+        elif extension == "docx":
+            text = _docx_text(data)
+        elif extension == "pdf" and PDF_TEXT_AVAILABLE:
+            text = _pdf_text(data)
+        else:
+            return None
+    except Exception as e:
+        print(f"文档文本提取失败，将按原文件上传: {e}")
+        return None
+    # 合并多余的空白，字数统计与提交内容保持一致
+    text = re.sub(r"[ \t　]+", " ", text)
+    return re.sub(r"\n\s*\n+", "\n", text).strip()
+
+
+def count_chars(text: str) -> int:
+    """按讯飞智文的口径粗略统计字数（不计空白）"""
+    return len(re.sub(r"\s", "", text))
+
+
+def truncate_text(text: str, max_chars: int) -> str:
+    """截断到字数限制，尽量在段落或句子边界处截断"""
+    if count_chars(text) <= max_chars:
+        return text
+    kept, used = [], 0
+    for char in text:
+        if not char.isspace():
+            if used >= max_chars:
+                break
+            used += 1
+        kept.append(char)
+    truncated = "".join(kept)
+    # 在末尾10%范围内寻找段落/句子边界
+    window = max(1, len(truncated) // 10)
+    position = max(truncated.rfind(boundary, len(truncated) - window)
+                   for boundary in ("\n", "。", "！", "？", ".", "!", "?"))
+    return truncated[:position + 1].rstrip() if position > 0 else truncated
+
+
+def condense_text(text: str, max_chars: int) -> str:
+    """压缩到字数限制：保留所有标题，正文段落按顺序只保留首句，仍超出时再截断"""
+    if count_chars(text) <= max_chars:
+        return text
+    lines = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#") or (len(line) <= 30 and not _SENTENCE_END.search(line[-1:])):
+            lines.append(line)
+        else:
+            sentences = [s for s in _SENTENCE_END.split(line) if s.strip()]
+            lines.append(sentences[0].strip() if sentences else line)
+    return truncate_text("\n".join(lines), max_chars)
+
+
+def fit_text(text: str, max_chars: int = DEFAULT_MAX_CHARS, overflow: str = "error") -> tuple[str, str]:
+    """按溢出策略把文本控制在字数限制内，返回(文本, 处理方式)，处理方式为 none/truncate/condense"""
+    if overflow not in OVERFLOW_POLICIES:
+        raise ValueError(f"未知的超长处理方式: {overflow}，可选: {'、'.join(OVERFLOW_POLICIES)}")
+    chars = count_chars(text)
+    if chars <= max_chars:
+        return text, "none"
+    if overflow == "error":
+        raise DocumentTooLong(chars, max_chars)
+    if overflow == "truncate":
+        return truncate_text(text, max_chars), "truncate"
+    return condense_text(text, max_chars), "condense"
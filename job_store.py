@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PPT生成任务的持久化存储
+
+基于本地SQLite文件记录每个生成任务的提交参数、sid、实际使用的密钥与状态。
+服务重启后可据此继续跟踪进行中的任务、重新提交尚未提交的排队任务，
+不必重新生成已在上游生成中的PPT，也不会浪费已消耗的配额。
+
+多个服务进程可以共用同一个存储文件：排队中的任务记录所属进程（owner）与租约到期时间，
+只有所属进程已退出或租约已过期的任务才能被其他进程以条件更新认领后重新提交。
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+# 任务状态：queued（已排队，未提交）-> submitted（已提交，获得sid）-> building -> done/failed
+# resubmitting 表示排队任务已被某个进程认领、正在重新提交；
+# submit_failed 表示提交被上游拒绝，cancelled 表示批量调用被取消时尚未提交（重启后不再提交）
+PENDING_STATUSES = ("queued", "resubmitting", "submitted", "building")
+CLAIMABLE_STATUSES = ("queued", "resubmitting")
+FINISHED_STATUSES = ("done", "failed", "submit_failed", "cancelled")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    sid TEXT UNIQUE,
+    key_name TEXT,
+    progress INTEGER NOT NULL DEFAULT 0,
+    ppt_url TEXT,
+    error TEXT,
+    owner TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+# 旧版本存储文件缺少的列
+_MIGRATIONS = {"owner": "ALTER TABLE jobs ADD COLUMN owner TEXT",
+               "lease_until": "ALTER TABLE jobs ADD COLUMN lease_until REAL"}
+
+
+class JobStore:
+    """生成任务存储（线程安全）
+
+    使用WAL模式；每次写入都会提交事务，异步代码中应通过asyncio.to_thread调用。
+    lease为排队任务的租约时长（秒），所属进程运行期间应定期调用renew_leases续约。
+    """
+
+    def __init__(self, path: str, retention: float = 7 * 24 * 3600, lease: float = 300.0):
+        self.path = path
+        self.retention = retention
+        self.lease = lease
+        # 所属进程标识：主机名:进程号:启动编号（进程号可能被复用，启动编号区分同一进程号的不同进程）
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, sql in _MIGRATIONS.items():
+            if column not in columns:
+                self._db.execute(sql)
+        self.prune()
+
+    def _execute(self, sql: str, args: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._db.execute(sql, args)
+
+    def _fetchall(self, sql: str, args: tuple = ()) -> list[sqlite3.Row]:
+        # 在锁内取完结果，避免其他线程在同一连接上执行语句时游标被重置
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def add_queued(self, kind: str, params: dict) -> int:
+        """记录一个尚未提交的任务，返回任务编号"""
+        now = time.time()
+        cursor = self._execute(
+            "INSERT INTO jobs (kind, params, status, owner, lease_until, created_at, updated_at) "
+            "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+            (kind, json.dumps(params, ensure_ascii=False), self.owner, now + self.lease, now, now))
+        return cursor.lastrowid
+
+    def add_queued_many(self, kind: str, params_list: list) -> list[int]:
+        """在一个事务中记录多个尚未提交的任务，按顺序返回任务编号"""
+        if not params_list:
+            return []
+        now = time.time()
+        rows = [(kind, json.dumps(params, ensure_ascii=False), self.owner, now + self.lease, now, now)
+                for params in params_list]
+        with self._lock:
+            # BEGIN IMMEDIATE独占写入，AUTOINCREMENT编号在事务内连续
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(
+                    "INSERT INTO jobs (kind, params, status, owner, lease_until, created_at, updated_at) "
+                    "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                    rows)
+                last_id = self._db.execute("SELECT last_insert_rowid()").fetchone()[0]
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
+    def mark_submitted(self, job_id: Optional[int], kind: str, params: dict, sid: str, key_name: str) -> int:
+        """记录任务已提交（job_id为None时新建记录），返回任务编号"""
+        now = time.time()
+        if job_id is None:
+            cursor = self._execute(
+                "INSERT OR REPLACE INTO jobs (kind, params, status, sid, key_name, created_at, updated_at) "
+                "VALUES (?, ?, 'submitted', ?, ?, ?, ?)",
+                (kind, json.dumps(params, ensure_ascii=False), sid, key_name, now, now))
+            return cursor.lastrowid
+        self._execute("UPDATE jobs SET status = 'submitted', sid = ?, key_name = ?, updated_at = ? WHERE id = ?",
+                      (sid, key_name, now, job_id))
+        return job_id
+
+    def mark_submit_failed(self, job_id: int, error: str):
+        self._execute("UPDATE jobs SET status = 'submit_failed', error = ?, updated_at = ? WHERE id = ?",
+                      (error, time.time(), job_id))
+
+    def cancel_queued(self, job_ids: list) -> int:
+        """把仍在排队（尚未提交）的任务标记为已取消，返回标记的数量"""
+        job_ids = [job_id for job_id in job_ids if job_id is not None]
+        if not job_ids:
+            return 0
+        cursor = self._execute(
+            f"UPDATE jobs SET status = 'cancelled', updated_at = ? "
+            f"WHERE status = 'queued' AND id IN ({', '.join('?' * len(job_ids))})",
+            (time.time(), *job_ids))
+        return cursor.rowcount
+
+    def renew_leases(self) -> int:
+        """为本进程排队中/重新提交中的任务续约，返回续约的数量"""
+        cursor = self._execute(
+            "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status IN (?, ?)",
+            (time.time() + self.lease, self.owner, *CLAIMABLE_STATUSES))
+        return cursor.rowcount
+
+    def _owner_gone(self, owner: Optional[str], lease_until: Optional[float], now: float) -> bool:
+        """任务的所属进程是否已不再处理它：无所属进程、租约过期，或同一主机上的所属进程已退出"""
+        if owner is None or lease_until is None or lease_until < now:
+            return True
+        if owner == self.owner:
+            return False
+        host, _, rest = owner.partition(":")
+        pid = rest.partition(":")[0]
+        if host != socket.gethostname() or not pid.isdigit() or os.name == "nt":
+            # 其他主机（或Windows上无法无副作用地探测进程）只能等租约过期
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass  # 进程存在但无权发送信号
+        return False
+
+    def claim_queued(self) -> list[dict]:
+        """认领可以重新提交的排队任务（按提交顺序），返回认领成功的任务
+
+        每个任务以条件更新认领：只有状态与所属进程都未被其他进程改动时才生效，
+        多个进程同时恢复同一个存储文件时，每个任务只会被其中一个进程认领。
+        """
+        now = time.time()
+        rows = self._fetchall(
+            f"SELECT * FROM jobs WHERE status IN ({', '.join('?' * len(CLAIMABLE_STATUSES))}) ORDER BY id",
+            CLAIMABLE_STATUSES)
+        claimed = []
+        for row in rows:
+            if not self._owner_gone(row["owner"], row["lease_until"], now):
+                continue
+            cursor = self._execute(
+                "UPDATE jobs SET status = 'resubmitting', owner = ?, lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND owner IS ?",
+                (self.owner, now + self.lease, now, row["id"], row["status"], row["owner"]))
+            if cursor.rowcount == 1:
+                job = self._row(row)
+                job.update(status="resubmitting", owner=self.owner, lease_until=now + self.lease)
+                claimed.append(job)
+        return claimed
+
+    def update_progress(self, snapshot: dict):
+        """按进度快照更新任务状态（不在存储中的sid忽略）"""
+        if snapshot.get("status") == "error" and not snapshot.get("finished"):
+            # 单次查询失败不改变任务状态
+            return
+        self._execute(
+            "UPDATE jobs SET status = ?, progress = ?, ppt_url = COALESCE(?, ppt_url), error = ?, updated_at = ? "
+            "WHERE sid = ? AND status NOT IN ('done', 'failed')",
+            (snapshot["status"], snapshot.get("progress", 0), snapshot.get("ppt_url") or None,
+             snapshot.get("error"), time.time(), snapshot["sid"]))
+
+    def pending(self) -> list[dict]:
+        """所有未结束的任务（按提交顺序）"""
+        rows = self._fetchall(
+            f"SELECT * FROM jobs WHERE status IN ({', '.join('?' * len(PENDING_STATUSES))}) ORDER BY id",
+            PENDING_STATUSES)
+        return [self._row(row) for row in rows]
+
+    def get(self, sid: str) -> Optional[dict]:
+        rows = self._fetchall("SELECT * FROM jobs WHERE sid = ?", (sid,))
+        return self._row(rows[0]) if rows else None
+
+    def prune(self) -> int:
+        """删除超过保留时间的已结束任务"""
+        cursor = self._execute(
+            f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))}) AND updated_at < ?",
+            (*FINISHED_STATUSES, time.time() - self.retention))
+        return cursor.rowcount
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
+
+    def get_stats(self) -> dict:
+        rows = self._fetchall("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status")
+        return {"path": self.path, "jobs": {row["status"]: row["count"] for row in rows}}
+
+    def close(self):
+        """关闭存储；本进程尚未提交的任务立即释放租约，其他进程无需等待租约过期即可认领"""
+        with self._lock:
+            self._db.execute("UPDATE jobs SET lease_until = 0 WHERE owner = ? AND status IN (?, ?)",
+                             (self.owner, *CLAIMABLE_STATUSES))
+            self._db.close()
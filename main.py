@@ -6,16 +6,36 @@ import os
 import json
 import time
 import hashlib
+import heapq
+import random
 import hmac
 import base64
+import ipaddress
+import socket
 import argparse
 import logging
-from contextlib import AsyncExitStack
+import contextvars
+import mmap
+from collections import OrderedDict, deque, namedtuple
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager, nullcontext
 from typing import Any, Sequence, Optional
 
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 from requests_toolbelt.multipart.encoder import MultipartEncoder
 
+try:
+    import h2  # noqa: F401  httpx的HTTP/2支持依赖h2（可选：pip install "httpx[http2]"）
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 from mcp.server.models import InitializationOptions
 from mcp.server.stdio import stdio_server
 from mcp.server.lowlevel import NotificationOptions, Server
@@ -28,6 +48,13 @@ from mcp.types import (
     LoggingLevel,
 )
 import mcp.types as types
+from mcp.shared.exceptions import McpError
+
+from task_tracker import TaskTracker, summarize_progress
+from template_catalog import TemplateCatalog
+from disk_cache import DiskCache
+from job_store import JobStore
+from document_text import DocumentTooLong, count_chars, extract_text, fit_text
 
 # 讯飞智文API密钥池配置
 # 请在此处配置您的讯飞智文API密钥
@@ -37,7 +64,15 @@ API_KEY_POOL = [
         "api_secret": "your_api_secret_here",
         "name": "主密钥",
         "max_concurrent": 10,  # 最大并发数
-        "enabled": True
+        "enabled": True,
+        # 连接池配置（可选）
+        # "pool_size": 10,       # 该密钥的HTTP连接池大小，默认等于max_concurrent
+        # "idle_timeout": 30,    # 空闲连接保活时间（秒）
+        # "http2": False,        # 启用HTTP/2（需安装h2）
+        # 限流配置（可选，对应讯飞开放平台的配额）
+        # "qps": 5,              # 每秒请求数
+        # "burst": 5,            # 允许的突发请求数，默认等于qps
+        # "daily_quota": 1000,   # 每日请求配额
     },
     # 可以添加更多密钥实现负载均衡
     # {
@@ -56,387 +91,3012 @@ API_KEY_POOL = [
     # }
 ]
 
+# 工具调用工作池配置
+TOOL_WORKER_POOL_CONFIG = {
+    "max_workers": None,            # 同时执行的工具调用数，None表示取API_KEY_POOL中max_concurrent之和
+    "rejection_policy": "queue",    # 工作池满时的策略：queue-排队等待，fail_fast-立即拒绝
+    "max_queue_size": 1000,         # queue策略下的最大排队数
+    "queue_timeout": 300,           # queue策略下的最长排队时间（秒）
+    # 排队时各优先级的权重：interactive-模板列表/进度查询，outline-大纲生成，
+    # generation-PPT生成与工作流，batch-批量生成的每次提交
+    "priority_weights": {"interactive": 8, "outline": 4, "generation": 2, "batch": 1},
+    "tenant_weights": {},           # 按租户（MCP会话或经过认证的HTTP租户）调整权重，未列出的租户为1
+}
+
+# 租户配额配置：在工具调用进入工作池之前按租户限制并发与频率，超出时返回JSON-RPC错误
+# 默认关闭；stdio传输只有一个调用方，不检查配额
+TENANT_QUOTA_CONFIG = {
+    "enabled": False,
+    "tenant_tokens": {},            # HTTP类传输的租户令牌：{"令牌": "租户"}，调用方在 Authorization: Bearer <令牌> 中携带
+    "trust_tenant_header": False,   # 是否按X-Tenant-Id识别租户：该请求头由客户端任意设置，仅在前置的认证代理覆盖它时开启
+    "require_tenant": True,         # HTTP类传输无法确定租户时拒绝（NAT/代理后的多个调用方共用客户端地址）
+    "max_concurrent": 8,            # 每个租户同时执行的工具调用数
+    "rate_per_minute": 120,         # 每个租户每分钟的工具调用数（令牌桶）
+    "burst": 30,                    # 令牌桶容量，允许的短时突发调用数
+    "exempt_tools": ["get_api_pool_stats"],  # 不计入配额的工具
+    "overrides": {},                # 按租户覆盖：{"租户": {"max_concurrent": 20, "rate_per_minute": 600}}
+    "idle_ttl": 600,                # 空闲租户状态的保留时间（秒）
+}
+
+# 任务进度跟踪配置（服务端集中轮询并推送进度）
+TASK_TRACKER_CONFIG = {
+    "min_interval": 2.0,            # 最短轮询间隔（秒）
+    "max_interval": 15.0,           # 最长轮询间隔（秒），无进度变化时逐步拉长
+    "max_wait": 600,                # wait_for_task单次最长等待时间（秒）
+}
+
+# 密钥健康度与熔断配置
+KEY_HEALTH_CONFIG = {
+    "half_life": 60.0,              # 错误率衰减半衰期（秒），越早的请求权重越低
+    "latency_alpha": 0.2,           # 延迟EWMA平滑系数
+    "failure_threshold": 5,         # 连续失败多少次触发熔断
+    "error_rate_threshold": 0.5,    # 衰减错误率超过该值触发熔断
+    "min_samples": 10,              # 按错误率熔断所需的最小（衰减后）样本量
+    "open_seconds": 30.0,           # 熔断时长（秒），之后进入半开状态放行一个探测请求
+    "max_open_seconds": 300.0       # 探测连续失败时熔断时长翻倍的上限（秒）
+}
+
+class KeyHealth:
+    """单个密钥的健康度：时间衰减错误率、EWMA延迟与熔断器（closed/open/half_open）"""
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, config: dict = None):
+        self.config = {**KEY_HEALTH_CONFIG, **(config or {})}
+        self.state = self.CLOSED
+        self.error_weight = 0.0
+        self.total_weight = 0.0
+        self.latency = None
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.open_seconds = self.config["open_seconds"]
+        self.trips = 0
+        self.leases = 0             # 正在执行的请求数
+        self.stale_leases = 0       # 熔断前发出、仍在执行的请求数，其结果不推进熔断器状态
+        self.probing = False        # 半开状态下发出的探测请求正在执行
+        self._last_update = time.monotonic()
+    
+    def _decay(self, now: float):
+        elapsed = max(0.0, now - self._last_update)
+        if elapsed:
+            factor = 0.5 ** (elapsed / self.config["half_life"])
+            self.error_weight *= factor
+            self.total_weight *= factor
+            self._last_update = now
+    
+    def error_rate(self, now: float = None) -> float:
+        """时间衰减后的错误率"""
+        self._decay(now or time.monotonic())
+        return self.error_weight / self.total_weight if self.total_weight else 0.0
+    
+    def lease_started(self):
+        """占用密钥时调用；半开状态只放行一个请求，此时发出的请求即为探测请求"""
+        self.leases += 1
+        if self.state == self.HALF_OPEN:
+            self.probing = True
+    
+    def lease_finished(self) -> bool:
+        """请求结束时调用，返回其结果能否推进熔断器状态
+        
+        熔断时仍在执行的请求先于探测请求结束（半开状态要等它们都结束才放行探测），
+        因此按数量即可区分：它们的结果只计入错误率，只有探测请求的结果决定恢复或再次熔断。
+        """
+        self.leases = max(0, self.leases - 1)
+        if self.stale_leases:
+            self.stale_leases -= 1
+            return False
+        self.probing = False
+        return True
+    
+    def record(self, success: bool, latency: float = None, now: float = None, transition: bool = True):
+        """记录一次请求结果；transition为False时（熔断前发出的请求）只更新错误率与延迟"""
+        now = now or time.monotonic()
+        self._decay(now)
+        self.total_weight += 1.0
+        if latency is not None:
+            alpha = self.config["latency_alpha"]
+            self.latency = latency if self.latency is None else (1 - alpha) * self.latency + alpha * latency
+        
+        if not transition:
+            if not success:
+                self.error_weight += 1.0
+            return
+        if success:
+            self.consecutive_failures = 0
+            if self.state == self.HALF_OPEN:
+                # 探测成功，恢复正常
+                self.state = self.CLOSED
+                self.open_seconds = self.config["open_seconds"]
+            return
+        
+        self.error_weight += 1.0
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN:
+            # 探测失败，熔断时长翻倍
+            self.open_seconds = min(self.open_seconds * 2, self.config["max_open_seconds"])
+            self._trip(now)
+        elif self.state == self.CLOSED and (
+                self.consecutive_failures >= self.config["failure_threshold"] or
+                (self.total_weight >= self.config["min_samples"] and
+                 self.error_weight / self.total_weight >= self.config["error_rate_threshold"])):
+            self._trip(now)
+    
+    def _trip(self, now: float):
+        self.state = self.OPEN
+        self.open_until = now + self.open_seconds
+        self.trips += 1
+        self.stale_leases = self.leases
+    
+    def try_half_open(self, now: float) -> bool:
+        """熔断时间已过则进入半开状态，返回是否发生了状态变化"""
+        if self.state == self.OPEN and now >= self.open_until:
+            self.state = self.HALF_OPEN
+            return True
+        return False
+    
+    def to_dict(self, now: float = None) -> dict:
+        now = now or time.monotonic()
+        return {
+            "state": self.state,
+            "error_rate": round(self.error_rate(now), 4),
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "open_remaining": round(max(0.0, self.open_until - now), 1) if self.state == self.OPEN else 0,
+            "trips": self.trips
+        }
+
+class TokenBucket:
+    """令牌桶限流：每秒补充rate个令牌，最多积累burst个；可选每日配额（按本地自然日重置）"""
+    
+    def __init__(self, rate: float = None, burst: float = None, daily_quota: int = None):
+        self.rate = float(rate) if rate else None
+        self.burst = float(burst) if burst else (max(1.0, self.rate) if self.rate else None)
+        self.daily_quota = int(daily_quota) if daily_quota else None
+        self.tokens = self.burst
+        self.daily_used = 0
+        self._day = time.localtime().tm_yday
+        self._last_refill = time.monotonic()
+    
+    @classmethod
+    def from_key_info(cls, key_info: dict):
+        """根据API_KEY_POOL条目中的qps/burst/daily_quota创建限流器"""
+        return cls(key_info.get("qps"), key_info.get("burst"), key_info.get("daily_quota"))
+    
+    def _refill(self, now: float):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        today = time.localtime().tm_yday
+        if today != self._day:
+            self._day = today
+            self.daily_used = 0
+    
+    def try_consume(self, now: float = None) -> bool:
+        """尝试消耗一个令牌"""
+        now = now or time.monotonic()
+        self._refill(now)
+        if self.daily_quota is not None and self.daily_used >= self.daily_quota:
+            return False
+        if self.rate:
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+        self.daily_used += 1
+        return True
+    
+    def next_available(self, now: float = None) -> float:
+        """下一个令牌可用的时间（time.monotonic时间轴）"""
+        now = now or time.monotonic()
+        self._refill(now)
+        if self.daily_quota is not None and self.daily_used >= self.daily_quota:
+            # 每日配额用尽，等到本地次日零点
+            return now + _seconds_until_midnight()
+        if self.rate and self.tokens < 1.0:
+            return now + (1.0 - self.tokens) / self.rate
+        return now
+    
+    def to_dict(self) -> dict:
+        self._refill(time.monotonic())
+        return {
+            "qps": self.rate,
+            "burst": self.burst,
+            "tokens": round(self.tokens, 2) if self.rate else None,
+            "daily_quota": self.daily_quota,
+            "daily_used": self.daily_used
+        }
+
+class KeyPoolTimeout(Exception):
+    """等待可用密钥超时"""
+
+class _KeyWaiter:
+    """等待密钥的请求（同步请求使用threading.Event，异步请求使用Future）"""
+    
+    __slots__ = ("key_index", "loop", "event", "future")
+    
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self.key_index = None
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+    
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._set_future)
+    
+    def _set_future(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
 class APIKeyPool:
-    """API密钥池管理类"""
+    """API密钥池管理类
     
-    def __init__(self, key_pool):
+    所有状态变更都在同一把线程锁内完成，可同时被多个线程和协程安全使用。
+    最优密钥通过最小堆维护：评分只在请求开始/结束时更新（O(log n)），
+    选择时直接取堆顶（均摊O(1)），过期的堆条目通过版本号惰性丢弃。
+    评分使用时间衰减的错误率；熔断中或令牌桶耗尽的密钥暂存在按恢复时间排序的堆中，
+    熔断到期后进入半开状态，只放行一个探测请求。
+    
+    推荐使用acquire/release（或lease/lease_async上下文管理器）占用密钥：
+    所有密钥都达到并发上限时按先来先服务排队等待，而不是超额使用密钥。
+    """
+    
+    def __init__(self, key_pool, health_config: dict = None):
         self.key_pool = [key for key in key_pool if key.get('enabled', True)]
         self.current_index = 0
         self.usage_stats = {i: {"requests": 0, "errors": 0, "concurrent": 0} 
                            for i in range(len(self.key_pool))}
-        self._lock = asyncio.Lock() if hasattr(asyncio, 'Lock') else None
+        self.health = [KeyHealth(health_config) for _ in self.key_pool]
+        self.rate_limiters = [TokenBucket.from_key_info(key) for key in self.key_pool]
+        # 因令牌桶耗尽而暂停的密钥恢复时间
+        self._limited_until = [0.0] * len(self.key_pool)
+        self._lock = threading.RLock()
+        # 堆条目为 (评分, 密钥索引, 版本号)，版本号与_versions不一致的条目已过期
+        self._versions = [0] * len(self.key_pool)
+        self._heap = []
+        # 暂不可用（熔断中）的密钥：(恢复时间, 密钥索引, 版本号)
+        self._parked = []
+        # 等待可用密钥的请求队列（FIFO）
+        self._waiters = deque()
+        self._acquire_timeouts = 0
+        with self._lock:
+            for i in range(len(self.key_pool)):
+                self._update_key_locked(i)
+    
+    def _max_concurrent(self, key_index):
+        if self.health[key_index].state == KeyHealth.HALF_OPEN:
+            # 半开状态只放行一个探测请求
+            return 1
+        return self.key_pool[key_index].get("max_concurrent", 10)
+    
+    def _score_locked(self, key_index):
+        """计算评分（衰减错误率 + 并发负载），越低越好"""
+        stats = self.usage_stats[key_index]
+        error_rate = self.health[key_index].error_rate()
+        concurrent_load = stats["concurrent"] / self._max_concurrent(key_index)
+        return error_rate * 0.7 + concurrent_load * 0.3
+    
+    def _update_key_locked(self, key_index):
+        """密钥状态变化后重新入堆；达到并发限制的密钥不入堆，熔断或限流中的密钥暂存到_parked"""
+        self._versions[key_index] += 1
+        version = self._versions[key_index]
+        health = self.health[key_index]
+        if health.state == KeyHealth.OPEN:
+            heapq.heappush(self._parked, (health.open_until, key_index, version))
+        elif self._limited_until[key_index] > time.monotonic():
+            heapq.heappush(self._parked, (self._limited_until[key_index], key_index, version))
+        elif self.usage_stats[key_index]["concurrent"] < self._max_concurrent(key_index):
+            heapq.heappush(self._heap, (self._score_locked(key_index), key_index, version))
+        # 过期条目过多时重建，避免堆无限增长
+        limit = 4 * len(self.key_pool) + 16
+        if len(self._heap) > limit:
+            self._heap = [entry for entry in self._heap
+                          if entry[2] == self._versions[entry[1]]]
+            heapq.heapify(self._heap)
+        if len(self._parked) > limit:
+            self._parked = [entry for entry in self._parked
+                            if entry[2] == self._versions[entry[1]]]
+            heapq.heapify(self._parked)
+    
+    def _unpark_locked(self, now: float):
+        """把恢复时间已到的密钥移回可选堆"""
+        while self._parked and self._parked[0][0] <= now:
+            _, key_index, version = heapq.heappop(self._parked)
+            if version != self._versions[key_index]:
+                continue
+            self.health[key_index].try_half_open(now)
+            self._update_key_locked(key_index)
+    
+    def _next_wakeup_locked(self):
+        """下一个暂停密钥的恢复时间，没有则返回None"""
+        while self._parked:
+            available_at, key_index, version = self._parked[0]
+            if version == self._versions[key_index]:
+                return available_at
+            heapq.heappop(self._parked)
+        return None
+    
+    def _peek_best_locked(self):
+        """返回当前最优且未饱和的密钥索引，没有则返回None"""
+        self._unpark_locked(time.monotonic())
+        while self._heap:
+            _, key_index, version = self._heap[0]
+            if version == self._versions[key_index]:
+                return key_index
+            heapq.heappop(self._heap)
+        return None
         
     def get_next_key(self):
         """获取下一个可用的API密钥（轮询方式）"""
         if not self.key_pool:
             raise Exception("没有可用的API密钥")
-            
-        # 轮询选择
-        key_info = self.key_pool[self.current_index]
-        stats = self.usage_stats[self.current_index]
-        
-        # 检查并发限制
-        if stats["concurrent"] >= key_info.get("max_concurrent", 10):
-            # 尝试下一个密钥
-            original_index = self.current_index
-            while True:
-                self.current_index = (self.current_index + 1) % len(self.key_pool)
-                if self.current_index == original_index:
-                    # 所有密钥都达到并发限制
-                    break
-                    
-                key_info = self.key_pool[self.current_index]
-                stats = self.usage_stats[self.current_index]
-                if stats["concurrent"] < key_info.get("max_concurrent", 10):
-                    break
         
-        return self.current_index, key_info
+        with self._lock:
+            # 轮询选择
+            key_info = self.key_pool[self.current_index]
+            stats = self.usage_stats[self.current_index]
+            
+            # 检查并发限制
+            if stats["concurrent"] >= key_info.get("max_concurrent", 10):
+                # 尝试下一个密钥
+                original_index = self.current_index
+                while True:
+                    self.current_index = (self.current_index + 1) % len(self.key_pool)
+                    if self.current_index == original_index:
+                        # 所有密钥都达到并发限制
+                        break
+                        
+                    key_info = self.key_pool[self.current_index]
+                    stats = self.usage_stats[self.current_index]
+                    if stats["concurrent"] < key_info.get("max_concurrent", 10):
+                        break
+            
+            return self.current_index, key_info
     
     def get_best_key(self):
         """获取最优密钥（基于错误率和并发数）"""
         if not self.key_pool:
             raise Exception("没有可用的API密钥")
-            
-        best_index = 0
-        best_score = float('inf')
         
-        for i, key_info in enumerate(self.key_pool):
-            stats = self.usage_stats[i]
-            
-            # 跳过达到并发限制的密钥
-            if stats["concurrent"] >= key_info.get("max_concurrent", 10):
-                continue
-                
-            # 计算评分（错误率 + 并发负载）
-            error_rate = stats["errors"] / max(stats["requests"], 1)
-            concurrent_load = stats["concurrent"] / key_info.get("max_concurrent", 10)
-            score = error_rate * 0.7 + concurrent_load * 0.3
-            
-            if score < best_score:
-                best_score = score
-                best_index = i
-                
-        return best_index, self.key_pool[best_index]
+        with self._lock:
+            best_index = self._peek_best_locked()
+            if best_index is None:
+                # 所有密钥都达到并发限制
+                best_index = 0
+            return best_index, self.key_pool[best_index]
     
-    def mark_request_start(self, key_index):
-        """标记请求开始"""
+    def _mark_start_locked(self, key_index):
         self.usage_stats[key_index]["requests"] += 1
         self.usage_stats[key_index]["concurrent"] += 1
+        self.health[key_index].lease_started()
+        self._update_key_locked(key_index)
+    
+    def _try_take_locked(self, exclude=None):
+        """尝试占用最优密钥（需同时有并发名额和令牌），成功返回密钥索引，否则返回None
+        
+        exclude为需要跳过的密钥索引集合（如对冲请求需避开主请求所用密钥）。
+        """
+        skipped = []
+        try:
+            while True:
+                key_index = self._peek_best_locked()
+                if key_index is None:
+                    return None
+                if exclude and key_index in exclude:
+                    skipped.append(heapq.heappop(self._heap))
+                    continue
+                now = time.monotonic()
+                limiter = self.rate_limiters[key_index]
+                if limiter.try_consume(now):
+                    self._mark_start_locked(key_index)
+                    return key_index
+                # 令牌耗尽：暂停该密钥直到下一个令牌可用，继续尝试次优密钥
+                self._limited_until[key_index] = limiter.next_available(now)
+                self._update_key_locked(key_index)
+        finally:
+            for entry in skipped:
+                heapq.heappush(self._heap, entry)
+    
+    def _dispatch_locked(self):
+        """有空闲容量时按FIFO顺序唤醒等待者，并直接把密钥交给它"""
+        while self._waiters:
+            key_index = self._try_take_locked()
+            if key_index is None:
+                break
+            waiter = self._waiters.popleft()
+            waiter.key_index = key_index
+            waiter.wake()
+    
+    def mark_request_start(self, key_index):
+        """标记请求开始"""
+        with self._lock:
+            self._mark_start_locked(key_index)
+        
+    def mark_request_end(self, key_index, success=True, latency: float = None):
+        """标记请求结束（latency为请求耗时，单位秒）"""
+        with self._lock:
+            self.usage_stats[key_index]["concurrent"] = max(0, 
+                self.usage_stats[key_index]["concurrent"] - 1)
+            if not success:
+                self.usage_stats[key_index]["errors"] += 1
+            previous_state = self.health[key_index].state
+            transition = self.health[key_index].lease_finished()
+            self.health[key_index].record(success, latency, transition=transition)
+            if previous_state != KeyHealth.OPEN and self.health[key_index].state == KeyHealth.OPEN:
+                print(f"密钥 {self.key_pool[key_index].get('name', key_index)} 错误过多，"
+                      f"熔断 {self.health[key_index].open_seconds:g} 秒")
+            self._update_key_locked(key_index)
+            self._dispatch_locked()
+    
+    def release_unrecorded(self, key_index):
+        """归还密钥但不记录健康样本（请求未执行或被调用方取消，结果与密钥好坏无关）"""
+        with self._lock:
+            self.usage_stats[key_index]["concurrent"] = max(0,
+                self.usage_stats[key_index]["concurrent"] - 1)
+            self.health[key_index].lease_finished()
+            self._update_key_locked(key_index)
+            self._dispatch_locked()
+    
+    def penalize(self, key_index, seconds: float):
+        """上游返回流控错误时，让密钥暂停seconds秒不参与选择"""
+        with self._lock:
+            self._limited_until[key_index] = max(self._limited_until[key_index],
+                                                 time.monotonic() + seconds)
+            self._update_key_locked(key_index)
+    
+    def try_acquire(self, exclude=None):
+        """非阻塞地占用密钥（可排除指定密钥），无可用密钥或已有排队者时返回None"""
+        with self._lock:
+            if not self.key_pool or self._waiters:
+                return None
+            key_index = self._try_take_locked(exclude)
+            if key_index is None:
+                return None
+            return key_index, self.key_pool[key_index]
+    
+    def _acquire_fast_locked(self):
+        """没有排队者时直接占用密钥（排队者优先，保证公平）"""
+        if not self.key_pool:
+            raise Exception("没有可用的API密钥")
+        if self._waiters:
+            return None
+        return self._try_take_locked()
+    
+    def _on_timeout_locked(self, waiter, timeout):
+        """等待超时：若已被分配密钥则视为成功，否则移出队列并报错"""
+        if waiter.key_index is not None:
+            return
+        self._waiters.remove(waiter)
+        self._acquire_timeouts += 1
+        raise KeyPoolTimeout(f"等待可用密钥超时（{timeout}秒），所有密钥均已达到并发上限、限流或熔断")
+    
+    def _wait_interval_locked(self, deadline):
+        """等待者下一次需要醒来重新检查的间隔：截止时间或最近的密钥恢复时间"""
+        now = time.monotonic()
+        wakeups = [t for t in (deadline, self._next_wakeup_locked()) if t is not None]
+        if not wakeups:
+            return None
+        return max(0.0, min(wakeups) - now)
+    
+    def _poll_waiter_locked(self, waiter, deadline, timeout):
+        """检查等待者状态：已分配密钥返回None，超时抛出KeyPoolTimeout，否则返回下次等待间隔"""
+        self._dispatch_locked()
+        if waiter.key_index is not None:
+            return None
+        if deadline is not None and time.monotonic() >= deadline:
+            self._on_timeout_locked(waiter, timeout)
+        interval = self._wait_interval_locked(deadline)
+        # 没有截止时间也没有待恢复的密钥时无限等待
+        return interval if interval is not None else -1
+    
+    def acquire(self, timeout: float = None):
+        """占用一个密钥（同步），密钥全部饱和时阻塞等待，超时抛出KeyPoolTimeout
         
-    def mark_request_end(self, key_index, success=True):
-        """标记请求结束"""
-        self.usage_stats[key_index]["concurrent"] = max(0, 
-            self.usage_stats[key_index]["concurrent"] - 1)
-        if not success:
-            self.usage_stats[key_index]["errors"] += 1
+        返回 (key_index, key_info)，使用完毕后必须调用release。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            key_index = self._acquire_fast_locked()
+            if key_index is not None:
+                return key_index, self.key_pool[key_index]
+            waiter = _KeyWaiter()
+            self._waiters.append(waiter)
+        
+        while True:
+            with self._lock:
+                interval = self._poll_waiter_locked(waiter, deadline, timeout)
+            if interval is None:
+                break
+            waiter.event.wait(None if interval < 0 else interval)
+        return waiter.key_index, self.key_pool[waiter.key_index]
+    
+    async def acquire_async(self, timeout: float = None):
+        """占用一个密钥（异步），等待期间不阻塞事件循环"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            key_index = self._acquire_fast_locked()
+            if key_index is not None:
+                return key_index, self.key_pool[key_index]
+            waiter = _KeyWaiter(asyncio.get_running_loop())
+            self._waiters.append(waiter)
+        
+        try:
+            while True:
+                with self._lock:
+                    interval = self._poll_waiter_locked(waiter, deadline, timeout)
+                if interval is None:
+                    break
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future),
+                                           None if interval < 0 else interval)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.key_index is None:
+                    self._waiters.remove(waiter)
+            if waiter.key_index is not None:
+                # 已分配到密钥但调用方被取消，归还密钥（请求未执行，不计入健康度）
+                self.release_unrecorded(waiter.key_index)
+            raise
+        return waiter.key_index, self.key_pool[waiter.key_index]
+    
+    def release(self, key_index, success=True, latency: float = None):
+        """归还通过acquire占用的密钥"""
+        self.mark_request_end(key_index, success=success, latency=latency)
+    
+    @contextmanager
+    def lease(self, timeout: float = None):
+        """同步上下文管理器：with pool.lease() as (key_index, key_info)"""
+        key_index, key_info = self.acquire(timeout)
+        success = False
+        try:
+            yield key_index, key_info
+            success = True
+        finally:
+            self.release(key_index, success=success)
+    
+    @asynccontextmanager
+    async def lease_async(self, timeout: float = None):
+        """异步上下文管理器：async with pool.lease_async() as (key_index, key_info)"""
+        key_index, key_info = await self.acquire_async(timeout)
+        success = False
+        try:
+            yield key_index, key_info
+            success = True
+        except asyncio.CancelledError:
+            # 调用方取消不计入密钥健康度
+            self.release_unrecorded(key_index)
+            key_index = None
+            raise
+        finally:
+            if key_index is not None:
+                self.release(key_index, success=success)
             
     def get_stats(self):
         """获取使用统计"""
+        with self._lock:
+            self._unpark_locked(time.monotonic())
+            usage_stats = {i: dict(stats) for i, stats in self.usage_stats.items()}
+            health = [h.to_dict() for h in self.health]
+            rate_limits = [limiter.to_dict() for limiter in self.rate_limiters]
+            waiting = len(self._waiters)
+            acquire_timeouts = self._acquire_timeouts
         return {
             "total_keys": len(self.key_pool),
             "active_keys": len([k for k in self.key_pool if k.get('enabled', True)]),
-            "usage_stats": self.usage_stats,
+            "waiting": waiting,
+            "acquire_timeouts": acquire_timeouts,
+            "usage_stats": usage_stats,
             "key_info": [{"name": k.get("name", f"密钥{i}"), 
-                         "concurrent": self.usage_stats[i]["concurrent"],
-                         "max_concurrent": k.get("max_concurrent", 10)} 
+                         "concurrent": usage_stats[i]["concurrent"],
+                         "max_concurrent": k.get("max_concurrent", 10),
+                         "health": health[i],
+                         "rate_limit": rate_limits[i]} 
                         for i, k in enumerate(self.key_pool)]
         }
 
-class AIPPTClient:
-    """讯飞智文PPT生成客户端 - 支持API密钥池"""
+# 重试配置
+RETRY_CONFIG = {
+    "max_attempts": 3,              # 单次调用最多尝试次数（含首次）
+    "base_delay": 0.5,              # 指数退避的初始等待（秒）
+    "max_delay": 8.0,               # 单次退避等待上限（秒）
+    "deadline": 120.0,              # 单次工具调用的总时限（秒），包含请求与退避；从工作池放行时开始计时，排队另受queue_timeout约束
+    "budget_ratio": 0.2,            # 进程级重试预算：每个请求允许0.2次重试
+    "budget_min_per_second": 1.0,   # 低流量时的保底重试额度（每秒）
+    "budget_max_tokens": 100.0      # 重试预算上限
+}
+
+class CallDeadline:
+    """一次工具调用的总时限，调用中的所有上游请求共用
     
-    def __init__(self, key_pool=None):
-        self.key_pool_manager = APIKeyPool(key_pool or API_KEY_POOL)
-        self.base_url = "https://zwapi.xfyun.cn/api/ppt/v2"
-        self.max_retries = 3  # 最大重试次数
+    在工作池放行调用时开始计时（排队时间不计入，排队另受queue_timeout约束）；
+    未经工作池直接发出的请求在第一次使用时开始计时。
+    """
+    
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = None
+    
+    def start(self):
+        if self.expires_at is None:
+            self.expires_at = time.monotonic() + self.budget
+    
+    def expires(self) -> float:
+        """截止时间（time.monotonic()），尚未开始计时则从现在开始"""
+        self.start()
+        return self.expires_at
+
+# 当前工具调用的总时限（CallDeadline）：在工具调用入口设置一次，
+# 调用中的每个重试循环取它与自身时限中较早者，多次上游请求共用同一个总时限
+_call_deadline: contextvars.ContextVar = contextvars.ContextVar("call_deadline", default=None)
+
+def _detached(func, *args):
+    """在空上下文中调用func：其中创建的长期后台任务不继承当前工具调用的截止时间等上下文"""
+    return contextvars.Context().run(func, *args)
+
+# 讯飞开放平台通用错误码
+# 流控类错误：换一个密钥重试，并让当前密钥暂停一段时间（秒，None表示到次日零点）
+RATE_LIMIT_CODES = {
+    11201: None,    # 日流控超限
+    11202: 1.0,     # 秒级流控超限
+    11203: 1.0      # 并发流控超限
+}
+# 密钥本身的问题（如授权错误）：记为密钥错误并换密钥重试
+KEY_ERROR_CODES = {11200}
+# 其他可安全重试的业务错误码（默认无，按需添加）
+RETRYABLE_API_CODES = set()
+
+class UpstreamHTTPError(Exception):
+    """上游返回5xx、429或响应体不是JSON的4xx等非业务错误"""
+    
+    def __init__(self, status_code: int, message: str = ""):
+        super().__init__(f"上游HTTP错误 {status_code}: {message[:200]}")
+        self.status_code = status_code
+
+class RequestDeadlineExceeded(Exception):
+    """单次调用超过总时限"""
+
+def _seconds_until_midnight() -> float:
+    """距离本地次日零点的秒数"""
+    local = time.localtime()
+    return 86400 - (local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec)
+
+class RetryBudget:
+    """进程级重试预算：每个请求存入ratio个令牌，每次重试消耗1个令牌，
+    同时按min_per_second保底补充，避免上游故障时重试流量把故障放大。"""
+    
+    def __init__(self, ratio: float, min_per_second: float, max_tokens: float):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "exhausted": 0}
+    
+    def record_request(self):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+    
+    def try_spend(self) -> bool:
+        """申请一次重试，预算不足时返回False"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.max_tokens,
+                              self.tokens + (now - self._last_refill) * self.min_per_second)
+            self._last_refill = now
+            if self.tokens < 1.0:
+                self.stats["exhausted"] += 1
+                return False
+            self.tokens -= 1.0
+            self.stats["retries"] += 1
+            return True
+    
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "tokens": round(self.tokens, 2)}
+
+# 全进程共享的重试预算
+retry_budget = RetryBudget(RETRY_CONFIG["budget_ratio"], RETRY_CONFIG["budget_min_per_second"],
+                           RETRY_CONFIG["budget_max_tokens"])
+
+RetryOutcome = namedtuple("RetryOutcome", ["kind", "reason", "penalty"])
+
+class RetryPolicy:
+    """重试策略：按响应code/异常类型分类，计算带抖动的指数退避
+    
+    分类结果（RetryOutcome.kind）：
+    - success：成功
+    - fatal：不可重试（参数错误等），直接返回响应或抛出异常
+    - transient：网络错误、5xx、429等暂时性故障，退避后重试，计入密钥错误
+    - rate_limited：讯飞流控，暂停当前密钥并换密钥重试，不计入密钥错误
+    - key_error：密钥授权错误，计入密钥错误并换密钥重试
+    """
+    
+    SUCCESS = "success"
+    FATAL = "fatal"
+    TRANSIENT = "transient"
+    RATE_LIMITED = "rate_limited"
+    KEY_ERROR = "key_error"
+    
+    def __init__(self, config: dict = None, budget: RetryBudget = None):
+        config = {**RETRY_CONFIG, **(config or {})}
+        self.max_attempts = int(config["max_attempts"])
+        self.base_delay = float(config["base_delay"])
+        self.max_delay = float(config["max_delay"])
+        self.deadline = float(config["deadline"])
+        self.budget = budget or retry_budget
+    
+    def classify(self, result: dict = None, error: Exception = None) -> RetryOutcome:
+        """对一次请求的结果分类"""
+        if error is not None:
+            if isinstance(error, (httpx.TransportError, requests.ConnectionError, requests.Timeout)):
+                return RetryOutcome(self.TRANSIENT, f"网络错误: {error!r}", 0)
+            if isinstance(error, UpstreamHTTPError):
+                if error.status_code == 429:
+                    return RetryOutcome(self.RATE_LIMITED, str(error), 1.0)
+                if error.status_code < 500:
+                    # 其他4xx为客户端错误，重试也不会成功
+                    return RetryOutcome(self.FATAL, str(error), 0)
+                return RetryOutcome(self.TRANSIENT, str(error), 0)
+            if isinstance(error, ValueError) and not isinstance(error, json.JSONDecodeError):
+                return RetryOutcome(self.FATAL, str(error), 0)
+            if isinstance(error, json.JSONDecodeError):
+                return RetryOutcome(self.TRANSIENT, f"响应不是合法JSON: {error}", 0)
+            return RetryOutcome(self.FATAL, str(error), 0)
         
-    def _get_signature(self, app_id: str, api_secret: str, timestamp: int) -> str:
-        """生成API签名"""
+        code = result.get("code") if isinstance(result, dict) else None
+        if code == 0:
+            return RetryOutcome(self.SUCCESS, "", 0)
+        desc = f"code={code} {result.get('desc', '') if isinstance(result, dict) else ''}"
+        if code in RATE_LIMIT_CODES:
+            penalty = RATE_LIMIT_CODES[code]
+            return RetryOutcome(self.RATE_LIMITED, desc,
+                                _seconds_until_midnight() if penalty is None else penalty)
+        if code in KEY_ERROR_CODES:
+            return RetryOutcome(self.KEY_ERROR, desc, 0)
+        if code in RETRYABLE_API_CODES:
+            return RetryOutcome(self.TRANSIENT, desc, 0)
+        return RetryOutcome(self.FATAL, desc, 0)
+    
+    def request_deadline(self) -> float:
+        """本次请求的截止时间：自身时限与当前工具调用截止时间中较早者"""
+        deadline = time.monotonic() + self.deadline
+        call_deadline = _call_deadline.get()
+        return deadline if call_deadline is None else min(deadline, call_deadline.expires())
+    
+    def backoff_delay(self, attempt: int, outcome: RetryOutcome) -> float:
+        """第attempt次失败后的等待时间：full jitter指数退避；换密钥类错误只做短暂抖动"""
+        if outcome.kind in (self.RATE_LIMITED, self.KEY_ERROR):
+            return random.uniform(0, self.base_delay / 5)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+    
+    def settle_key(self, pool: "APIKeyPool", key_index: int, outcome: RetryOutcome, latency: float):
+        """根据分类结果归还密钥并更新其健康度"""
+        key_fault = outcome.kind in (self.TRANSIENT, self.KEY_ERROR)
+        pool.release(key_index, success=not key_fault, latency=latency)
+        if outcome.kind == self.RATE_LIMITED and outcome.penalty:
+            pool.penalize(key_index, outcome.penalty)
+
+# 对冲请求配置（仅用于get_theme_list、get_task_progress等幂等读请求）
+HEDGE_CONFIG = {
+    "enabled": False,               # 是否启用对冲
+    "delay": None,                  # 发出对冲请求前的等待时间（秒），None表示取近期延迟的分位数
+    "percentile": 0.9,              # delay为None时使用的延迟分位数
+    "min_delay": 0.05,              # 对冲等待时间下限（秒）
+    "min_samples": 20,              # 计算分位数所需的最少样本，不足时不对冲
+    "window": 200,                  # 延迟统计窗口（最近N次请求）
+    "max_hedge_ratio": 0.1,         # 对冲请求数不超过请求数的10%
+    "max_burst": 5                  # 对冲预算上限，限制突发对冲
+}
+
+class LatencyTracker:
+    """最近请求延迟的滑动窗口，用于计算分位数"""
+    
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+    
+    def record(self, latency: float):
+        self._samples.append(latency)
+    
+    def percentile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        if len(self._samples) < max(1, min_samples):
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+# 任务进度查询调度配置
+PROGRESS_SCHEDULER_CONFIG = {
+    "freshness": 1.0,               # 该时间（秒）内的查询结果直接复用，不再请求上游
+    "max_in_flight": None           # 同时进行的上游进度查询数，None表示启用密钥数的2倍
+}
+
+class _ProgressEntry:
+    """调度器中单个sid的状态"""
+    __slots__ = ("future", "due", "dispatched", "result", "fetched_at")
+    
+    def __init__(self):
+        self.future: Optional[asyncio.Future] = None
+        self.due = 0.0
+        self.dispatched = False
+        self.result: Optional[dict] = None
+        self.fetched_at = 0.0
+
+class ProgressScheduler:
+    """任务进度查询调度器
+    
+    待查询的sid按到期时间放入优先队列，由单个调度协程按到期顺序发出上游请求；
+    同一sid的重复查询（不论来自哪个会话）合并为一次上游请求，较早的查询会把到期时间提前。
+    同时进行的上游查询数受限，密钥池按负载挑选密钥，使查询均匀分布到各密钥上。
+    """
+    
+    def __init__(self, fetch, freshness: float = 1.0, max_in_flight: int = 4):
+        self.fetch = fetch
+        self.freshness = freshness
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._loop = None
+        self._stats = {"requests": 0, "upstream": 0, "coalesced": 0, "fresh_hits": 0, "errors": 0}
+        self._reset()
+    
+    def _reset(self):
+        self._entries: dict[str, _ProgressEntry] = {}
+        self._heap: list = []
+        self._seq = 0
+        self._in_flight = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+    
+    def _ensure_dispatcher(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 事件循环变化（如测试中多次asyncio.run）时重建调度状态
+            self._loop = loop
+            self._reset()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            # 调度循环为所有调用方服务，不受首个调用方的截止时间约束
+            self._dispatcher = _detached(asyncio.ensure_future, self._dispatch_loop())
+    
+    async def poll(self, sid: str, delay: float = 0.0) -> dict:
+        """查询任务进度（delay秒后到期），与同一sid的其他查询共享一次上游请求"""
+        self._ensure_dispatcher()
+        self._stats["requests"] += 1
+        now = time.monotonic()
+        entry = self._entries.get(sid)
+        if entry is None:
+            entry = self._entries[sid] = _ProgressEntry()
+        
+        if entry.future is None:
+            if delay <= 0 and entry.result is not None and now - entry.fetched_at < self.freshness:
+                self._stats["fresh_hits"] += 1
+                return entry.result
+            entry.future = self._loop.create_future()
+            # 调用方都取消时避免"exception was never retrieved"警告
+            entry.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            entry.dispatched = False
+            self._schedule(sid, entry, now + max(0.0, delay))
+        else:
+            self._stats["coalesced"] += 1
+            if not entry.dispatched and now + max(0.0, delay) < entry.due:
+                self._schedule(sid, entry, now + max(0.0, delay))
+        return await asyncio.shield(entry.future)
+    
+    def _schedule(self, sid: str, entry: _ProgressEntry, due: float):
+        # 旧的堆元素到期时间与entry.due不一致，出堆时会被跳过
+        entry.due = due
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, sid))
+        self._wakeup.set()
+    
+    async def _dispatch_loop(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            due, _, sid = self._heap[0]
+            entry = self._entries.get(sid)
+            if entry is None or entry.future is None or entry.dispatched or entry.due != due:
+                heapq.heappop(self._heap)
+                continue
+            wait = due - time.monotonic()
+            if wait > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._slots.acquire()
+            if not self._heap or self._heap[0][2] != sid or entry.due != due:
+                # 等待名额期间队首发生变化，重新选择
+                self._slots.release()
+                continue
+            heapq.heappop(self._heap)
+            entry.dispatched = True
+            self._in_flight += 1
+            asyncio.ensure_future(self._run(sid, entry))
+    
+    async def _run(self, sid: str, entry: _ProgressEntry):
+        future = entry.future
+        self._stats["upstream"] += 1
         try:
-            # 对app_id和时间戳进行MD5加密
-            auth = self._md5(app_id + str(timestamp))
-            # 使用HMAC-SHA1算法对加密后的字符串进行加密
-            return self._hmac_sha1_encrypt(auth, api_secret)
+            result = await self.fetch(sid)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
         except Exception as e:
-            raise Exception(f"签名生成失败: {e}")
-    
-    def _hmac_sha1_encrypt(self, encrypt_text: str, encrypt_key: str) -> str:
-        """HMAC-SHA1加密"""
-        return base64.b64encode(
-            hmac.new(
-                encrypt_key.encode('utf-8'),
-                encrypt_text.encode('utf-8'),
-                hashlib.sha1
-            ).digest()
-        ).decode('utf-8')
+            self._stats["errors"] += 1
+            future.set_exception(e)
+        else:
+            entry.result = result
+            entry.fetched_at = time.monotonic()
+            future.set_result(result)
+            self._loop.call_later(max(self.freshness, 0.0) + 1.0, self._expire, sid, entry)
+        finally:
+            entry.future = None
+            entry.dispatched = False
+            self._in_flight -= 1
+            self._slots.release()
     
-    def _md5(self, text: str) -> str:
-        """MD5加密"""
-        return hashlib.md5(text.encode('utf-8')).hexdigest()
+    def _expire(self, sid: str, entry: _ProgressEntry):
+        """清理过期且无人等待的结果"""
+        if (self._entries.get(sid) is entry and entry.future is None
+                and time.monotonic() - entry.fetched_at >= self.freshness):
+            del self._entries[sid]
     
-    def _get_headers(self, key_info: dict, content_type: str = "application/json; charset=utf-8") -> dict:
-        """获取请求头"""
-        timestamp = int(time.time())
-        signature = self._get_signature(key_info["app_id"], key_info["api_secret"], timestamp)
+    def get_stats(self) -> dict:
         return {
-            "appId": key_info["app_id"],
-            "timestamp": str(timestamp),
-            "signature": signature,
-            "Content-Type": content_type
+            **self._stats,
+            "queued": sum(1 for e in self._entries.values() if e.future is not None and not e.dispatched),
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight
         }
+    
+    async def aclose(self):
+        if self._dispatcher is not None and not self._dispatcher.done():
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+        self._dispatcher = None
+
+# 本地缓存目录（模板目录索引等持久化数据）
+CACHE_DIR = os.environ.get("AIPPT_CACHE_DIR",
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+# 本地模板目录索引配置：后台抓取全部模板，get_theme_list直接在本地筛选分页
+TEMPLATE_CATALOG_CONFIG = {
+    "enabled": True,
+    "path": os.path.join(CACHE_DIR, "template_catalog.json"),  # 持久化文件，重启后直接加载
+    "page_size": 100,               # 抓取时每页数量
+    "refresh_interval": 6 * 3600,   # 定时增量刷新间隔（秒）
+    "full_refresh_every": 4         # 每4次刷新做1次全量抓取
+}
+
+# 大纲结果缓存配置：相同内容（文本/文档）的大纲生成直接从本地磁盘返回
+OUTLINE_CACHE_CONFIG = {
+    "enabled": True,
+    "path": os.path.join(CACHE_DIR, "outlines"),
+    "max_bytes": 256 * 1024 * 1024,  # 缓存总大小上限，超出按最近访问时间淘汰
+    "max_age": None                  # 缓存有效期（秒，从写入时计算，读取不会延长），None表示不过期
+}
+
+# 文档上传配置（create_outline_by_doc）
+UPLOAD_CONFIG = {
+    "max_bytes": 10 * 1024 * 1024,  # 文档大小上限（讯飞智文限制10M）
+    "allowed_extensions": ("pdf", "doc", "docx", "txt", "md"),
+    "chunk_size": 64 * 1024         # 流式上传的分块大小
+}
+
+# 文档预处理配置：txt/md/docx先在本地提取文本，按文本方式生成大纲（不上传文件）
+DOC_PREPROCESS_CONFIG = {
+    "enabled": True,
+    "max_chars": 8000,              # 提交内容（text+文档）的字数上限（讯飞智文限制8000字）
+    "overflow": "error"             # 超长处理：error（直接拒绝）、truncate（截断）、condense（压缩）
+}
+
+# file_url预取配置：启用后由服务端下载文档，按内容去重并复用大纲缓存，再按本地文档处理
+DOC_PREFETCH_CONFIG = {
+    "enabled": False,               # 默认仍由讯飞智文直接拉取file_url；调用参数prefetch只能关闭预取，不能开启
+    "max_concurrent": 4,            # 同时进行的下载数
+    "timeout": 30.0,                # 单个文档的下载超时（秒）
+    "max_redirects": 5,             # 最多跟随的重定向次数（每一跳都重新检查地址）
+    "allowed_private_hosts": [],    # 允许下载的内网主机名（如内网文档服务器），其他内网与保留地址一律拒绝
+    "seen_entries": 1024            # 记录已处理文档内容指纹的数量（用于统计重复文档）
+}
+
+# 任务存储配置：记录已提交/排队的生成任务，服务重启后继续跟踪
+JOB_STORE_CONFIG = {
+    "enabled": True,
+    "path": os.path.join(CACHE_DIR, "jobs.sqlite3"),
+    "retention": 7 * 24 * 3600,     # 已结束任务的保留时间（秒）
+    "lease": 300.0                  # 排队任务的租约（秒）：所属进程运行期间定期续约，过期后其他进程才能接手
+}
+
+# 批量生成配置（create_ppt_batch）
+BATCH_CONFIG = {
+    "max_jobs": 500,                # 单次批量的任务数上限
+    "max_parallel": None,           # 同时进行的任务数，None表示所有启用密钥的max_concurrent之和
+    "job_timeout": 1800,            # 每个任务等待生成完成的最长时间（秒）
+    "poll_interval": 5.0            # 同步客户端查询进度的间隔（秒）
+}
+
+# 模板列表缓存配置
+THEME_CACHE_CONFIG = {
+    "enabled": True,
+    "ttl": 300,                     # 缓存有效期（秒）
+    "stale_ttl": 3600,              # 过期后仍可先返回旧值并后台刷新的时间（秒）
+    "max_entries": 256              # 最多缓存的查询条件组合数（LRU淘汰）
+}
+
+def _content_hash(*parts) -> str:
+    """按内容计算请求指纹（用于合并相同请求、缓存结果）"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class SingleFlight:
+    """合并相同的进行中请求：同一key的后到调用者直接等待首个调用的结果
+    
+    请求在独立的任务中执行，个别调用者取消不会影响其他等待同一结果的调用者。
+    """
+    
+    def __init__(self):
+        self._inflight: dict = {}
+        self._stats = {"calls": 0, "executed": 0, "upstream_calls_saved": 0}
+    
+    def in_flight(self, key) -> bool:
+        return key in self._inflight
+    
+    async def do(self, key, func):
+        """执行func()，同一key已有进行中的调用时共享其结果"""
+        self._stats["calls"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            self._stats["executed"] += 1
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self._stats["upstream_calls_saved"] += 1
+        return await asyncio.shield(task)
+    
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 所有调用者都已取消时避免"exception was never retrieved"警告
+        if not task.cancelled():
+            task.exception()
+    
+    def get_stats(self) -> dict:
+        return {**self._stats, "in_flight": len(self._inflight)}
+
+class AsyncTTLCache:
+    """异步TTL缓存：LRU淘汰，过期后在stale窗口内先返回旧值并后台刷新，
+    同一个key的并发未命中只加载一次"""
+    
+    def __init__(self, ttl: float, stale_ttl: float = 0.0, max_entries: int = 256,
+                 cacheable=None):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max(1, int(max_entries))
+        self.cacheable = cacheable or (lambda value: True)
+        self._data: OrderedDict = OrderedDict()  # key -> (value, stored_at)
+        self._flight = SingleFlight()
+        self._background: set = set()
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0,
+                       "refresh_errors": 0, "evictions": 0}
+    
+    async def get(self, key, loader):
+        """获取缓存值，未命中时调用loader()加载"""
+        entry = self._data.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age < self.ttl:
+                self._stats["hits"] += 1
+                self._data.move_to_end(key)
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self._stats["stale_hits"] += 1
+                self._data.move_to_end(key)
+                self._refresh_in_background(key, loader)
+                return value
+            del self._data[key]
+        self._stats["misses"] += 1
+        return await self._load(key, loader)
+    
+    async def _load(self, key, loader):
+        async def load_and_store():
+            value = await loader()
+            if self.cacheable(value):
+                self._store(key, value)
+            return value
         
-    def _make_request_with_retry(self, request_func, *args, **kwargs):
-        """带重试的请求执行"""
-        last_exception = None
+        return await self._flight.do(key, load_and_store)
+    
+    def _store(self, key, value):
+        self._data[key] = (value, time.monotonic())
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self._stats["evictions"] += 1
+    
+    def _refresh_in_background(self, key, loader):
+        if self._flight.in_flight(key):
+            return
+        self._stats["refreshes"] += 1
         
-        for attempt in range(self.max_retries):
+        async def refresh():
             try:
-                # 获取最优密钥
-                key_index, key_info = self.key_pool_manager.get_best_key()
-                
-                # 标记请求开始
-                self.key_pool_manager.mark_request_start(key_index)
-                
-                try:
-                    # 执行请求
-                    result = request_func(key_info, *args, **kwargs)
-                    
-                    # 标记请求成功
-                    self.key_pool_manager.mark_request_end(key_index, success=True)
-                    
-                    return result
-                    
-                except Exception as req_error:
-                    # 标记请求失败
-                    self.key_pool_manager.mark_request_end(key_index, success=False)
-                    
-                    # 如果是API限制错误，尝试其他密钥
-                    if "限制" in str(req_error) or "rate" in str(req_error).lower():
-                        print(f"密钥 {key_info.get('name', key_index)} 达到限制，尝试其他密钥...")
-                        continue
-                    else:
-                        raise req_error
-                        
-            except Exception as e:
-                last_exception = e
-                if attempt < self.max_retries - 1:
-                    print(f"请求失败 (尝试 {attempt + 1}/{self.max_retries}): {e}")
-                    time.sleep(1)  # 等待1秒后重试
-                else:
-                    print(f"所有重试均失败")
-                    
-        raise last_exception or Exception("请求失败，已达到最大重试次数")
+                await self._load(key, loader)
+            except Exception:
+                self._stats["refresh_errors"] += 1
+        
+        task = _detached(asyncio.ensure_future, refresh())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
     
-    def get_pool_stats(self):
-        """获取密钥池统计信息"""
-        return self.key_pool_manager.get_stats()
+    def invalidate(self, key=None):
+        """清除指定key或全部缓存"""
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
     
-    def get_theme_list(self, pay_type: str = "not_free", style: str = None, 
-                      color: str = None, industry: str = None, 
-                      page_num: int = 1, page_size: int = 10) -> dict:
-        """获取PPT模板列表"""
-        def _request(key_info):
-            url = f"{self.base_url}/template/list"
-            headers = self._get_headers(key_info)
-            
-            params = {
-                "payType": pay_type,
-                "pageNum": page_num,
-                "pageSize": page_size
-            }
-            
-            if style:
-                params["style"] = style
-            if color:
-                params["color"] = color
-            if industry:
-                params["industry"] = industry
-            
-            response = requests.get(url, headers=headers, params=params)
-            return response.json()
-        
-        return self._make_request_with_retry(_request)
+    def get_stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["stale_hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "size": len(self._data),
+            "hit_rate": round((lookups - self._stats["misses"]) / lookups, 4) if lookups else 0.0
+        }
+
+# 常见文档格式的文件头，用于在上传前识别扩展名与内容不符的文件
+DOCUMENT_SIGNATURES = {
+    "pdf": (b"%PDF-",),
+    "docx": (b"PK\x03\x04",),
+    "doc": (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1",)
+}
+
+class _MappedReader:
+    """内存映射文档上的独立读取游标，供MultipartEncoder分块读取，每次请求互不影响"""
     
-    def create_ppt_task(self, text: str, template_id: str, author: str = "XXXX",
-                       is_card_note: bool = True, search: bool = False,
-                       is_figure: bool = True, ai_image: str = "normal") -> dict:
-        """创建PPT生成任务"""
-        def _request(key_info):
-            url = f"{self.base_url}/create"
-            timestamp = int(time.time())
-            signature = self._get_signature(key_info["app_id"], key_info["api_secret"], timestamp)
-            
-            form_data = MultipartEncoder(
-                fields={
-                    "query": text,
-                    "templateId": template_id,
-                    "author": author,
-                    "isCardNote": str(is_card_note),
-                    "search": str(search),
-                    "isFigure": str(is_figure),
-                    "aiImage": ai_image
-                }
-            )
-            
-            headers = {
-                "appId": key_info["app_id"],
-                "timestamp": str(timestamp),
-                "signature": signature,
-                "Content-Type": form_data.content_type
-            }
-            
-            response = requests.post(url, data=form_data, headers=headers)
-            return response.json()
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+    
+    @property
+    def len(self) -> int:
+        # MultipartEncoder按剩余字节数判断是否读完
+        return len(self._view) - self._pos
+    
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(len(self._view), self._pos + size)
+        chunk = self._view[self._pos:end].tobytes()
+        self._pos = end
+        return chunk
+
+class DocumentUpload:
+    """待上传的本地文档
+    
+    打开时即校验类型与大小（不发生任何网络请求），文件以只读方式内存映射，
+    重试时复用同一份映射而不再读盘；必须通过with语句或close()确定性关闭。
+    """
+    
+    def __init__(self, file_path: str, file_name: str = None, config: dict = None,
+                 content: bytes = None):
+        """content不为None时使用内存中的文档内容（如预取的file_url），file_path仅用于提示信息"""
+        config = {**UPLOAD_CONFIG, **(config or {})}
+        self.file_name = file_name or os.path.basename(file_path)
+        self.extension = extension = os.path.splitext(self.file_name)[1].lstrip(".").lower()
+        if extension not in config["allowed_extensions"]:
+            raise ValueError(f"不支持的文档类型: {self.file_name}，"
+                             f"支持: {'、'.join(config['allowed_extensions'])}")
         
-        return self._make_request_with_retry(_request)
+        self._file = open(file_path, "rb") if content is None else None
+        self._mmap = None
+        self.view = None
+        try:
+            self.size = os.fstat(self._file.fileno()).st_size if content is None else len(content)
+            if self.size == 0:
+                raise ValueError(f"文档为空: {file_path}")
+            if self.size > config["max_bytes"]:
+                raise ValueError(f"文档大小 {self.size / 1024 / 1024:.1f}MB 超过上限 "
+                                 f"{config['max_bytes'] / 1024 / 1024:.0f}MB: {file_path}")
+            if content is None:
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._mmap = mmap.mmap(-1, self.size)
+                self._mmap.write(content)
+            self.view = memoryview(self._mmap)
+            signatures = DOCUMENT_SIGNATURES.get(extension)
+            if signatures and not any(self.view[:len(sig)] == sig for sig in signatures):
+                raise ValueError(f"文档内容与扩展名 .{extension} 不符: {file_path}")
+            # 内容指纹，用于按内容合并相同请求、命中缓存
+            self.sha256 = hashlib.sha256(self.view).hexdigest()
+        except BaseException:
+            self.close()
+            raise
+    
+    def reader(self) -> _MappedReader:
+        """返回从头开始的新读取游标（每次请求/重试各用一个）"""
+        return _MappedReader(self.view)
+    
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+async def _iter_multipart(form_data: MultipartEncoder, chunk_size: int):
+    """分块产出multipart请求体，文件内容无需在内存中整体拼接"""
+    while True:
+        chunk = form_data.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+class DocumentFetcher:
+    """服务端预取file_url指向的文档
+    
+    下载并发受max_concurrent限制，同一URL的并发下载合并为一次；下载过程中即检查大小上限，
+    超出时立即中止。下载内容交给DocumentUpload校验，之后与本地文档一样按内容指纹去重、命中缓存。
+    
+    file_url由调用方提供，为避免借服务端访问内网（SSRF），只允许http/https，解析主机名后
+    拒绝回环、私有、链路本地与保留地址（allowed_private_hosts中的主机除外），并直接连接
+    检查过的地址；重定向手动跟随，每一跳同样检查。
+    """
+    
+    REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+    
+    def __init__(self, max_concurrent: int = 4, timeout: float = 30.0,
+                 max_bytes: int = None, seen_entries: int = 1024,
+                 max_redirects: int = 5, allowed_private_hosts=()):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.timeout = timeout
+        self.max_bytes = max_bytes or UPLOAD_CONFIG["max_bytes"]
+        self.seen_entries = seen_entries
+        self.max_redirects = max_redirects
+        self.allowed_private_hosts = {host.lower() for host in allowed_private_hosts or ()}
+        self._flight = SingleFlight()
+        self._seen: OrderedDict = OrderedDict()  # 已处理文档的内容指纹
+        self._loop = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._stats = {"requests": 0, "downloads": 0, "bytes": 0, "errors": 0,
+                       "blocked": 0, "duplicate_content": 0}
+    
+    def _ensure_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 事件循环变化（如测试中多次asyncio.run）时重建绑定到循环的对象
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+            self._client = httpx.AsyncClient(timeout=self.timeout, follow_redirects=False)
+    
+    async def fetch(self, url: str) -> bytes:
+        """下载文档内容，失败或超过大小上限时抛出ValueError"""
+        self._ensure_loop()
+        self._stats["requests"] += 1
+        return await self._flight.do(url, lambda: self._download(url))
+    
+    async def _resolve(self, url: httpx.URL) -> Optional[str]:
+        """检查下载地址，返回要连接的IP（允许的内网主机返回None，按主机名连接）"""
+        if url.scheme not in ("http", "https") or not url.host:
+            raise ValueError(f"文档地址只支持http/https: {url}")
+        if url.host.lower() in self.allowed_private_hosts:
+            return None
+        port = url.port or (443 if url.scheme == "https" else 80)
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(url.host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise ValueError(f"无法解析文档地址 {url.host}: {e}") from e
+        for info in infos:
+            ip = ipaddress.ip_address(info[4][0].split("%")[0])
+            if ip.version == 6 and ip.ipv4_mapped:
+                ip = ip.ipv4_mapped
+            if not ip.is_global or ip.is_multicast:
+                self._stats["blocked"] += 1
+                raise ValueError(f"文档地址 {url.host} 指向内网或保留地址 {ip}，拒绝下载")
+        # 直接连接检查过的地址，避免连接时重新解析到其他地址（DNS重绑定）
+        return infos[0][4][0]
+    
+    async def _open(self, url: httpx.URL):
+        """检查地址后发出GET请求（不跟随重定向），返回流式响应"""
+        address = await self._resolve(url)
+        headers, extensions, target = {}, {}, url
+        if address is not None:
+            target = url.copy_with(host=address)
+            headers["Host"] = url.netloc.decode("ascii")
+            if url.scheme == "https":
+                # TLS握手与证书校验仍使用原主机名
+                extensions["sni_hostname"] = url.host
+        request = self._client.build_request("GET", target, headers=headers, extensions=extensions)
+        return await self._client.send(request, stream=True)
+    
+    async def _download(self, url: str) -> bytes:
+        async with self._slots:
+            try:
+                current = httpx.URL(url)
+                for _ in range(self.max_redirects + 1):
+                    response = await self._open(current)
+                    if response.status_code not in self.REDIRECT_STATUSES:
+                        break
+                    location = response.headers.get("location")
+                    await response.aclose()
+                    if not location:
+                        raise ValueError(f"文档下载失败: HTTP {response.status_code} 缺少Location: {url}")
+                    current = current.join(location)
+                else:
+                    raise ValueError(f"文档下载失败: 重定向超过 {self.max_redirects} 次: {url}")
+                try:
+                    if response.status_code >= 400:
+                        raise ValueError(f"文档下载失败: HTTP {response.status_code}: {url}")
+                    declared = int(response.headers.get("content-length") or 0)
+                    if declared > self.max_bytes:
+                        raise ValueError(f"文档大小 {declared / 1024 / 1024:.1f}MB 超过上限 "
+                                         f"{self.max_bytes / 1024 / 1024:.0f}MB: {url}")
+                    chunks, size = [], 0
+                    async for chunk in response.aiter_bytes():
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise ValueError(f"文档大小超过上限 {self.max_bytes / 1024 / 1024:.0f}MB: {url}")
+                        chunks.append(chunk)
+                finally:
+                    await response.aclose()
+            except ValueError:
+                self._stats["errors"] += 1
+                raise
+            except (httpx.HTTPError, httpx.InvalidURL) as e:
+                self._stats["errors"] += 1
+                raise ValueError(f"文档下载失败: {e}: {url}") from e
+        self._stats["downloads"] += 1
+        self._stats["bytes"] += size
+        return b"".join(chunks)
+    
+    def mark_seen(self, sha256: str) -> bool:
+        """记录已处理的文档内容，返回此前是否处理过相同内容"""
+        seen = sha256 in self._seen
+        if seen:
+            self._stats["duplicate_content"] += 1
+            self._seen.move_to_end(sha256)
+        else:
+            self._seen[sha256] = True
+            if len(self._seen) > self.seen_entries:
+                self._seen.popitem(last=False)
+        return seen
+    
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+    
+    def get_stats(self) -> dict:
+        return {**self._stats, "coalesced": self._flight.get_stats()["upstream_calls_saved"],
+                "in_flight": self._flight.get_stats()["in_flight"],
+                "max_concurrent": self.max_concurrent}
+
+# 空闲连接默认保活时间（秒）
+DEFAULT_IDLE_TIMEOUT = 30.0
+
+class RequestSigner:
+    """请求签名 - 按（密钥, 秒级时间戳）缓存签名与请求头
+    
+    签名为 base64(HMAC-SHA1(api_secret, MD5(app_id + timestamp)))，时间戳精确到秒，
+    因此同一密钥在同一秒内的所有请求可复用同一签名。每个密钥只缓存当前这一秒的结果，
+    HMAC密钥预处理也只在首次使用该密钥时进行一次。缓存条目整体替换，多线程下无需加锁。
+    """
+    
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._keys: dict[tuple, object] = {}     # (app_id, api_secret) -> 预处理过密钥的HMAC对象
+        self._entries: dict[tuple, tuple] = {}   # (app_id, api_secret) -> (时间戳, 签名请求头)
+        self._stats = {"hits": 0, "misses": 0}
+    
+    def signature(self, app_id: str, api_secret: str, timestamp: int) -> str:
+        """计算签名（不经过缓存）"""
+        mac = self._keys.get((app_id, api_secret))
+        if mac is None:
+            mac = self._keys[(app_id, api_secret)] = hmac.new(api_secret.encode("utf-8"), digestmod=hashlib.sha1)
+        mac = mac.copy()
+        mac.update(hashlib.md5(f"{app_id}{timestamp}".encode("utf-8")).hexdigest().encode("utf-8"))
+        return base64.b64encode(mac.digest()).decode("utf-8")
+    
+    def headers(self, app_id: str, api_secret: str, content_type: str) -> dict:
+        """当前这一秒的签名请求头（每次返回新的字典，调用方可以修改）"""
+        timestamp = int(self.clock())
+        key = (app_id, api_secret)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == timestamp:
+            self._stats["hits"] += 1
+            signed = entry[1]
+        else:
+            self._stats["misses"] += 1
+            signed = {
+                "appId": app_id,
+                "timestamp": str(timestamp),
+                "signature": self.signature(app_id, api_secret, timestamp)
+            }
+            self._entries[key] = (timestamp, signed)
+        return {**signed, "Content-Type": content_type}
+    
+    def get_stats(self) -> dict:
+        return {**self._stats, "keys": len(self._entries)}
+
+class BaseAIPPTClient:
+    """讯飞智文PPT客户端基类 - 负责密钥池、签名与请求参数构建（同步/异步客户端共用）"""
+    
+    def __init__(self, key_pool=None, base_url: str = None):
+        self.key_pool_manager = APIKeyPool(key_pool or API_KEY_POOL)
+        self.base_url = base_url or "https://zwapi.xfyun.cn/api/ppt/v2"
+        self.retry_policy = RetryPolicy()
+        self.acquire_timeout = 60.0  # 等待可用密钥的最长时间（秒）
+        self.signer = RequestSigner()
+        
+    def _get_signature(self, app_id: str, api_secret: str, timestamp: int) -> str:
+        """生成API签名"""
+        try:
+            return self.signer.signature(app_id, api_secret, timestamp)
+        except Exception as e:
+            raise Exception(f"签名生成失败: {e}")
+    
+    def _get_headers(self, key_info: dict, content_type: str = "application/json; charset=utf-8") -> dict:
+        """获取请求头（同一密钥同一秒内复用签名）"""
+        try:
+            return self.signer.headers(key_info["app_id"], key_info["api_secret"], content_type)
+        except Exception as e:
+            raise Exception(f"签名生成失败: {e}")
+    
+    def _prepare_request(self, key_info: dict, path: str, params: dict = None,
+                         fields: dict = None) -> dict:
+        """构建请求：有fields时为multipart表单POST，否则为带查询参数的GET"""
+        url = f"{self.base_url}{path}"
+        if fields is not None:
+            form_data = MultipartEncoder(fields=fields)
+            return {
+                "method": "POST",
+                "url": url,
+                "headers": self._get_headers(key_info, form_data.content_type),
+                "data": form_data
+            }
+        return {
+            "method": "GET",
+            "url": url,
+            "headers": self._get_headers(key_info),
+            "params": params
+        }
+    
+    def _connection_config(self, key_info: dict) -> dict:
+        """读取密钥的连接池配置"""
+        http2 = bool(key_info.get("http2", False))
+        if http2 and not HTTP2_AVAILABLE:
+            print(f"警告: 密钥 {key_info.get('name', key_info['app_id'])} 配置了http2但未安装h2，回退到HTTP/1.1")
+            http2 = False
+        return {
+            "pool_size": int(key_info.get("pool_size", key_info.get("max_concurrent", 10))),
+            "idle_timeout": float(key_info.get("idle_timeout", DEFAULT_IDLE_TIMEOUT)),
+            "http2": http2
+        }
+    
+    def get_pool_stats(self):
+        """获取密钥池统计信息"""
+        stats = self.key_pool_manager.get_stats()
+        stats["retry_budget"] = self.retry_policy.budget.get_stats()
+        stats["signer"] = self.signer.get_stats()
+        return stats
+    
+    def _check_response(self, status_code: int, text: str):
+        """5xx与429属于暂时性错误，抛出异常交由重试策略处理；
+        其他4xx的响应体不是JSON时同样抛出（不可重试），是JSON时按业务code分类"""
+        if status_code >= 500 or status_code == 429:
+            raise UpstreamHTTPError(status_code, text)
+        if status_code >= 400:
+            try:
+                json.loads(text)
+            except ValueError:
+                raise UpstreamHTTPError(status_code, text)
+    
+    def _theme_list_params(self, pay_type: str = "not_free", style: str = None,
+                           color: str = None, industry: str = None,
+                           page_num: int = 1, page_size: int = 10) -> dict:
+        """构建模板列表查询参数"""
+        params = {
+            "payType": pay_type,
+            "pageNum": page_num,
+            "pageSize": page_size
+        }
+        
+        if style:
+            params["style"] = style
+        if color:
+            params["color"] = color
+        if industry:
+            params["industry"] = industry
+        return params
+    
+    def _ppt_task_fields(self, text: str, template_id: str, author: str = "XXXX",
+                         is_card_note: bool = True, search: bool = False,
+                         is_figure: bool = True, ai_image: str = "normal") -> dict:
+        """构建PPT生成任务表单字段"""
+        return {
+            "query": text,
+            "templateId": template_id,
+            "author": author,
+            "isCardNote": str(is_card_note),
+            "search": str(search),
+            "isFigure": str(is_figure),
+            "aiImage": ai_image
+        }
+    
+    def _outline_fields(self, text: str, language: str = "cn", search: bool = False) -> dict:
+        """构建大纲生成表单字段"""
+        # 使用form-data格式而不是JSON
+        return {
+            "query": text,
+            "language": language,
+            "search": str(search)
+        }
+    
+    def _outline_by_doc_fields(self, file_name: str, text: str, language: str = "cn",
+                               search: bool = False) -> dict:
+        """构建文档大纲生成的公共表单字段（不含文件部分）"""
+        return {
+            "fileName": file_name,
+            "query": text,
+            "language": language,
+            "search": str(search)
+        }
+    
+    def _outline_to_query(self, text: str, outline: dict) -> str:
+        """将大纲转换为create接口可用的查询文本"""
+        # 由于createPptByOutline接口存在99999系统异常问题
+        # 改用create接口，将大纲信息融合到query文本中
+        
+        # 将大纲转换为文本描述
+        outline_text = f"标题：{outline.get('title', text)}\n"
+        if outline.get('subTitle'):
+            outline_text += f"副标题：{outline['subTitle']}\n"
+        
+        outline_text += "\n内容要点：\n"
+        for i, chapter in enumerate(outline.get('chapters', []), 1):
+            chapter_title = chapter.get('chapterTitle', f'第{i}部分')
+            outline_text += f"{i}. {chapter_title}\n"
+            
+            # 处理章节内容
+            contents = chapter.get('contents', [])
+            if isinstance(contents, list):
+                for content in contents:
+                    if isinstance(content, str):
+                        outline_text += f"   - {content}\n"
+                    elif isinstance(content, dict) and 'chapterTitle' in content:
+                        outline_text += f"   - {content['chapterTitle']}\n"
+        
+        # 构建完整的查询文本
+        return f"{text}\n\n{outline_text}"
+    
+    def _log_outline_debug(self, result: dict, template_id: str, full_query: str, key_info: dict):
+        """大纲创建PPT失败时输出调试信息"""
+        if result.get('code') != 0:
+            print(f"DEBUG - 使用直接创建方式的详细信息:")
+            print(f"  模板ID: {template_id}")
+            print(f"  查询文本长度: {len(full_query)}")
+            print(f"  使用密钥: {key_info.get('name', 'unnamed')}")
+            print(f"  响应: {result}")
+    
+    def _batch_jobs(self, jobs: list) -> list[dict]:
+        """校验批量任务列表，返回create_ppt_task的参数列表"""
+        if not isinstance(jobs, list) or not jobs:
+            raise ValueError("jobs 必须是非空列表")
+        if len(jobs) > BATCH_CONFIG["max_jobs"]:
+            raise ValueError(f"批量任务数 {len(jobs)} 超过上限 {BATCH_CONFIG['max_jobs']}")
+        allowed = set(inspect.signature(self.create_ppt_task).parameters)
+        normalized = []
+        for index, job in enumerate(jobs):
+            if not isinstance(job, dict) or not job.get("text") or not job.get("template_id"):
+                raise ValueError(f"第{index + 1}个任务缺少 text 或 template_id")
+            unknown = set(job) - allowed
+            if unknown:
+                raise ValueError(f"第{index + 1}个任务包含未知参数: {', '.join(sorted(unknown))}")
+            normalized.append(dict(job))
+        return normalized
+    
+    def _batch_capacity(self, max_parallel: int = None) -> int:
+        """批量任务的并行上限：默认等于所有启用密钥的max_concurrent之和"""
+        capacity = sum(key.get("max_concurrent", 10) for key in self.key_pool_manager.key_pool)
+        limit = max_parallel or BATCH_CONFIG["max_parallel"]
+        return max(1, min(capacity, limit) if limit else capacity)
+    
+    @staticmethod
+    def _batch_job_result(index: int, started: float, sid: str = None, response: dict = None,
+                          snapshot: dict = None, error: str = None) -> dict:
+        """整理单个批量任务的结果
+        
+        status: submit_failed（提交失败）、submitted（已提交，未等待）、done、failed、error、timed_out
+        """
+        if error is not None and sid:
+            # 已提交，但等待完成时出错
+            status = "error"
+        elif error is not None or response is None or response.get("code") != 0:
+            status = "submit_failed"
+            error = error or (response or {}).get("desc") or f"code={(response or {}).get('code')}"
+        elif snapshot is None:
+            status = "submitted"
+        elif not snapshot.get("finished"):
+            status = "timed_out"
+        else:
+            status = snapshot["status"]
+            error = snapshot.get("error")
+        return {
+            "index": index,
+            "success": status in ("done", "submitted"),
+            "status": status,
+            "sid": sid,
+            "ppt_url": (snapshot or {}).get("ppt_url"),
+            "progress": (snapshot or {}).get("progress", 0),
+            "error": error,
+            "elapsed": round(time.monotonic() - started, 2)
+        }
+    
+    @staticmethod
+    def _batch_summary(results: list, started: float) -> dict:
+        counts = {}
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        return {
+            "total": len(results),
+            "succeeded": sum(1 for result in results if result["success"]),
+            "failed": sum(1 for result in results if not result["success"]),
+            "status_counts": counts,
+            "elapsed": round(time.monotonic() - started, 2),
+            "results": results
+        }
+
+class AIPPTClient(BaseAIPPTClient):
+    """讯飞智文PPT生成客户端 - 支持API密钥池"""
+    
+    def __init__(self, key_pool=None, base_url: str = None):
+        super().__init__(key_pool, base_url)
+        # 每个密钥一个持久会话：{app_id: {"session": Session, "last_used": float}}
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+    
+    def _get_session(self, key_info: dict) -> requests.Session:
+        """获取密钥对应的持久会话，复用keep-alive连接，空闲超时后重建"""
+        config = self._connection_config(key_info)
+        now = time.monotonic()
+        with self._sessions_lock:
+            entry = self._sessions.get(key_info["app_id"])
+            if entry and now - entry["last_used"] > config["idle_timeout"]:
+                # urllib3不支持连接空闲过期，超时后整体重建会话，避免复用已被服务端关闭的连接
+                entry["session"].close()
+                entry = None
+            if entry is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config["pool_size"])
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                entry = {"session": session, "last_used": now}
+                self._sessions[key_info["app_id"]] = entry
+            entry["last_used"] = now
+            return entry["session"]
+    
+    def close(self):
+        """关闭所有持久会话"""
+        with self._sessions_lock:
+            for entry in self._sessions.values():
+                entry["session"].close()
+            self._sessions.clear()
+    
+    def _send(self, key_info: dict, path: str, params: dict = None, fields: dict = None) -> dict:
+        """发送同步请求并解析JSON响应"""
+        request = self._prepare_request(key_info, path, params=params, fields=fields)
+        response = self._get_session(key_info).request(**request)
+        self._check_response(response.status_code, response.text)
+        return response.json()
+        
+    def _make_request_with_retry(self, request_func, *args, **kwargs):
+        """带重试的请求执行：按响应code分类，指数退避+抖动，受总时限与全局重试预算约束"""
+        policy = self.retry_policy
+        deadline = policy.request_deadline()
+        policy.budget.record_request()
+        last_result, last_error = None, None
+        
+        for attempt in range(1, policy.max_attempts + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # 占用最优密钥，所有密钥饱和时排队等待
+            key_index, key_info = self.key_pool_manager.acquire(
+                timeout=min(self.acquire_timeout, remaining))
+            
+            started = time.monotonic()
+            result, error = None, None
+            try:
+                result = request_func(key_info, *args, **kwargs)
+            except Exception as e:
+                error = e
+            outcome = policy.classify(result, error)
+            policy.settle_key(self.key_pool_manager, key_index, outcome, time.monotonic() - started)
+            
+            if outcome.kind in (RetryPolicy.SUCCESS, RetryPolicy.FATAL):
+                if error is not None:
+                    raise error
+                return result
+            
+            last_result, last_error = result, error
+            if attempt == policy.max_attempts:
+                break
+            delay = policy.backoff_delay(attempt, outcome)
+            if time.monotonic() + delay >= deadline:
+                break
+            if not policy.budget.try_spend():
+                print("重试预算已耗尽，放弃重试")
+                break
+            print(f"密钥 {key_info.get('name', key_index)} 请求失败 (尝试 {attempt}/{policy.max_attempts}): "
+                  f"{outcome.reason}，{delay:.2f}秒后重试")
+            time.sleep(delay)  # 同步客户端运行在工作线程中
+        
+        # 重试用尽：有业务响应则原样返回，由调用方检查code
+        if last_result is not None:
+            return last_result
+        raise last_error or RequestDeadlineExceeded(f"请求超过总时限 {policy.deadline} 秒")
+    
+    def get_theme_list(self, pay_type: str = "not_free", style: str = None, 
+                      color: str = None, industry: str = None, 
+                      page_num: int = 1, page_size: int = 10) -> dict:
+        """获取PPT模板列表"""
+        params = self._theme_list_params(pay_type, style, color, industry, page_num, page_size)
+        
+        def _request(key_info):
+            return self._send(key_info, "/template/list", params=params)
+        
+        return self._make_request_with_retry(_request)
+    
+    def create_ppt_task(self, text: str, template_id: str, author: str = "XXXX",
+                       is_card_note: bool = True, search: bool = False,
+                       is_figure: bool = True, ai_image: str = "normal") -> dict:
+        """创建PPT生成任务"""
+        def _request(key_info):
+            fields = self._ppt_task_fields(text, template_id, author, is_card_note,
+                                           search, is_figure, ai_image)
+            return self._send(key_info, "/create", fields=fields)
+        
+        return self._make_request_with_retry(_request)
+    
+    def get_task_progress(self, sid: str) -> dict:
+        """查询PPT生成任务进度"""
+        def _request(key_info):
+            return self._send(key_info, "/progress", params={"sid": sid})
+        
+        return self._make_request_with_retry(_request)
+    
+    def create_ppt_batch(self, jobs: list, wait_for_completion: bool = True, job_timeout: float = None,
+                         max_parallel: int = None, on_result=None) -> dict:
+        """批量创建PPT生成任务
+        
+        jobs为create_ppt_task的参数字典列表（必须包含text与template_id）。同时进行的任务数
+        不超过密钥池容量，每个任务提交后按poll_interval查询进度直到完成或超时；
+        on_result(result)在每个任务结束时（在工作线程中）调用。返回按jobs顺序排列的结果。
+        """
+        jobs = self._batch_jobs(jobs)
+        job_timeout = job_timeout or BATCH_CONFIG["job_timeout"]
+        started = time.monotonic()
+        
+        def _run(index, job):
+            job_started = time.monotonic()
+            try:
+                response = self.create_ppt_task(**job)
+            except Exception as e:
+                result = self._batch_job_result(index, job_started, error=str(e))
+            else:
+                sid = (response.get("data") or {}).get("sid") if response.get("code") == 0 else None
+                snapshot = None
+                if sid and wait_for_completion:
+                    deadline = time.monotonic() + job_timeout
+                    while True:
+                        try:
+                            snapshot = summarize_progress(sid, self.get_task_progress(sid))
+                        except Exception as e:
+                            snapshot = {"sid": sid, "status": "error", "progress": 0,
+                                        "finished": False, "error": str(e)}
+                        if snapshot["finished"] or time.monotonic() >= deadline:
+                            break
+                        time.sleep(min(BATCH_CONFIG["poll_interval"], max(0.0, deadline - time.monotonic())))
+                result = self._batch_job_result(index, job_started, sid, response, snapshot)
+            if on_result:
+                try:
+                    on_result(result)
+                except Exception as e:
+                    print(f"批量任务结果推送失败: {e}")
+            return result
+        
+        with ThreadPoolExecutor(max_workers=self._batch_capacity(max_parallel),
+                                thread_name_prefix="ppt-batch") as executor:
+            results = list(executor.map(_run, range(len(jobs)), jobs))
+        return self._batch_summary(results, started)
+    
+    def create_outline(self, text: str, language: str = "cn", search: bool = False) -> dict:
+        """创建PPT大纲"""
+        def _request(key_info):
+            return self._send(key_info, "/createOutline",
+                              fields=self._outline_fields(text, language, search))
+        
+        return self._make_request_with_retry(_request)
+    
+    def create_outline_by_doc(self, file_name: str, text: str, file_url: str = None,
+                             file_path: str = None, language: str = "cn", 
+                             search: bool = False) -> dict:
+        """从文档创建PPT大纲"""
+        if not file_url and not file_path:
+            raise ValueError("file_url 或 file_path 必须提供其中一个")
+        
+        # 上传前校验文档；重试复用同一份内存映射，结束后确定性关闭
+        with (DocumentUpload(file_path, file_name) if not file_url else nullcontext()) as upload:
+            def _request(key_info):
+                fields = self._outline_by_doc_fields(file_name, text, language, search)
+                if file_url:
+                    fields["fileUrl"] = file_url
+                else:
+                    fields["file"] = (upload.file_name, upload.reader(), 'application/octet-stream')
+                return self._send(key_info, "/createOutlineByDoc", fields=fields)
+            
+            return self._make_request_with_retry(_request)
+    
+    def create_ppt_by_outline(self, text: str, outline: dict, template_id: str,
+                             author: str = "XXXX", is_card_note: bool = True,
+                             search: bool = False, is_figure: bool = True,
+                             ai_image: str = "normal") -> dict:
+        """根据大纲创建PPT - 使用直接创建方式（绕过API bug）"""
+        full_query = self._outline_to_query(text, outline)
+        
+        def _request(key_info):
+            # 使用create接口（已知可以工作）
+            fields = self._ppt_task_fields(full_query, template_id, author, is_card_note,
+                                           search, is_figure, ai_image)
+            result = self._send(key_info, "/create", fields=fields)
+            
+            # 添加调试信息
+            self._log_outline_debug(result, template_id, full_query, key_info)
+            return result
+        
+        return self._make_request_with_retry(_request)
+
+class AsyncAIPPTClient(BaseAIPPTClient):
+    """讯飞智文PPT生成异步客户端 - 基于httpx，不阻塞事件循环"""
+    
+    def __init__(self, key_pool=None, base_url: str = None, timeout: float = 120.0,
+                 hedge_config: dict = None, template_catalog_config: dict = None,
+                 outline_cache_config: dict = None, prefetch_config: dict = None,
+                 job_store_config: dict = None):
+        super().__init__(key_pool, base_url)
+        self.timeout = timeout
+        # 每个密钥一个httpx连接池：{app_id: AsyncClient}
+        self._http_clients: dict[str, httpx.AsyncClient] = {}
+        # 对冲请求：按接口统计延迟，对冲预算限制额外配额消耗
+        self.hedge_config = {**HEDGE_CONFIG, **(hedge_config or {})}
+        self.hedge_budget = RetryBudget(self.hedge_config["max_hedge_ratio"], 0.0,
+                                        self.hedge_config["max_burst"])
+        self._latency_trackers: dict[str, LatencyTracker] = {}
+        self._hedge_stats = {"fired": 0, "won": 0, "skipped_budget": 0, "skipped_no_key": 0}
+        # 进度查询调度：同一sid的查询合并，所有sid共享有界的上游查询名额
+        max_in_flight = (PROGRESS_SCHEDULER_CONFIG["max_in_flight"]
+                         or 2 * max(1, len(self.key_pool_manager.key_pool)))
+        self.progress_scheduler = ProgressScheduler(self._fetch_task_progress,
+                                                    PROGRESS_SCHEDULER_CONFIG["freshness"],
+                                                    max_in_flight)
+        # 模板列表缓存：只缓存成功的响应
+        self.theme_cache = None
+        if THEME_CACHE_CONFIG["enabled"]:
+            self.theme_cache = AsyncTTLCache(THEME_CACHE_CONFIG["ttl"], THEME_CACHE_CONFIG["stale_ttl"],
+                                             THEME_CACHE_CONFIG["max_entries"],
+                                             cacheable=lambda result: result.get("code") == 0)
+        # 相同的进行中大纲生成请求只发送一次；成功结果按内容哈希缓存到磁盘（传入配置时启用）
+        self.outline_flight = SingleFlight()
+        # file_url预取：下载并发有界，同一URL的并发下载合并
+        self.prefetch_config = {**DOC_PREFETCH_CONFIG, **(prefetch_config or {})}
+        self.document_fetcher = DocumentFetcher(self.prefetch_config["max_concurrent"],
+                                                self.prefetch_config["timeout"],
+                                                UPLOAD_CONFIG["max_bytes"],
+                                                self.prefetch_config["seen_entries"],
+                                                self.prefetch_config.get("max_redirects", 5),
+                                                self.prefetch_config.get("allowed_private_hosts"))
+        self._preprocess_stats = {"as_text": 0, "uploaded": 0, "truncated": 0, "condensed": 0,
+                                  "rejected": 0, "bytes_saved": 0}
+        self.outline_cache = None
+        if outline_cache_config:
+            self.outline_cache = DiskCache(outline_cache_config["path"],
+                                           outline_cache_config.get("max_bytes", 256 * 1024 * 1024),
+                                           outline_cache_config.get("max_age"))
+        # 生成任务持久化存储（传入配置时启用）
+        self.job_store = None
+        if job_store_config:
+            self.job_store = JobStore(job_store_config["path"],
+                                      job_store_config.get("retention", 7 * 24 * 3600),
+                                      job_store_config.get("lease", 300.0))
+        self._lease_holders = 0
+        self._lease_renewer: Optional[asyncio.Task] = None
+        # 本地模板目录索引（传入配置时启用）
+        self.template_catalog = None
+        if template_catalog_config:
+            self.template_catalog = TemplateCatalog(
+                self._fetch_theme_page, template_catalog_config.get("path"),
+                template_catalog_config.get("page_size", 100),
+                template_catalog_config.get("refresh_interval", 6 * 3600),
+                full_refresh_every=template_catalog_config.get("full_refresh_every", 4))
+    
+    def _get_http_client(self, key_info: dict) -> httpx.AsyncClient:
+        """获取（惰性创建）密钥对应的httpx连接池"""
+        client = self._http_clients.get(key_info["app_id"])
+        if client is None or client.is_closed:
+            config = self._connection_config(key_info)
+            client = httpx.AsyncClient(
+                timeout=self.timeout,
+                http2=config["http2"],
+                limits=httpx.Limits(
+                    max_connections=config["pool_size"],
+                    max_keepalive_connections=config["pool_size"],
+                    keepalive_expiry=config["idle_timeout"]
+                )
+            )
+            self._http_clients[key_info["app_id"]] = client
+        return client
+    
+    async def aclose(self):
+        """关闭底层HTTP连接"""
+        await self.progress_scheduler.aclose()
+        await self.document_fetcher.aclose()
+        if self.template_catalog is not None:
+            await self.template_catalog.aclose()
+        clients = list(self._http_clients.values())
+        self._http_clients.clear()
+        for client in clients:
+            await client.aclose()
+    
+    async def _send(self, key_info: dict, path: str, params: dict = None, fields: dict = None) -> dict:
+        """发送异步请求并解析JSON响应"""
+        request = self._prepare_request(key_info, path, params=params, fields=fields)
+        form_data = request.pop("data", None)
+        if form_data is not None:
+            # 流式发送multipart请求体（与同步客户端报文一致），显式给出长度避免分块传输编码
+            request["content"] = _iter_multipart(form_data, UPLOAD_CONFIG["chunk_size"])
+            request["headers"]["Content-Length"] = str(form_data.len)
+        response = await self._get_http_client(key_info).request(**request)
+        self._check_response(response.status_code, response.text)
+        return response.json()
+    
+    async def _make_request_with_retry(self, request_func, *args, used_keys: set = None, **kwargs):
+        """带重试的异步请求执行：按响应code分类，指数退避+抖动，受总时限与全局重试预算约束
+        
+        used_keys不为None时记录本次调用用过的密钥索引（供对冲请求避开）。
+        """
+        policy = self.retry_policy
+        deadline = policy.request_deadline()
+        policy.budget.record_request()
+        last_result, last_error = None, None
+        
+        for attempt in range(1, policy.max_attempts + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # 占用最优密钥，所有密钥饱和时排队等待（不阻塞事件循环）
+            key_index, key_info = await self.key_pool_manager.acquire_async(
+                timeout=min(self.acquire_timeout, remaining))
+            if used_keys is not None:
+                used_keys.add(key_index)
+            
+            started = time.monotonic()
+            result, error = None, None
+            try:
+                result = await asyncio.wait_for(request_func(key_info, *args, **kwargs),
+                                                deadline - time.monotonic())
+            except asyncio.CancelledError:
+                # 调用方取消不计入密钥健康度，但必须归还密钥
+                self.key_pool_manager.release_unrecorded(key_index)
+                raise
+            except asyncio.TimeoutError:
+                error = RequestDeadlineExceeded(f"请求超过总时限 {policy.deadline} 秒")
+            except Exception as e:
+                error = e
+            if isinstance(error, RequestDeadlineExceeded):
+                self.key_pool_manager.release(key_index, success=False,
+                                              latency=time.monotonic() - started)
+                raise error
+            outcome = policy.classify(result, error)
+            policy.settle_key(self.key_pool_manager, key_index, outcome, time.monotonic() - started)
+            
+            if outcome.kind in (RetryPolicy.SUCCESS, RetryPolicy.FATAL):
+                if error is not None:
+                    raise error
+                return result
+            
+            last_result, last_error = result, error
+            if attempt == policy.max_attempts:
+                break
+            delay = policy.backoff_delay(attempt, outcome)
+            if time.monotonic() + delay >= deadline:
+                break
+            if not policy.budget.try_spend():
+                print("重试预算已耗尽，放弃重试")
+                break
+            print(f"密钥 {key_info.get('name', key_index)} 请求失败 (尝试 {attempt}/{policy.max_attempts}): "
+                  f"{outcome.reason}，{delay:.2f}秒后重试")
+            await asyncio.sleep(delay)
+        
+        # 重试用尽：有业务响应则原样返回，由调用方检查code
+        if last_result is not None:
+            return last_result
+        raise last_error or RequestDeadlineExceeded(f"请求超过总时限 {policy.deadline} 秒")
+    
+    async def _hedge_attempt(self, request_func, key_index: int, key_info: dict):
+        """对冲请求：在另一个密钥上执行一次（不重试）"""
+        started = time.monotonic()
+        result, error = None, None
+        try:
+            result = await request_func(key_info)
+        except asyncio.CancelledError:
+            # 对冲失败方被取消：只归还密钥，不记录健康样本
+            self.key_pool_manager.release_unrecorded(key_index)
+            raise
+        except Exception as e:
+            error = e
+        outcome = self.retry_policy.classify(result, error)
+        self.retry_policy.settle_key(self.key_pool_manager, key_index, outcome,
+                                     time.monotonic() - started)
+        if error is not None:
+            raise error
+        return result
+    
+    def _start_hedge(self, request_func, used_keys: set):
+        """在预算允许且有其他空闲密钥时发出对冲请求"""
+        if not self.hedge_budget.try_spend():
+            self._hedge_stats["skipped_budget"] += 1
+            return None
+        acquired = self.key_pool_manager.try_acquire(exclude=used_keys)
+        if acquired is None:
+            self._hedge_stats["skipped_no_key"] += 1
+            return None
+        self._hedge_stats["fired"] += 1
+        key_index, key_info = acquired
+        return asyncio.ensure_future(self._hedge_attempt(request_func, key_index, key_info))
+    
+    async def _hedged_request(self, endpoint: str, request_func):
+        """幂等读请求的对冲执行：主请求超过近期延迟分位数仍未返回时，
+        在另一个密钥上发出重复请求，取先成功的结果并取消另一个"""
+        config = self.hedge_config
+        if not config["enabled"]:
+            return await self._make_request_with_retry(request_func)
+        
+        tracker = self._latency_trackers.setdefault(endpoint, LatencyTracker(config["window"]))
+        self.hedge_budget.record_request()
+        started = time.monotonic()
+        used_keys = set()
+        primary = asyncio.ensure_future(self._make_request_with_retry(request_func, used_keys=used_keys))
+        hedge = None
+        try:
+            delay = config["delay"] or tracker.percentile(config["percentile"], config["min_samples"])
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=max(delay, config["min_delay"]))
+                if not done:
+                    hedge = self._start_hedge(request_func, used_keys)
+            
+            pending = {task for task in (primary, hedge) if task is not None}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().get("code") == 0:
+                        if task is hedge:
+                            self._hedge_stats["won"] += 1
+                        tracker.record(time.monotonic() - started)
+                        return task.result()
+            # 都没有成功：以主请求的结果为准
+            return primary.result()
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+    
+    def get_pool_stats(self):
+        """获取密钥池统计信息（含对冲统计）"""
+        stats = super().get_pool_stats()
+        stats["progress_scheduler"] = self.progress_scheduler.get_stats()
+        stats["outline_singleflight"] = self.outline_flight.get_stats()
+        stats["doc_preprocess"] = dict(self._preprocess_stats)
+        stats["doc_prefetch"] = {"enabled": self.prefetch_config["enabled"],
+                                 **self.document_fetcher.get_stats()}
+        if self.outline_cache is not None:
+            stats["outline_cache"] = self.outline_cache.get_stats()
+        if self.theme_cache is not None:
+            stats["theme_cache"] = self.theme_cache.get_stats()
+        if self.template_catalog is not None:
+            stats["template_catalog"] = self.template_catalog.get_stats()
+        if self.job_store is not None:
+            stats["job_store"] = self.job_store.get_stats()
+        stats["hedging"] = {
+            "enabled": self.hedge_config["enabled"],
+            **self._hedge_stats,
+            "p90_latency": {endpoint: tracker.percentile(0.9)
+                            for endpoint, tracker in self._latency_trackers.items()}
+        }
+        return stats
+    
+    async def get_theme_list(self, pay_type: str = "not_free", style: str = None,
+                             color: str = None, industry: str = None,
+                             page_num: int = 1, page_size: int = 10) -> dict:
+        """获取PPT模板列表（本地模板目录就绪时直接在本地筛选，否则请求上游并按查询条件缓存）"""
+        if self.template_catalog is not None:
+            _detached(self.template_catalog.ensure_started)
+            if self.template_catalog.ready:
+                return self.template_catalog.search(pay_type, style, color, industry, page_num, page_size)
+        params = self._theme_list_params(pay_type, style, color, industry, page_num, page_size)
+        
+        async def _request(key_info):
+            return await self._send(key_info, "/template/list", params=params)
+        
+        async def _load():
+            return await self._hedged_request("/template/list", _request)
+        
+        if self.theme_cache is None:
+            return await _load()
+        cache_key = (pay_type, style, color, industry, page_num, page_size)
+        return await self.theme_cache.get(cache_key, _load)
+    
+    async def _submit_ppt_job(self, kind: str, params: dict, request_func, job_id: int = None) -> dict:
+        """提交PPT生成任务；启用任务存储时记录sid与实际使用的密钥（job_id为已排队任务的编号）"""
+        used = {}
+        
+        async def _request(key_info):
+            used["key"] = key_info.get("name") or key_info["app_id"]
+            return await request_func(key_info)
+        
+        try:
+            result = await self._make_request_with_retry(_request)
+        except Exception as e:
+            if self.job_store is not None and job_id is not None:
+                await asyncio.to_thread(self.job_store.mark_submit_failed, job_id, str(e))
+            raise
+        if self.job_store is not None:
+            sid = (result.get("data") or {}).get("sid") if result.get("code") == 0 else None
+            if sid:
+                await asyncio.to_thread(self.job_store.mark_submitted, job_id, kind, params, sid, used.get("key"))
+            elif job_id is not None:
+                await asyncio.to_thread(self.job_store.mark_submit_failed, job_id,
+                                        result.get("desc") or f"code={result.get('code')}")
+        return result
+    
+    def _ppt_task_request(self, params: dict):
+        """按create_ppt_task的参数构建请求函数"""
+        async def _request(key_info):
+            return await self._send(key_info, "/create", fields=self._ppt_task_fields(**params))
+        return _request
+    
+    async def create_ppt_task(self, text: str, template_id: str, author: str = "XXXX",
+                              is_card_note: bool = True, search: bool = False,
+                              is_figure: bool = True, ai_image: str = "normal") -> dict:
+        """创建PPT生成任务"""
+        params = {"text": text, "template_id": template_id, "author": author, "is_card_note": is_card_note,
+                  "search": search, "is_figure": is_figure, "ai_image": ai_image}
+        return await self._submit_ppt_job("create_ppt_task", params, self._ppt_task_request(params))
+    
+    async def _renew_job_leases(self):
+        """每隔三分之一租约时长续约一次，直到被取消"""
+        interval = max(0.01, self.job_store.lease / 3)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.job_store.renew_leases)
+            except Exception as e:
+                print(f"任务租约续约失败: {e}")
+    
+    @asynccontextmanager
+    async def _holding_job_leases(self):
+        """在此期间定期为本进程排队中的任务续约（多个批量调用共用一个续约任务）"""
+        if self.job_store is None:
+            yield
+            return
+        self._lease_holders += 1
+        if self._lease_renewer is None:
+            self._lease_renewer = asyncio.ensure_future(self._renew_job_leases())
+        try:
+            yield
+        finally:
+            self._lease_holders -= 1
+            if self._lease_holders == 0 and self._lease_renewer is not None:
+                self._lease_renewer.cancel()
+                self._lease_renewer = None
+    
+    async def resume_jobs(self, tracker: TaskTracker) -> dict:
+        """服务启动时恢复任务存储中未结束的任务：已提交的由tracker继续跟踪，排队中的重新提交
+
+        排队任务先经任务存储认领（见JobStore.claim_queued），只重新提交本进程认领成功的任务；
+        仍由其他存活进程负责（租约未过期）的任务不会被重复提交。
+        """
+        if self.job_store is None:
+            return {"tracked": 0, "resubmitted": 0}
+        pending = await asyncio.to_thread(self.job_store.pending)
+        tracked = [job["sid"] for job in pending if job["sid"]]
+        for sid in tracked:
+            tracker.track(sid)
+        
+        async with self._holding_job_leases():
+            queued = await asyncio.to_thread(self.job_store.claim_queued)
+            resubmitted = await self._resubmit_jobs(queued, tracker)
+        if pending:
+            print(f"任务存储: 继续跟踪 {len(tracked)} 个进行中的任务，重新提交 {resubmitted}/{len(queued)} 个排队任务")
+        return {"tracked": len(tracked), "resubmitted": resubmitted}
+    
+    async def _resubmit_jobs(self, queued: list, tracker: TaskTracker) -> int:
+        """按密钥池容量重新提交已认领的排队任务，返回成功提交的数量"""
+        slots = asyncio.Semaphore(self._batch_capacity())
+        resubmitted = 0
+        
+        async def _resubmit(job):
+            nonlocal resubmitted
+            async with slots:
+                try:
+                    result = await self._submit_ppt_job(job["kind"], job["params"],
+                                                        self._ppt_task_request(job["params"]), job["id"])
+                except Exception as e:
+                    print(f"排队任务{job['id']}重新提交失败: {e}")
+                    return
+            sid = (result.get("data") or {}).get("sid") if result.get("code") == 0 else None
+            if sid:
+                resubmitted += 1
+                tracker.track(sid)
+        
+        await asyncio.gather(*(_resubmit(job) for job in queued))
+        return resubmitted
+    
+    async def create_ppt_batch(self, jobs: list, wait_for_completion: bool = True, job_timeout: float = None,
+                               max_parallel: int = None, tracker: TaskTracker = None,
+                               on_result=None, call=None) -> dict:
+        """批量创建PPT生成任务
+        
+        jobs为create_ppt_task的参数字典列表（必须包含text与template_id）。同时进行（已提交、
+        未完成）的任务数不超过密钥池容量，提交时由密钥池按各密钥的max_concurrent分配；
+        wait_for_completion时由任务跟踪器（tracker，默认临时创建）跟踪每个sid直到完成。
+        on_result为协程函数，每个任务结束时按完成顺序调用，可用于流式返回结果。
+        call(func, *args)为执行每次提交的函数（如工作池的run_as），不传时直接调用。
+        """
+        jobs = self._batch_jobs(jobs)
+        job_timeout = job_timeout or BATCH_CONFIG["job_timeout"]
+        slots = asyncio.Semaphore(self._batch_capacity(max_parallel))
+        waiter = None
+        if wait_for_completion:
+            waiter = tracker or TaskTracker(self.progress_scheduler.poll, TASK_TRACKER_CONFIG)
+        started = time.monotonic()
+        results = [None] * len(jobs)
+        # 先把全部任务记为排队中（一个事务），服务进程退出后未提交的任务会在重启时重新提交
+        job_ids = [None] * len(jobs)
+        if self.job_store is not None:
+            job_ids = await asyncio.to_thread(self.job_store.add_queued_many, "create_ppt_batch", jobs)
+        
+        async def _run(index, job):
+            job_started = time.monotonic()
+            sid, response = None, None
+            async with slots:
+                # 单个任务的任何异常（提交或等待完成时）只作为该任务的结果，不影响其他任务
+                try:
+                    submit = (self._submit_ppt_job, "create_ppt_batch", job, self._ppt_task_request(job),
+                              job_ids[index])
+                    response = await (call(*submit) if call else submit[0](*submit[1:]))
+                    sid = (response.get("data") or {}).get("sid") if response.get("code") == 0 else None
+                    snapshot = await waiter.wait(sid, job_timeout) if sid and waiter else None
+                    result = self._batch_job_result(index, job_started, sid, response, snapshot)
+                except Exception as e:
+                    result = self._batch_job_result(index, job_started, sid, response, error=str(e))
+            results[index] = result
+            if on_result:
+                try:
+                    await on_result(result)
+                except Exception as e:
+                    print(f"批量任务结果推送失败: {e}")
+        
+        finished = False
+        try:
+            async with self._holding_job_leases():
+                await asyncio.gather(*(_run(index, job) for index, job in enumerate(jobs)))
+            finished = True
+        finally:
+            if not finished and self.job_store is not None:
+                # 批量调用被取消（客户端断开等）：尚未提交的任务已无人等待，重启后不应再提交。
+                # 清理期间可能再次被取消，因此直接执行这一条更新语句而不等待线程池
+                self.job_store.cancel_queued(job_ids)
+            if waiter is not None and tracker is None:
+                await waiter.aclose()
+        return self._batch_summary(results, started)
+    
+    async def _fetch_theme_page(self, pay_type: str, page_num: int, page_size: int) -> dict:
+        """向上游请求一页模板列表（供模板目录抓取，不经过缓存）"""
+        params = self._theme_list_params(pay_type, page_num=page_num, page_size=page_size)
+        
+        async def _request(key_info):
+            return await self._send(key_info, "/template/list", params=params)
+        
+        return await self._hedged_request("/template/list", _request)
+    
+    async def _fetch_task_progress(self, sid: str) -> dict:
+        """向上游查询任务进度（幂等读请求，支持对冲）"""
+        async def _request(key_info):
+            return await self._send(key_info, "/progress", params={"sid": sid})
+        
+        return await self._hedged_request("/progress", _request)
+    
+    async def get_task_progress(self, sid: str) -> dict:
+        """查询PPT生成任务进度（经进度调度器合并同一sid的并发查询）"""
+        return await self.progress_scheduler.poll(sid)
+    
+    async def _generate_outline(self, content_key: str, request_func, use_cache: bool,
+                                upload: "DocumentUpload" = None) -> dict:
+        """大纲生成：先查磁盘缓存，未命中时合并相同的进行中请求，成功结果写入缓存
+        
+        upload为本次调用打开的本地文档，由本方法负责关闭：实际发出上游请求时
+        交给执行请求的任务在结束后关闭，命中缓存或合并到已有请求时立即关闭。
+        """
+        try:
+            if use_cache and self.outline_cache is not None:
+                cached = await asyncio.to_thread(self.outline_cache.get, content_key)
+                if cached is not None:
+                    return {**cached, "cache_hit": True}
+            
+            owned = None
+            if not self.outline_flight.in_flight(content_key):
+                owned, upload = upload, None
+            
+            async def _generate():
+                try:
+                    result = await self._make_request_with_retry(request_func)
+                    if self.outline_cache is not None and result.get("code") == 0:
+                        await asyncio.to_thread(self.outline_cache.put, content_key, result)
+                    return result
+                finally:
+                    if owned is not None:
+                        owned.close()
+            
+            return await self.outline_flight.do(content_key, _generate)
+        finally:
+            if upload is not None:
+                upload.close()
+    
+    async def create_outline(self, text: str, language: str = "cn", search: bool = False,
+                             use_cache: bool = True) -> dict:
+        """创建PPT大纲（相同内容命中本地缓存，相同的进行中请求合并为一次上游调用）"""
+        async def _request(key_info):
+            return await self._send(key_info, "/createOutline",
+                                    fields=self._outline_fields(text, language, search))
+        
+        content_key = _content_hash("/createOutline", text, language, search)
+        return await self._generate_outline(content_key, _request, use_cache)
+    
+    async def _outline_from_document_text(self, upload: "DocumentUpload", text: str, language: str,
+                                          search: bool, use_cache: bool, overflow: str) -> Optional[dict]:
+        """在本地提取文档文本并按文本方式生成大纲
+        
+        无法提取文本（doc、扫描件等）时返回None，由调用方按原文件上传；
+        字数超限且overflow为error时在任何网络请求之前抛出DocumentTooLong。
+        """
+        document_text = await asyncio.to_thread(extract_text, upload.view, upload.extension)
+        if not document_text:
+            return None
+        original_chars = count_chars(document_text)
+        # 字数限制针对整个提交内容：先扣除用户文本与文档引导语占用的字数；
+        # 引导语不含文件名，同一份文档以不同文件名上传时仍命中缓存
+        prefix = f"{text}\n\n以下是文档的内容：\n" if text else ""
+        max_chars = DOC_PREPROCESS_CONFIG["max_chars"]
+        budget = max_chars - count_chars(prefix)
+        try:
+            if budget <= 0:
+                raise DocumentTooLong(count_chars(prefix) + original_chars, max_chars)
+            try:
+                document_text, handling = fit_text(document_text, budget,
+                                                   overflow or DOC_PREPROCESS_CONFIG["overflow"])
+            except DocumentTooLong as e:
+                raise DocumentTooLong(count_chars(prefix) + e.chars, max_chars) from e
+        except DocumentTooLong:
+            self._preprocess_stats["rejected"] += 1
+            raise
+        
+        query = prefix + document_text
+        bytes_saved = max(0, upload.size - len(query.encode("utf-8")))
+        self._preprocess_stats["as_text"] += 1
+        self._preprocess_stats["bytes_saved"] += bytes_saved
+        if handling != "none":
+            self._preprocess_stats[f"{handling}d"] += 1
+        upload.close()
+        
+        result = await self.create_outline(query, language, search, use_cache)
+        return {**result, "preprocess": {
+            "mode": "text",
+            "original_chars": original_chars,
+            "submitted_chars": count_chars(query),
+            "overflow_handling": handling,
+            "upload_bytes_saved": bytes_saved
+        }}
+    
+    async def create_outline_by_doc(self, file_name: str, text: str, file_url: str = None,
+                                    file_path: str = None, language: str = "cn",
+                                    search: bool = False, use_cache: bool = True,
+                                    preprocess: bool = None, overflow: str = None,
+                                    prefetch: bool = None) -> dict:
+        """从文档创建PPT大纲（按文档内容与文本命中本地缓存）
+        
+        本地txt/md/docx默认先提取文本并按文本方式生成大纲，只提交压缩后的文本；
+        preprocess=False时按原文件上传。overflow指定超过字数限制时的处理方式。
+        服务端启用预取时先下载file_url，之后与本地文档一样按内容去重、命中缓存；
+        prefetch=False可关闭本次调用的预取，但服务端未启用时prefetch=True不会开启预取。
+        """
+        if not file_url and not file_path:
+            raise ValueError("file_url 或 file_path 必须提供其中一个")
+        
+        upload = None
+        if file_url and self.prefetch_config["enabled"] and prefetch is not False:
+            content = await self.document_fetcher.fetch(file_url)
+            upload = await asyncio.to_thread(DocumentUpload, file_url, file_name, None, content)
+            self.document_fetcher.mark_seen(upload.sha256)
+            file_url = None
+        elif not file_url:
+            # 打开、校验与计算内容指纹放到线程中，避免阻塞事件循环；校验失败时不会发生网络请求
+            upload = await asyncio.to_thread(DocumentUpload, file_path, file_name)
+        
+        if upload is not None:
+            if DOC_PREPROCESS_CONFIG["enabled"] if preprocess is None else preprocess:
+                try:
+                    result = await self._outline_from_document_text(upload, text, language, search,
+                                                                     use_cache, overflow)
+                except BaseException:
+                    upload.close()
+                    raise
+                if result is not None:
+                    return result
+            self._preprocess_stats["uploaded"] += 1
+        
+        async def _request(key_info):
+            fields = self._outline_by_doc_fields(file_name, text, language, search)
+            if file_url:
+                fields["fileUrl"] = file_url
+            else:
+                fields["file"] = (upload.file_name, upload.reader(), 'application/octet-stream')
+            return await self._send(key_info, "/createOutlineByDoc", fields=fields)
+        
+        # 本地文件按内容（而不是路径或文件名）识别相同请求
+        source = file_url or upload.sha256
+        content_key = _content_hash("/createOutlineByDoc", text, language, search, source)
+        return await self._generate_outline(content_key, _request, use_cache, upload)
+    
+    async def create_ppt_by_outline(self, text: str, outline: dict, template_id: str,
+                                    author: str = "XXXX", is_card_note: bool = True,
+                                    search: bool = False, is_figure: bool = True,
+                                    ai_image: str = "normal") -> dict:
+        """根据大纲创建PPT - 使用直接创建方式（绕过API bug）"""
+        full_query = self._outline_to_query(text, outline)
+        
+        params = {"text": full_query, "template_id": template_id, "author": author,
+                  "is_card_note": is_card_note, "search": search, "is_figure": is_figure, "ai_image": ai_image}
+        
+        async def _request(key_info):
+            # 使用create接口（已知可以工作）
+            fields = self._ppt_task_fields(**params)
+            result = await self._send(key_info, "/create", fields=fields)
+            self._log_outline_debug(result, template_id, full_query, key_info)
+            return result
+        
+        return await self._submit_ppt_job("create_ppt_by_outline", params, _request)
+
+class WorkerPoolRejected(Exception):
+    """工具调用工作池已满，请求被拒绝"""
+
+# 工具调用的优先级类别（按排队时的默认权重从高到低）
+PRIORITY_CLASSES = ("interactive", "outline", "generation", "batch")
+DEFAULT_TENANT = "default"
+
+class ToolWorkerPool:
+    """工具调用工作池 - 限制同时执行的API调用数量，并统计排队深度与等待时间
+    
+    协程函数在事件循环上受限执行，普通（阻塞）函数投递到有界线程池执行，
+    从而保证突发负载下tools/list与心跳仍能及时响应。
+    
+    工作池满时按加权公平排队调度：每个（优先级, 租户）为一条队列，权重为优先级权重
+    与租户权重之积，空出的名额交给虚拟完成时间最早的请求。因此交互查询会插到批量
+    提交之前，同一优先级下单个租户排再多请求也只能按权重分得名额，不会饿死其他租户。
+    """
+    
+    def __init__(self, max_workers: int, rejection_policy: str = "queue",
+                 max_queue_size: int = None, queue_timeout: float = None,
+                 priority_weights: dict = None, tenant_weights: dict = None):
+        if rejection_policy not in ("queue", "fail_fast"):
+            raise ValueError(f"未知的拒绝策略: {rejection_policy}")
+        self.max_workers = max(1, int(max_workers))
+        self.rejection_policy = rejection_policy
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self.priority_weights = {**TOOL_WORKER_POOL_CONFIG["priority_weights"], **(priority_weights or {})}
+        self.tenant_weights = dict(tenant_weights or {})
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix="aippt-worker")
+        self._slots_used = 0
+        self._queue: list = []  # 堆：(虚拟完成时间, 序号, future, 优先级)
+        self._sequence = 0
+        self._virtual_time = 0.0
+        self._finish_tags: dict[tuple, float] = {}  # (优先级, 租户) -> 最近一次排队的虚拟完成时间
+        self._active = 0
+        self._waiting = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "max_queue_depth": 0,
+            "total_wait_time": 0.0,
+            "max_wait_time": 0.0
+        }
+        self._priority_stats = {priority: {"submitted": 0, "waiting": 0, "total_wait_time": 0.0,
+                                           "max_wait_time": 0.0} for priority in PRIORITY_CLASSES}
+    
+    def _reject(self, reason: str):
+        self._stats["rejected"] += 1
+        raise WorkerPoolRejected(f"服务繁忙，{reason}（执行中 {self._active}/{self.max_workers}，排队 {self._waiting}）")
+    
+    async def _acquire(self, priority: str, tenant: str):
+        """占用一个名额：有空闲且无人排队时立即返回，否则按加权公平顺序排队"""
+        if self._slots_used < self.max_workers and not self._queue:
+            self._slots_used += 1
+            return
+        flow = (priority, tenant)
+        weight = self.priority_weights[priority] * self.tenant_weights.get(tenant, 1)
+        tag = max(self._virtual_time, self._finish_tags.get(flow, 0.0)) + 1.0 / weight
+        self._finish_tags[flow] = tag
+        future = asyncio.get_running_loop().create_future()
+        self._sequence += 1
+        heapq.heappush(self._queue, (tag, self._sequence, future, priority))
+        try:
+            if self.queue_timeout:
+                await asyncio.wait_for(future, timeout=self.queue_timeout)
+            else:
+                await future
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # 名额已移交给本请求，转交下一个排队者
+                self._release()
+            else:
+                future.cancel()
+            raise
+    
+    def _release(self):
+        """释放名额：直接移交给虚拟完成时间最早的排队请求"""
+        while self._queue:
+            tag, _, future, _ = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self._virtual_time = tag
+            future.set_result(None)
+            return
+        self._slots_used -= 1
+        # 没有积压时各队列的进度差不再有意义
+        self._finish_tags.clear()
+    
+    async def run(self, func, *args, **kwargs):
+        """在工作池中执行函数：协程函数直接等待，阻塞函数在线程池中执行"""
+        return await self.run_as("generation", DEFAULT_TENANT, func, *args, **kwargs)
+    
+    async def run_as(self, priority: str, tenant: Optional[str], func, *args, **kwargs):
+        """以指定优先级与租户在工作池中执行函数"""
+        if priority not in self.priority_weights:
+            raise ValueError(f"未知的优先级: {priority}，可选: {'、'.join(self.priority_weights)}")
+        tenant = tenant or DEFAULT_TENANT
+        self._stats["submitted"] += 1
+        priority_stats = self._priority_stats.setdefault(
+            priority, {"submitted": 0, "waiting": 0, "total_wait_time": 0.0, "max_wait_time": 0.0})
+        priority_stats["submitted"] += 1
+        
+        if self._slots_used >= self.max_workers:
+            if self.rejection_policy == "fail_fast":
+                self._reject("工作池已满")
+            if self.max_queue_size is not None and self._waiting >= self.max_queue_size:
+                self._reject("排队已满")
+        
+        enqueued_at = time.monotonic()
+        self._waiting += 1
+        priority_stats["waiting"] += 1
+        self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._waiting)
+        try:
+            await self._acquire(priority, tenant)
+        except asyncio.TimeoutError:
+            self._reject(f"排队超过{self.queue_timeout}秒")
+        finally:
+            self._waiting -= 1
+            priority_stats["waiting"] -= 1
+        
+        wait_time = time.monotonic() - enqueued_at
+        self._stats["total_wait_time"] += wait_time
+        self._stats["max_wait_time"] = max(self._stats["max_wait_time"], wait_time)
+        priority_stats["total_wait_time"] += wait_time
+        priority_stats["max_wait_time"] = max(priority_stats["max_wait_time"], wait_time)
+        
+        self._active += 1
+        call_deadline = _call_deadline.get()
+        if call_deadline is not None:
+            # 工具调用的总时限从放行时开始计时，排队时间不计入
+            call_deadline.start()
+        try:
+            if inspect.iscoroutinefunction(func):
+                result = await func(*args, **kwargs)
+            else:
+                loop = asyncio.get_running_loop()
+                # 复制上下文，工作线程中的同步请求同样受工具调用截止时间约束
+                result = await loop.run_in_executor(
+                    self._executor, partial(contextvars.copy_context().run, func, *args, **kwargs))
+            self._stats["completed"] += 1
+            return result
+        except Exception:
+            self._stats["failed"] += 1
+            raise
+        finally:
+            self._active -= 1
+            self._release()
+    
+    def get_stats(self):
+        """获取工作池统计"""
+        started = self._stats["completed"] + self._stats["failed"] + self._active
+        return {
+            "max_workers": self.max_workers,
+            "rejection_policy": self.rejection_policy,
+            "active": self._active,
+            "queue_depth": self._waiting,
+            **self._stats,
+            "avg_wait_time": self._stats["total_wait_time"] / max(started, 1),
+            "by_priority": {
+                priority: {
+                    "weight": self.priority_weights.get(priority),
+                    "submitted": stats["submitted"],
+                    "queue_depth": stats["waiting"],
+                    "avg_wait_time": stats["total_wait_time"] / max(stats["submitted"] - stats["waiting"], 1),
+                    "max_wait_time": stats["max_wait_time"]
+                } for priority, stats in self._priority_stats.items()
+            }
+        }
+    
+    def shutdown(self):
+        """关闭线程池"""
+        self._executor.shutdown(wait=False)
+
+def create_tool_worker_pool(client: BaseAIPPTClient, config: dict = None) -> ToolWorkerPool:
+    """根据密钥池容量创建工具调用工作池"""
+    config = config or TOOL_WORKER_POOL_CONFIG
+    max_workers = config.get("max_workers") or sum(
+        key.get("max_concurrent", 10) for key in client.key_pool_manager.key_pool) or 1
+    return ToolWorkerPool(
+        max_workers=max_workers,
+        rejection_policy=config.get("rejection_policy", "queue"),
+        max_queue_size=config.get("max_queue_size"),
+        queue_timeout=config.get("queue_timeout"),
+        priority_weights=config.get("priority_weights"),
+        tenant_weights=config.get("tenant_weights")
+    )
+
+# 超出租户配额时的JSON-RPC错误码（实现自定义的服务器错误区间）
+QUOTA_EXCEEDED_CODE = -32029
+
+class QuotaExceeded(Exception):
+    """租户的并发或频率配额已用完"""
+    
+    def __init__(self, tenant: str, reason: str, limit, retry_after: float = None):
+        if reason == "concurrency":
+            message = f"租户 {tenant} 同时进行的工具调用已达上限 {limit}，请等待已有调用完成后重试"
+        else:
+            message = f"租户 {tenant} 的调用频率超过每分钟 {limit} 次，请 {retry_after:.1f} 秒后重试"
+        super().__init__(message)
+        self.tenant = tenant
+        self.reason = reason
+        self.limit = limit
+        self.retry_after = retry_after
+    
+    def to_error(self) -> dict:
+        """JSON-RPC错误对象"""
+        data = {"tenant": self.tenant, "reason": self.reason, "limit": self.limit}
+        if self.retry_after is not None:
+            data["retry_after"] = round(self.retry_after, 3)
+        return {"code": QUOTA_EXCEEDED_CODE, "message": str(self), "data": data}
+
+class TenantRequired(QuotaExceeded):
+    """启用租户配额时，HTTP请求无法确定经过认证的租户（未携带或携带了无效的租户令牌）"""
+    
+    def __init__(self, invalid_token: bool = False):
+        if invalid_token:
+            Exception.__init__(self, "租户令牌无效，请检查 Authorization 请求头中的令牌")
+        else:
+            Exception.__init__(self, "已启用租户配额，请在请求头 Authorization: Bearer <租户令牌> 中携带租户令牌")
+        self.tenant, self.limit, self.retry_after = None, None, None
+        self.reason = "invalid_token" if invalid_token else "tenant_required"
+    
+    def to_error(self) -> dict:
+        """JSON-RPC错误对象"""
+        return {"code": types.INVALID_REQUEST, "message": str(self), "data": {"reason": self.reason}}
+
+class TenantQuotas:
+    """按租户限制工具调用的并发数与频率（令牌桶）
+    
+    在调用进入工作池之前检查，超出配额时立即拒绝而不排队，
+    避免单个调用方占满工作池与密钥池，影响整个部署的其他调用方。
+    """
     
-    def get_task_progress(self, sid: str) -> dict:
-        """查询PPT生成任务进度"""
-        def _request(key_info):
-            url = f"{self.base_url}/progress"
-            headers = self._get_headers(key_info)
-            
-            response = requests.get(url, headers=headers, params={"sid": sid})
-            return response.json()
-        
-        return self._make_request_with_retry(_request)
+    def __init__(self, max_concurrent: int = None, rate_per_minute: float = None, burst: int = None,
+                 exempt_tools=(), overrides: dict = None, idle_ttl: float = 600):
+        self.max_concurrent = max_concurrent
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.exempt_tools = set(exempt_tools or ())
+        self.overrides = dict(overrides or {})
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._tenants: dict[str, dict] = {}
+        self._last_sweep = time.monotonic()
+        self._stats = {"admitted": 0, "rejected_concurrency": 0, "rejected_rate": 0}
     
-    def create_outline(self, text: str, language: str = "cn", search: bool = False) -> dict:
-        """创建PPT大纲"""
-        def _request(key_info):
-            url = f"{self.base_url}/createOutline"
-            timestamp = int(time.time())
-            signature = self._get_signature(key_info["app_id"], key_info["api_secret"], timestamp)
-            
-            # 使用form-data格式而不是JSON
-            form_data = MultipartEncoder(fields={
-                "query": text,
-                "language": language,
-                "search": str(search)
-            })
-            
-            headers = {
-                "appId": key_info["app_id"],
-                "timestamp": str(timestamp),
-                "signature": signature,
-                "Content-Type": form_data.content_type
-            }
-            
-            response = requests.post(url, data=form_data, headers=headers)
-            return response.json()
-        
-        return self._make_request_with_retry(_request)
+    def _limits(self, tenant: str) -> tuple:
+        override = self.overrides.get(tenant, {})
+        rate = override.get("rate_per_minute", self.rate_per_minute)
+        burst = override.get("burst", self.burst) or (max(1.0, rate / 4) if rate else None)
+        return override.get("max_concurrent", self.max_concurrent), rate, burst
     
-    def create_outline_by_doc(self, file_name: str, text: str, file_url: str = None,
-                             file_path: str = None, language: str = "cn", 
-                             search: bool = False) -> dict:
-        """从文档创建PPT大纲"""
-        def _request(key_info):
-            url = f"{self.base_url}/createOutlineByDoc"
-            timestamp = int(time.time())
-            signature = self._get_signature(key_info["app_id"], key_info["api_secret"], timestamp)
-            
-            fields = {
-                "fileName": file_name,
-                "query": text,
-                "language": language,
-                "search": str(search)
-            }
-            
-            if file_url:
-                fields["fileUrl"] = file_url
-            elif file_path:
-                fields["file"] = (file_path, open(file_path, 'rb'), 'application/octet-stream')
-            else:
-                raise ValueError("file_url 或 file_path 必须提供其中一个")
-            
-            form_data = MultipartEncoder(fields=fields)
-            
-            headers = {
-                "appId": key_info["app_id"],
-                "timestamp": str(timestamp),
-                "signature": signature,
-                "Content-Type": form_data.content_type
-            }
+    def try_acquire(self, tenant: str, tool_name: str = None):
+        """占用租户的一次调用配额，返回释放函数；超出配额时抛出QuotaExceeded"""
+        if tool_name in self.exempt_tools:
+            return lambda: None
+        max_concurrent, rate, burst = self._limits(tenant)
+        now = time.monotonic()
+        with self._lock:
+            self._sweep_locked(now)
+            state = self._tenants.get(tenant)
+            if state is None:
+                state = self._tenants[tenant] = {"active": 0, "tokens": burst, "updated": now,
+                                                 "calls": 0, "rejected": 0}
+            if rate:
+                state["tokens"] = min(burst, state["tokens"] + (now - state["updated"]) * rate / 60)
+            state["updated"] = now
             
-            response = requests.post(url, data=form_data, headers=headers)
-            return response.json()
+            if max_concurrent and state["active"] >= max_concurrent:
+                state["rejected"] += 1
+                self._stats["rejected_concurrency"] += 1
+                raise QuotaExceeded(tenant, "concurrency", max_concurrent)
+            if rate and state["tokens"] < 1:
+                state["rejected"] += 1
+                self._stats["rejected_rate"] += 1
+                raise QuotaExceeded(tenant, "rate", rate, (1 - state["tokens"]) * 60 / rate)
+            if rate:
+                state["tokens"] -= 1
+            state["active"] += 1
+            state["calls"] += 1
+            self._stats["admitted"] += 1
         
-        return self._make_request_with_retry(_request)
+        released = False
+        
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            with self._lock:
+                state["active"] -= 1
+                state["updated"] = time.monotonic()
+        return release
     
-    def create_ppt_by_outline(self, text: str, outline: dict, template_id: str,
-                             author: str = "XXXX", is_card_note: bool = True,
-                             search: bool = False, is_figure: bool = True,
-                             ai_image: str = "normal") -> dict:
-        """根据大纲创建PPT - 使用直接创建方式（绕过API bug）"""
-        def _request(key_info):
-            # 由于createPptByOutline接口存在99999系统异常问题
-            # 改用create接口，将大纲信息融合到query文本中
-            
-            # 将大纲转换为文本描述
-            outline_text = f"标题：{outline.get('title', text)}\n"
-            if outline.get('subTitle'):
-                outline_text += f"副标题：{outline['subTitle']}\n"
-            
-            outline_text += "\n内容要点：\n"
-            for i, chapter in enumerate(outline.get('chapters', []), 1):
-                chapter_title = chapter.get('chapterTitle', f'第{i}部分')
-                outline_text += f"{i}. {chapter_title}\n"
-                
-                # 处理章节内容
-                contents = chapter.get('contents', [])
-                if isinstance(contents, list):
-                    for content in contents:
-                        if isinstance(content, str):
-                            outline_text += f"   - {content}\n"
-                        elif isinstance(content, dict) and 'chapterTitle' in content:
-                            outline_text += f"   - {content['chapterTitle']}\n"
-            
-            # 构建完整的查询文本
-            full_query = f"{text}\n\n{outline_text}"
-            
-            # 使用create接口（已知可以工作）
-            url = f"{self.base_url}/create"
-            timestamp = int(time.time())
-            signature = self._get_signature(key_info["app_id"], key_info["api_secret"], timestamp)
-            
-            form_data = MultipartEncoder(
-                fields={
-                    "query": full_query,
-                    "templateId": template_id,
-                    "author": author,
-                    "isCardNote": str(is_card_note),
-                    "search": str(search),
-                    "isFigure": str(is_figure),
-                    "aiImage": ai_image
-                }
-            )
-            
-            headers = {
-                "appId": key_info["app_id"],
-                "timestamp": str(timestamp),
-                "signature": signature,
-                "Content-Type": form_data.content_type
+    @contextmanager
+    def hold(self, tenant: str, tool_name: str = None):
+        """在with块内占用一次调用配额"""
+        release = self.try_acquire(tenant, tool_name)
+        try:
+            yield
+        finally:
+            release()
+    
+    def _sweep_locked(self, now: float):
+        """清理长时间空闲的租户状态（空闲期间令牌桶已回满，删除不影响配额）"""
+        if now - self._last_sweep < min(60.0, self.idle_ttl):
+            return
+        self._last_sweep = now
+        for tenant in [t for t, state in self._tenants.items()
+                       if state["active"] == 0 and now - state["updated"] > self.idle_ttl]:
+            del self._tenants[tenant]
+    
+    def get_stats(self) -> dict:
+        with self._lock:
+            busiest = sorted(self._tenants.items(), key=lambda item: (-item[1]["active"], -item[1]["calls"]))[:10]
+            return {
+                "max_concurrent": self.max_concurrent,
+                "rate_per_minute": self.rate_per_minute,
+                "tenants": len(self._tenants),
+                **self._stats,
+                "top_tenants": {tenant: {"active": state["active"], "calls": state["calls"],
+                                         "rejected": state["rejected"]} for tenant, state in busiest}
             }
-            
-            response = requests.post(url, data=form_data, headers=headers)
-            result = response.json()
-            
-            # 添加调试信息
-            if result.get('code') != 0:
-                print(f"DEBUG - 使用直接创建方式的详细信息:")
-                print(f"  模板ID: {template_id}")
-                print(f"  查询文本长度: {len(full_query)}")
-                print(f"  使用密钥: {key_info.get('name', 'unnamed')}")
-                print(f"  响应: {result}")
-            
-            return result
-        
-        return self._make_request_with_retry(_request)
+
+def create_tenant_quotas(config: dict = None) -> Optional[TenantQuotas]:
+    """根据配置创建租户配额，未启用时返回None"""
+    config = config or TENANT_QUOTA_CONFIG
+    if not config.get("enabled"):
+        return None
+    return TenantQuotas(
+        max_concurrent=config.get("max_concurrent"),
+        rate_per_minute=config.get("rate_per_minute"),
+        burst=config.get("burst"),
+        exempt_tools=config.get("exempt_tools", ()),
+        overrides=config.get("overrides"),
+        idle_ttl=config.get("idle_ttl", 600)
+    )
 
 # 创建MCP服务器
 server = Server("pptmcpseriver")
-aippt_client = AIPPTClient()
+aippt_client = AsyncAIPPTClient(
+    template_catalog_config=TEMPLATE_CATALOG_CONFIG if TEMPLATE_CATALOG_CONFIG["enabled"] else None,
+    outline_cache_config=OUTLINE_CACHE_CONFIG if OUTLINE_CACHE_CONFIG["enabled"] else None,
+    job_store_config=JOB_STORE_CONFIG if JOB_STORE_CONFIG["enabled"] else None)
+tool_worker_pool = create_tool_worker_pool(aippt_client)
+tenant_quotas = create_tenant_quotas()
+task_tracker = TaskTracker(aippt_client.progress_scheduler.poll, TASK_TRACKER_CONFIG,
+                           on_change=aippt_client.job_store.update_progress if aippt_client.job_store else None)
+
+def _start_job_recovery():
+    """服务启动时在后台恢复任务存储中未结束的任务"""
+    if aippt_client.job_store is None:
+        return
+    
+    async def _recover():
+        try:
+            await aippt_client.resume_jobs(task_tracker)
+        except Exception as e:
+            print(f"任务恢复失败: {e}")
+    asyncio.ensure_future(_recover())
+
+# 当前工具调用的进度推送通道（http-stream传输下由本次请求的SSE响应提供）
+_progress_sink: contextvars.ContextVar = contextvars.ContextVar("progress_sink", default=None)
+# 当前工具调用所属的租户（HTTP类传输按请求头设置，stdio/SSE传输按MCP会话区分）
+_request_tenant: contextvars.ContextVar = contextvars.ContextVar("request_tenant", default=None)
+
+# 各工具在工作池中排队时的优先级类别
+TOOL_PRIORITY_CLASSES = {
+    "get_theme_list": "interactive",
+    "get_task_progress": "interactive",
+    "create_outline": "outline",
+    "create_outline_by_doc": "outline",
+    "create_ppt_task": "generation",
+    "create_ppt_by_outline": "generation",
+    "create_full_ppt_workflow": "generation",
+    "create_ppt_batch": "batch",
+}
+
+def _current_tenant() -> str:
+    """当前工具调用的租户标识，用于工作池的公平排队"""
+    tenant = _request_tenant.get()
+    if tenant:
+        return tenant
+    try:
+        return f"session-{id(server.request_context.session)}"
+    except LookupError:
+        return DEFAULT_TENANT
+
+def _acquire_tool_quota(tool_name: str, tenant: str = None):
+    """占用当前租户的工具调用配额，返回释放函数；超出配额时抛出QuotaExceeded"""
+    if tenant_quotas is None:
+        return lambda: None
+    return tenant_quotas.try_acquire(tenant or _current_tenant(), tool_name)
+
+def _bearer_token(request) -> Optional[str]:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer":
+        return None
+    return token.strip() or None
+
+def _authenticated_tenant(request) -> Optional[str]:
+    """HTTP请求经过认证的租户，无法确定时返回None
+    
+    租户取自Authorization中的租户令牌（按tenant_tokens映射）；只有trust_tenant_header开启时
+    才取X-Tenant-Id请求头。携带了令牌时不再看请求头，令牌无效即为None。
+    """
+    tokens = TENANT_QUOTA_CONFIG.get("tenant_tokens") or {}
+    token = _bearer_token(request)
+    if tokens and token:
+        return tokens.get(token)
+    if TENANT_QUOTA_CONFIG.get("trust_tenant_header"):
+        return request.headers.get("x-tenant-id") or None
+    return None
+
+def _acquire_http_tool_quota(request, tool_name: str):
+    """HTTP类传输的配额检查，返回释放函数
+    
+    配额按经过认证的租户计算：客户端自行设置的请求头不能作为租户，否则每次换一个值即可绕过配额，
+    冒用其他调用方的值则会耗尽对方的配额。客户端地址也不能区分NAT或反向代理后面的多个调用方，
+    因此启用配额且require_tenant为True时，计配额的工具调用必须能确定租户，否则抛出TenantRequired。
+    """
+    if tenant_quotas is None:
+        return lambda: None
+    tenant = _authenticated_tenant(request)
+    if not tenant and tool_name not in tenant_quotas.exempt_tools:
+        invalid_token = bool(TENANT_QUOTA_CONFIG.get("tenant_tokens") and _bearer_token(request))
+        if invalid_token or TENANT_QUOTA_CONFIG.get("require_tenant", True):
+            raise TenantRequired(invalid_token)
+    return _acquire_tool_quota(tool_name, tenant)
+
+def _quota_error_response(request_id, error: QuotaExceeded) -> dict:
+    """超出配额时的JSON-RPC错误响应"""
+    return {"jsonrpc": "2.0", "id": request_id, "error": error.to_error()}
+
+def _http_request_tenant(request) -> Optional[str]:
+    """HTTP请求的租户：优先经过认证的租户，其次Mcp-Session-Id，最后客户端地址
+    
+    后两者由客户端决定，加上前缀后不会与经过认证的租户重名（不能借此获得其他租户的权重或配额）。
+    """
+    tenant = _authenticated_tenant(request)
+    if tenant:
+        return tenant
+    session_id = request.headers.get("mcp-session-id")
+    if session_id:
+        return f"session-{session_id}"
+    return f"client-{request.client.host}" if request.client else None
+
+def _progress_payload(snapshot: dict) -> dict:
+    """进度通知内容（去掉上游原始响应）"""
+    return {key: value for key, value in snapshot.items() if key != "response"}
+
+def _progress_message(snapshot: dict) -> str:
+    if snapshot.get("total_pages"):
+        return f"{snapshot['status']} {snapshot['done_pages']}/{snapshot['total_pages']}页"
+    return snapshot["status"]
+
+def _make_progress_notifier(after_response: bool = False):
+    """返回向当前调用方推送任务进度的协程函数，没有可推送的通道时返回None
+    
+    - http-stream传输：写入本次请求的SSE响应（仅在请求处理期间有效）
+    - stdio/SSE传输：请求带progressToken时发送notifications/progress，
+      否则（或需要在响应返回后继续推送时）发送notifications/message日志通知
+    """
+    sink = _progress_sink.get()
+    if sink is not None:
+        return None if after_response else sink
+    try:
+        ctx = server.request_context
+    except LookupError:
+        return None
+    
+    session = ctx.session
+    token = getattr(ctx.meta, "progressToken", None) if ctx.meta else None
+    if token is not None and not after_response:
+        async def notify(snapshot: dict):
+            await session.send_progress_notification(
+                token, snapshot["progress"], 100,
+                message=_progress_message(snapshot), related_request_id=ctx.request_id)
+        return notify
+    
+    async def notify(snapshot: dict):
+        await session.send_log_message("info", _progress_payload(snapshot), logger="task_progress")
+    return notify
+
+def _watch_created_task(sid: Optional[str]):
+    """任务创建成功后由服务端跟踪进度，并向当前会话推送后续进度变化"""
+    if not sid:
+        return
+    notifier = _make_progress_notifier(after_response=True)
+    if notifier is not None:
+        task_tracker.subscribe(sid, notifier)
+    elif aippt_client.job_store is not None:
+        # 没有推送通道时仍跟踪到结束，使任务存储中的状态保持最新
+        task_tracker.track(sid)
 
 @server.list_tools()
 async def handle_list_tools() -> list[Tool]:
@@ -480,7 +3140,7 @@ async def handle_list_tools() -> list[Tool]:
         ),
         Tool(
             name="create_ppt_task",
-            description="创建PPT生成任务。使用说明：1. 在调用本工具前，必须先调用get_theme_list获取有效的template_id。2. 工具会返回任务ID(sid)，需用get_task_progress轮询查询进度。3. 任务完成后，可从get_task_progress结果中获取PPT下载地址。4. 需先设置环境变量AIPPT_APP_ID和AIPPT_API_SECRET。",
+            description="创建PPT生成任务。使用说明：1. 在调用本工具前，必须先调用get_theme_list获取有效的template_id。2. 工具会返回任务ID(sid)，可用wait_for_task等待完成（服务端推送进度），或用get_task_progress查询当前进度。3. 任务完成后，可从wait_for_task或get_task_progress结果中获取PPT下载地址。4. 需先设置环境变量AIPPT_APP_ID和AIPPT_API_SECRET。",
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -523,7 +3183,7 @@ async def handle_list_tools() -> list[Tool]:
         ),
         Tool(
             name="get_task_progress",
-            description="查询PPT生成任务进度。使用说明：1. 用于查询通过create_ppt_task或create_ppt_by_outline创建的任务进度。2. 需定期轮询本工具直到任务完成。3. 任务完成后，可从返回结果中获取PPT下载地址。4. 需先设置环境变量AIPPT_APP_ID和AIPPT_API_SECRET。",
+            description="查询PPT生成任务进度。使用说明：1. 用于查询通过create_ppt_task或create_ppt_by_outline创建的任务进度。2. 只需查询一次当前状态；需要等待完成时请使用wait_for_task，无需反复轮询。3. 任务完成后，可从返回结果中获取PPT下载地址。4. 需先设置环境变量AIPPT_APP_ID和AIPPT_API_SECRET。",
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -535,6 +3195,25 @@ async def handle_list_tools() -> list[Tool]:
                 "required": ["sid"]
             }
         ),
+        Tool(
+            name="wait_for_task",
+            description="等待PPT生成任务完成。使用说明：1. 服务端集中轮询任务进度，任务完成（或失败）时立即返回，超时则返回当前进度。2. 等待期间通过MCP进度通知推送生成进度（请求带progressToken时）。3. 返回结果中的ppt_url为PPT下载地址。4. 替代反复调用get_task_progress。",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "sid": {
+                        "type": "string",
+                        "description": "任务ID，从create_ppt_task、create_ppt_by_outline或create_full_ppt_workflow获取"
+                    },
+                    "timeout": {
+                        "type": "number",
+                        "description": f"最长等待时间（秒），最大{TASK_TRACKER_CONFIG['max_wait']}",
+                        "default": 300
+                    }
+                },
+                "required": ["sid"]
+            }
+        ),
         Tool(
             name="create_outline",
             description="创建PPT大纲。使用说明：1. 用于根据文本内容生成PPT大纲。2. 生成的大纲可用于create_ppt_by_outline工具。3. 可通过search参数控制是否联网搜索补充内容。4. 需先设置环境变量AIPPT_APP_ID和AIPPT_API_SECRET。",
@@ -554,6 +3233,11 @@ async def handle_list_tools() -> list[Tool]:
                         "type": "boolean",
                         "description": "是否联网搜索，True表示联网搜索补充内容，False表示不联网",
                         "default": False
+                    },
+                    "use_cache": {
+                        "type": "boolean",
+                        "description": "是否使用本地大纲缓存，相同内容直接返回上次生成的大纲；False表示强制重新生成",
+                        "default": True
                     }
                 },
                 "required": ["text"]
@@ -561,7 +3245,7 @@ async def handle_list_tools() -> list[Tool]:
         ),
         Tool(
             name="create_outline_by_doc",
-            description="从文档创建PPT大纲。使用说明：1. 用于根据文档内容生成PPT大纲。2. 支持通过file_url或file_path上传文档。3. 文档格式支持：pdf(不支持扫描件)、doc、docx、txt、md。4. 文档大小限制：10M以内，字数限制8000字以内。5. 生成的大纲可用于create_ppt_by_outline工具。6. 需先设置环境变量AIPPT_APP_ID和AIPPT_API_SECRET。",
+            description="从文档创建PPT大纲。使用说明：1. 用于根据文档内容生成PPT大纲。2. 支持通过file_url或file_path上传文档。3. 文档格式支持：pdf(不支持扫描件)、doc、docx、txt、md。4. 文档大小限制：10M以内，字数限制8000字以内。本地txt/md/docx文档会先在本地提取文本并统计字数（连同text合计不超过8000字），超限时立即返回错误，或按overflow参数截断/压缩后以文本方式提交。5. 生成的大纲可用于create_ppt_by_outline工具。6. 需先设置环境变量AIPPT_APP_ID和AIPPT_API_SECRET。",
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -590,6 +3274,26 @@ async def handle_list_tools() -> list[Tool]:
                         "type": "boolean",
                         "description": "是否联网搜索，True表示联网搜索补充内容，False表示不联网",
                         "default": False
+                    },
+                    "use_cache": {
+                        "type": "boolean",
+                        "description": "是否使用本地大纲缓存，相同文档与文本直接返回上次生成的大纲；False表示强制重新生成",
+                        "default": True
+                    },
+                    "preprocess": {
+                        "type": "boolean",
+                        "description": "是否在本地提取文档文本（txt、md、docx；pdf按原文件上传）并以文本方式生成大纲，只提交文本而不上传文件；False表示按原文件上传",
+                        "default": True
+                    },
+                    "overflow": {
+                        "type": "string",
+                        "description": "本地提取的文档超过8000字时的处理方式：error（直接返回错误）、truncate（截断到限制内）、condense（保留标题与各段首句压缩到限制内）",
+                        "enum": ["error", "truncate", "condense"],
+                        "default": "error"
+                    },
+                    "prefetch": {
+                        "type": "boolean",
+                        "description": "服务端已启用预取时，传入false可让本次调用改由讯飞智文直接拉取file_url；服务端未启用预取时传入true无效。预取时下载后按文档内容去重，相同内容直接复用已生成的大纲，并按本地文档进行文本预处理"
                     }
                 },
                 "required": ["file_name", "text"]
@@ -597,7 +3301,7 @@ async def handle_list_tools() -> list[Tool]:
         ),
         Tool(
             name="create_ppt_by_outline",
-            description="根据大纲创建PPT - 使用直接创建方式（绕过API bug）。使用说明：1. 用于根据已生成的大纲创建PPT。2. 大纲需通过create_outline或create_outline_by_doc工具生成。3. template_id需通过get_theme_list工具获取。4. 工具会返回任务ID(sid)，需用get_task_progress轮询查询进度。5. 任务完成后，可从get_task_progress结果中获取PPT下载地址。6. 需先设置环境变量AIPPT_APP_ID和AIPPT_API_SECRET。",
+            description="根据大纲创建PPT - 使用直接创建方式（绕过API bug）。使用说明：1. 用于根据已生成的大纲创建PPT。2. 大纲需通过create_outline或create_outline_by_doc工具生成。3. template_id需通过get_theme_list工具获取。4. 工具会返回任务ID(sid)，可用wait_for_task等待完成（服务端推送进度），或用get_task_progress查询当前进度。5. 任务完成后，可从wait_for_task或get_task_progress结果中获取PPT下载地址。6. 需先设置环境变量AIPPT_APP_ID和AIPPT_API_SECRET。",
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -655,10 +3359,9 @@ async def handle_list_tools() -> list[Tool]:
             - 规划内容结构和要点
 
             🎯 ACT (行动阶段)：
-            1. 调用 get_theme_list 获取适合的PPT模板
-            2. 调用 create_outline 生成结构化大纲
-            3. 调用 create_ppt_by_outline 基于大纲生成PPT
-            4. 调用 get_task_progress 监控生成进度
+            1. 同时调用 get_theme_list 获取适合的PPT模板、create_outline 生成结构化大纲（两者互不依赖，并发执行）
+            2. 调用 create_ppt_by_outline 基于大纲生成PPT
+            3. 调用 get_task_progress 监控生成进度
 
             👁️ OBSERVE (观察阶段)：
             - 检查每步的执行结果
@@ -718,11 +3421,62 @@ async def handle_list_tools() -> list[Tool]:
                         "type": "boolean",
                         "description": "是否联网搜索补充内容",
                         "default": False
+                    },
+                    "wait_for_completion": {
+                        "type": "boolean",
+                        "description": "是否在服务端等待PPT生成完成后再返回：True时一次调用直接返回下载地址ppt_url，期间各THINK/ACT/OBSERVE阶段与生成进度以进度通知推送（请求带progressToken时为notifications/progress）；False时提交任务后立即返回task_id",
+                        "default": False
+                    },
+                    "timeout": {
+                        "type": "number",
+                        "description": f"wait_for_completion为True时最长等待PPT生成的时间（秒），最大{TASK_TRACKER_CONFIG['max_wait']}，超时后返回timed_out并可继续用wait_for_task等待",
+                        "default": 300
                     }
                 },
                 "required": ["topic"]
             }
         ),
+        Tool(
+            name="create_ppt_batch",
+            description=f"批量创建PPT生成任务。使用说明：1. 一次提交多个PPT任务（最多{BATCH_CONFIG['max_jobs']}个），每个任务包含text与template_id（template_id需通过get_theme_list获取），可选author、is_card_note、search、is_figure、ai_image。2. 同时进行的任务数由服务端按API密钥池容量自动限制，无需代理逐个提交与轮询。3. wait_for_completion为True时服务端跟踪每个任务直到完成，每完成一个任务即推送一条进度通知（含该任务结果），最终返回按提交顺序排列的全部结果（含ppt_url）。4. 需先设置环境变量AIPPT_APP_ID和AIPPT_API_SECRET。",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "jobs": {
+                        "type": "array",
+                        "description": "PPT任务列表，每项参数与create_ppt_task相同",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "text": {"type": "string", "description": "PPT生成的内容描述"},
+                                "template_id": {"type": "string", "description": "PPT模板ID"},
+                                "author": {"type": "string", "description": "PPT作者名称"},
+                                "is_card_note": {"type": "boolean", "description": "是否生成演讲备注"},
+                                "search": {"type": "boolean", "description": "是否联网搜索"},
+                                "is_figure": {"type": "boolean", "description": "是否自动配图"},
+                                "ai_image": {"type": "string", "description": "AI配图类型：normal或advanced"}
+                            },
+                            "required": ["text", "template_id"]
+                        }
+                    },
+                    "wait_for_completion": {
+                        "type": "boolean",
+                        "description": "是否等待所有任务生成完成后再返回；False时提交全部任务后返回各任务的sid",
+                        "default": True
+                    },
+                    "job_timeout": {
+                        "type": "number",
+                        "description": "每个任务等待生成完成的最长时间（秒）",
+                        "default": BATCH_CONFIG["job_timeout"]
+                    },
+                    "max_parallel": {
+                        "type": "integer",
+                        "description": "同时进行的任务数上限，默认为API密钥池中所有启用密钥的max_concurrent之和"
+                    }
+                },
+                "required": ["jobs"]
+            }
+        ),
         Tool(
             name="get_api_pool_stats",
             description="获取API密钥池状态统计。使用说明：1. 显示当前密钥池中所有密钥的使用情况。2. 包含并发数、请求数、错误率等信息。3. 用于监控和调试API调用性能。4. 无需参数，直接调用即可。",
@@ -739,40 +3493,92 @@ async def handle_call_tool(name: str, arguments: dict | None) -> list[types.Text
     """处理工具调用"""
     if arguments is None:
         arguments = {}
+    if name != "create_ppt_batch":
+        # 本次调用的所有上游请求（含重试与退避）共用一个总时限，工作池放行时开始计时；
+        # 批量生成的各任务相互独立，仍按每次请求计时。每个请求在各自的任务中处理，无需复原
+        _call_deadline.set(CallDeadline(aippt_client.retry_policy.deadline))
+    # 按工具的优先级类别与调用方租户在工作池中排队
+    run = partial(tool_worker_pool.run_as, TOOL_PRIORITY_CLASSES.get(name, "generation"), _current_tenant())
     
     try:
         if name == "get_theme_list":
-            result = aippt_client.get_theme_list(**arguments)
+            result = await run(aippt_client.get_theme_list, **arguments)
             return [types.TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
         
         elif name == "create_ppt_task":
-            result = aippt_client.create_ppt_task(**arguments)
+            result = await run(aippt_client.create_ppt_task, **arguments)
+            if result.get("code") == 0:
+                _watch_created_task(result.get("data", {}).get("sid"))
             return [types.TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
         
         elif name == "get_task_progress":
-            result = aippt_client.get_task_progress(**arguments)
+            result = await run(aippt_client.get_task_progress, **arguments)
+            return [types.TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
+        
+        elif name == "wait_for_task":
+            # 长轮询：不占用工作池名额，由任务跟踪器统一轮询上游
+            timeout = min(float(arguments.get("timeout", 300)), TASK_TRACKER_CONFIG["max_wait"])
+            snapshot = await task_tracker.wait(arguments["sid"], timeout,
+                                               on_progress=_make_progress_notifier())
+            result = {**snapshot, "timed_out": not snapshot["finished"]}
             return [types.TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
         
         elif name == "create_outline":
-            result = aippt_client.create_outline(**arguments)
+            result = await run(aippt_client.create_outline, **arguments)
             return [types.TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
         
         elif name == "create_outline_by_doc":
-            result = aippt_client.create_outline_by_doc(**arguments)
+            result = await run(aippt_client.create_outline_by_doc, **arguments)
             return [types.TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
         
         elif name == "create_ppt_by_outline":
-            result = aippt_client.create_ppt_by_outline(**arguments)
+            result = await run(aippt_client.create_ppt_by_outline, **arguments)
+            if result.get("code") == 0:
+                _watch_created_task(result.get("data", {}).get("sid"))
+            return [types.TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
+        
+        elif name == "create_ppt_batch":
+            # 批量生成：并行度由密钥池容量限制，每次提交以batch优先级经工作池排队；每完成一个任务推送一次结果
+            notifier = _make_progress_notifier()
+            total = len(arguments.get("jobs") or [])
+            completed = {"count": 0}
+            
+            async def on_result(job_result: dict):
+                completed["count"] += 1
+                await notifier({
+                    "sid": job_result["sid"],
+                    "status": f"{completed['count']}/{total} {job_result['status']}",
+                    "progress": round(completed["count"] * 100 / total, 1),
+                    "finished": False,
+                    "job": job_result
+                })
+            
+            result = await aippt_client.create_ppt_batch(**arguments, tracker=task_tracker,
+                                                         on_result=on_result if notifier else None, call=run)
+            if not arguments.get("wait_for_completion", True):
+                for job_result in result["results"]:
+                    _watch_created_task(job_result.get("sid"))
             return [types.TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
         
         elif name == "get_api_pool_stats":
             # 获取密钥池统计信息
             stats = aippt_client.get_pool_stats()
+            stats["worker_pool"] = tool_worker_pool.get_stats()
+            stats["task_tracker"] = task_tracker.get_stats()
+            if tenant_quotas is not None:
+                stats["tenant_quotas"] = tenant_quotas.get_stats()
             return [types.TextContent(type="text", text=json.dumps(stats, ensure_ascii=False, indent=2))]
         
         elif name == "create_full_ppt_workflow":
-            # ReACT模式完整工作流实现
-            result = await execute_react_ppt_workflow(aippt_client, **arguments)
+            # ReACT模式完整工作流实现：各上游调用经工作池执行，等待PPT生成期间不占用工作池名额
+            if "timeout" in arguments:
+                arguments["timeout"] = min(float(arguments["timeout"]), TASK_TRACKER_CONFIG["max_wait"])
+            result = await execute_react_ppt_workflow(aippt_client, **arguments, tracker=task_tracker,
+                                                      on_event=(_make_progress_notifier()
+                                                                if arguments.get("wait_for_completion") else None),
+                                                      call=run)
+            if result.get("success") and not result.get("final_status", {}).get("finished"):
+                _watch_created_task(result.get("task_id"))
             return [types.TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
         
         else:
@@ -781,29 +3587,128 @@ async def handle_call_tool(name: str, arguments: dict | None) -> list[types.Text
     except Exception as e:
         return [types.TextContent(type="text", text=f"错误: {str(e)}")]
 
-async def execute_react_ppt_workflow(client: AIPPTClient, topic: str, requirements: str = "", 
+def _guard_call_tool_quota():
+    """SSE传输的MCP会话在tools/call执行前检查租户配额（由run_sse_server安装，stdio不检查）
+    
+    call_tool注册的处理函数会把异常转换为工具错误结果，因此在其外层检查，
+    超出配额时抛出McpError，由会话返回JSON-RPC错误响应。
+    """
+    handler = server.request_handlers[types.CallToolRequest]
+    
+    async def guarded(req: types.CallToolRequest):
+        try:
+            release = _acquire_tool_quota(req.params.name)
+        except QuotaExceeded as e:
+            raise McpError(types.ErrorData(**e.to_error()))
+        try:
+            return await handler(req)
+        finally:
+            release()
+    
+    server.request_handlers[types.CallToolRequest] = guarded
+
+class WorkflowStageFailed(Exception):
+    """工作流阶段失败，携带返回给调用方的错误信息"""
+    
+    def __init__(self, error: str, **extra):
+        super().__init__(error)
+        self.error = error
+        self.extra = extra
+
+async def _run_workflow_dag(stages: dict, timings: dict, started: float) -> dict:
+    """按依赖关系并发执行工作流阶段
+    
+    stages为 {阶段名: (依赖的阶段名列表, 协程函数(依赖结果字典))}，没有依赖关系的阶段同时执行；
+    每个阶段的开始时间与耗时（毫秒，相对工作流开始）写入timings。任一阶段失败时取消其余阶段并抛出异常。
+    不经工具调用入口直接执行时，所有阶段的上游请求共用一个RETRY_CONFIG["deadline"]总时限。
+    """
+    tasks = {}
+    deadline_token = None
+    if _call_deadline.get() is None:
+        deadline_token = _call_deadline.set(CallDeadline(RETRY_CONFIG["deadline"]))
+    
+    async def _run(name):
+        deps, func = stages[name]
+        inputs = {dep: await tasks[dep] for dep in deps}
+        stage_started = time.perf_counter()
+        try:
+            return await func(inputs)
+        finally:
+            timings[name] = {
+                "start_ms": round((stage_started - started) * 1000, 1),
+                "duration_ms": round((time.perf_counter() - stage_started) * 1000, 1)
+            }
+    
+    for name in stages:
+        tasks[name] = asyncio.ensure_future(_run(name))
+    if deadline_token is not None:
+        _call_deadline.reset(deadline_token)
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    return {name: task.result() for name, task in tasks.items()}
+
+async def execute_react_ppt_workflow(client: AsyncAIPPTClient, topic: str, requirements: str = "", 
                                    style_preference: str = "简约", industry: str = "通用",
                                    author: str = "AI助手", enable_figures: bool = True,
-                                   enable_notes: bool = True, enable_search: bool = False) -> dict:
+                                   enable_notes: bool = True, enable_search: bool = False,
+                                   wait_for_completion: bool = False, timeout: float = 300,
+                                   tracker: TaskTracker = None, on_event=None, call=None) -> dict:
     """
     执行ReACT模式PPT生成工作流
     
-    THINK -> ACT -> OBSERVE -> ACT -> OBSERVE -> ... 直到完成
+    模板选择与大纲生成互不依赖，作为工作流DAG中的两个阶段同时执行，两者都完成后再创建PPT：
+    
+        select_template ─┐
+                         ├─> create_ppt ─> wait_for_deck（wait_for_completion时）
+        generate_outline ┘
+    
+    workflow_log中每条记录带有相对工作流开始的elapsed_ms，最后一条记录各阶段的开始时间与耗时。
+    
+    wait_for_completion为True时由任务跟踪器（tracker，默认临时创建）等待PPT生成完成，
+    直接返回下载地址。on_event为推送进度的协程函数（与wait_for_task的进度通知相同），
+    每个THINK/ACT/OBSERVE阶段及PPT生成进度都会以整体进度百分比推送；
+    call为执行上游API调用的函数（如工作池的run），默认直接调用。
     """
     
     workflow_log = []
+    stage_timings = {}
+    started = time.perf_counter()
+    overall = {"progress": 0, "task_id": None}
     
-    try:
-        # THINK 阶段：分析需求
-        workflow_log.append({
-            "stage": "THINK",
-            "action": "分析PPT需求",
-            "description": f"主题: {topic}, 风格: {style_preference}, 行业: {industry}",
-            "timestamp": time.time()
-        })
-        
-        # ACT 1: 获取适合的模板
-        workflow_log.append({
+    async def api(func, **kwargs):
+        return await (call(func, **kwargs) if call else func(**kwargs))
+    
+    async def emit(event: dict, progress: float = None, advance: float = 0):
+        """推送工作流事件，整体进度严格递增（MCP要求每次进度通知的progress都大于上一次）"""
+        current = overall["progress"]
+        overall["progress"] = min(100, max(progress or 0, current + advance, current + 0.1))
+        if on_event is None:
+            return
+        try:
+            await on_event({"sid": overall["task_id"], "finished": False, **event,
+                            "progress": round(overall["progress"], 1)})
+        except Exception as e:
+            print(f"工作流进度推送失败: {e}")
+    
+    async def log(entry: dict, progress: float = None, advance: float = 0):
+        entry["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        workflow_log.append(entry)
+        if entry["stage"] in ("THINK", "ACT", "OBSERVE"):
+            await emit({"status": f"{entry['stage']}: {entry['action']}", "stage": entry["stage"],
+                        "action": entry["action"]}, progress, advance)
+    
+    outline_query = f"{topic}"
+    if requirements:
+        outline_query += f"\n\n具体要求：{requirements}"
+    
+    async def select_template(_):
+        # ACT: 获取适合的模板
+        await log({
             "stage": "ACT",
             "action": "获取PPT模板",
             "description": f"搜索 {style_preference} 风格、{industry} 行业的模板"
@@ -820,111 +3725,95 @@ async def execute_react_ppt_workflow(client: AIPPTClient, topic: str, requiremen
         if industry and industry != "通用":
             template_params["industry"] = industry
         
-        templates_result = client.get_theme_list(**template_params)
+        templates_result = await api(client.get_theme_list, **template_params)
         
-        # OBSERVE 1: 检查模板获取结果
+        # OBSERVE: 检查模板获取结果
         if templates_result.get('code') != 0:
-            workflow_log.append({
+            await log({
                 "stage": "OBSERVE",
                 "action": "模板获取失败",
                 "error": templates_result.get('desc', '未知错误'),
                 "status": "failed"
             })
-            return {
-                "success": False,
-                "error": "无法获取PPT模板",
-                "workflow_log": workflow_log
-            }
+            raise WorkflowStageFailed("无法获取PPT模板")
         
         templates = templates_result.get('data', {}).get('list', [])
         if not templates:
-            workflow_log.append({
+            await log({
                 "stage": "OBSERVE", 
                 "action": "未找到合适模板",
                 "description": "尝试使用默认模板"
             })
             # 使用默认查询重试
-            templates_result = client.get_theme_list(pay_type="not_free", page_size=5)
+            templates_result = await api(client.get_theme_list, pay_type="not_free", page_size=5)
             templates = templates_result.get('data', {}).get('list', [])
         
         if not templates:
-            return {
-                "success": False,
-                "error": "无可用PPT模板",
-                "workflow_log": workflow_log
-            }
+            raise WorkflowStageFailed("无可用PPT模板")
         
         # 选择最佳模板
         selected_template = templates[0]  # 选择第一个模板
-        template_id = selected_template.get('templateIndexId')
-        
-        workflow_log.append({
+        await log({
             "stage": "OBSERVE",
             "action": "模板选择成功",
-            "template_id": template_id,
+            "template_id": selected_template.get('templateIndexId'),
             "template_name": selected_template.get('templateName', '未知'),
             "template_style": selected_template.get('style', ''),
             "template_industry": selected_template.get('industry', '')
-        })
-        
-        # ACT 2: 生成PPT大纲
-        workflow_log.append({
+        }, advance=10)
+        return selected_template
+    
+    async def generate_outline(_):
+        # ACT: 生成PPT大纲
+        await log({
             "stage": "ACT",
             "action": "生成PPT大纲",
             "description": f"基于主题 '{topic}' 和要求 '{requirements}' 生成结构化大纲"
         })
         
-        outline_query = f"{topic}"
-        if requirements:
-            outline_query += f"\n\n具体要求：{requirements}"
-        
-        outline_result = client.create_outline(
+        outline_result = await api(
+            client.create_outline,
             text=outline_query,
             language="cn",
             search=enable_search
         )
         
-        # OBSERVE 2: 检查大纲生成结果
+        # OBSERVE: 检查大纲生成结果
         if outline_result.get('code') != 0:
-            workflow_log.append({
+            await log({
                 "stage": "OBSERVE",
                 "action": "大纲生成失败", 
                 "error": outline_result.get('desc', '未知错误'),
                 "status": "failed"
             })
-            return {
-                "success": False,
-                "error": "大纲生成失败",
-                "workflow_log": workflow_log
-            }
+            raise WorkflowStageFailed("大纲生成失败")
         
         outline = outline_result.get('data', {}).get('outline', {})
         if not outline:
-            return {
-                "success": False,
-                "error": "生成的大纲为空",
-                "workflow_log": workflow_log
-            }
+            raise WorkflowStageFailed("生成的大纲为空")
         
-        workflow_log.append({
+        await log({
             "stage": "OBSERVE",
             "action": "大纲生成成功",
             "outline_title": outline.get('title', ''),
             "outline_chapters": len(outline.get('chapters', [])),
             "outline_preview": str(outline)[:200] + "..." if len(str(outline)) > 200 else str(outline)
-        })
-        
-        # ACT 3: 基于大纲生成PPT
-        workflow_log.append({
+        }, advance=10)
+        return outline
+    
+    async def create_ppt(inputs):
+        # ACT: 基于大纲与选定的模板生成PPT
+        await log({
             "stage": "ACT", 
             "action": "生成PPT",
             "description": "使用选定模板和生成的大纲创建PPT"
-        })
+        }, progress=20)
         
-        ppt_result = client.create_ppt_by_outline(
+        ppt_result = await api(
+            client.create_ppt_by_outline,
             text=outline_query,
-            outline=outline,
-            template_id=template_id,
+            outline=inputs["generate_outline"],
+            template_id=inputs["select_template"].get('templateIndexId'),
             author=author,
             is_card_note=enable_notes,
             search=enable_search,
@@ -932,52 +3821,133 @@ async def execute_react_ppt_workflow(client: AIPPTClient, topic: str, requiremen
             ai_image="normal"
         )
         
-        # OBSERVE 3: 检查PPT生成结果
+        # OBSERVE: 检查PPT生成结果
         if ppt_result.get('code') != 0:
-            workflow_log.append({
+            await log({
                 "stage": "OBSERVE",
                 "action": "PPT生成失败",
                 "error": ppt_result.get('desc', '未知错误'),
                 "status": "failed"
             })
-            return {
-                "success": False,
-                "error": "PPT生成失败", 
-                "workflow_log": workflow_log,
-                "debug_info": ppt_result
-            }
+            raise WorkflowStageFailed("PPT生成失败", debug_info=ppt_result)
         
         # 获取任务ID
         task_id = ppt_result.get('data', {}).get('sid')
         if not task_id:
-            return {
-                "success": False,
-                "error": "未获取到PPT生成任务ID",
-                "workflow_log": workflow_log
-            }
+            raise WorkflowStageFailed("未获取到PPT生成任务ID")
         
-        workflow_log.append({
+        overall["task_id"] = task_id
+        await log({
             "stage": "OBSERVE",
             "action": "PPT生成任务已提交",
             "task_id": task_id,
             "cover_image": ppt_result.get('data', {}).get('coverImgSrc', ''),
             "ppt_title": ppt_result.get('data', {}).get('title', ''),
             "ppt_subtitle": ppt_result.get('data', {}).get('subTitle', '')
+        }, progress=30)
+        return ppt_result
+    
+    async def wait_for_deck(inputs):
+        # ACT: 由服务端跟踪任务直到完成，PPT生成进度映射到整体进度的30%~99%，完成时为100%
+        task_id = inputs["create_ppt"].get('data', {}).get('sid')
+        await log({
+            "stage": "ACT",
+            "action": "等待PPT生成完成",
+            "description": f"服务端跟踪任务 {task_id}，最长等待 {timeout} 秒"
         })
         
-        # ACT 4: 监控生成进度
-        workflow_log.append({
-            "stage": "ACT",
-            "action": "监控生成进度",
-            "description": "定期检查PPT生成状态"
+        async def forward(snapshot: dict):
+            await emit({**_progress_payload(snapshot), "stage": "OBSERVE", "action": "PPT生成进度",
+                        "deck_progress": snapshot["progress"]}, progress=30 + 0.69 * snapshot["progress"])
+        
+        waiter = tracker or TaskTracker(client.progress_scheduler.poll, TASK_TRACKER_CONFIG)
+        try:
+            snapshot = await waiter.wait(task_id, timeout, on_progress=forward)
+        finally:
+            if tracker is None:
+                await waiter.aclose()
+        
+        # OBSERVE: 检查最终状态
+        if not snapshot["finished"]:
+            await log({
+                "stage": "OBSERVE",
+                "action": "等待超时",
+                "description": f"PPT仍在生成中（{snapshot['progress']}%），可继续使用wait_for_task等待",
+                "deck_progress": snapshot["progress"]
+            })
+        elif snapshot["status"] != "done":
+            await log({
+                "stage": "OBSERVE",
+                "action": "PPT生成失败",
+                "error": snapshot.get("error") or snapshot["status"],
+                "status": "failed"
+            })
+            raise WorkflowStageFailed("PPT生成失败", task_id=task_id, final_status=_progress_payload(snapshot))
+        else:
+            await log({
+                "stage": "OBSERVE",
+                "action": "PPT生成完成",
+                "ppt_url": snapshot.get("ppt_url"),
+                "total_pages": snapshot.get("total_pages")
+            }, progress=100)
+        return snapshot
+    
+    async def log_timings():
+        await log({
+            "stage": "TIMING",
+            "action": "阶段耗时",
+            "stages": stage_timings,
+            "total_ms": round((time.perf_counter() - started) * 1000, 1)
+        })
+    
+    try:
+        # THINK 阶段：分析需求
+        await log({
+            "stage": "THINK",
+            "action": "分析PPT需求",
+            "description": f"主题: {topic}, 风格: {style_preference}, 行业: {industry}",
+            "timestamp": time.time()
         })
         
+        stages = {
+            "select_template": ([], select_template),
+            "generate_outline": ([], generate_outline),
+            "create_ppt": (["select_template", "generate_outline"], create_ppt)
+        }
+        if wait_for_completion:
+            stages["wait_for_deck"] = (["create_ppt"], wait_for_deck)
+        results = await _run_workflow_dag(stages, stage_timings, started)
+        selected_template = results["select_template"]
+        outline = results["generate_outline"]
+        ppt_result = results["create_ppt"]
+        task_id = ppt_result.get('data', {}).get('sid')
+        final = results.get("wait_for_deck")
+        
+        if final is None:
+            # ACT: 监控生成进度
+            await log({
+                "stage": "ACT",
+                "action": "监控生成进度",
+                "description": "定期检查PPT生成状态"
+            })
+        await log_timings()
+        
+        if final is not None and final["finished"]:
+            next_steps = [f"PPT已生成完成，下载地址: {final.get('ppt_url')}"]
+            status = "deck_ready"
+        else:
+            next_steps = [
+                f"使用 wait_for_task 工具等待任务 {task_id} 完成（服务端推送进度，无需轮询）",
+                "任务完成后，返回结果中的ppt_url即为下载链接"
+            ]
+            status = "completed_successfully" if final is None else "wait_timed_out"
+        
         # 返回成功结果和工作流日志
-        return {
+        result = {
             "success": True,
             "task_id": task_id,
             "template_info": {
-                "id": template_id,
+                "id": selected_template.get('templateIndexId'),
                 "name": selected_template.get('templateName', ''),
                 "style": selected_template.get('style', ''),
                 "industry": selected_template.get('industry', '')
@@ -992,23 +3962,37 @@ async def execute_react_ppt_workflow(client: AIPPTClient, topic: str, requiremen
                 "subtitle": ppt_result.get('data', {}).get('subTitle', ''),
                 "cover_image": ppt_result.get('data', {}).get('coverImgSrc', '')
             },
-            "next_steps": [
-                f"使用 get_task_progress 工具查询任务 {task_id} 的生成进度",
-                "等待PPT生成完成后，可获取下载链接",
-                "建议每30-60秒查询一次进度，直到任务完成"
-            ],
+            "next_steps": next_steps,
             "workflow_log": workflow_log,
             "react_summary": {
-                "total_stages": len(workflow_log),
-                "think_count": len([log for log in workflow_log if log.get('stage') == 'THINK']),
-                "act_count": len([log for log in workflow_log if log.get('stage') == 'ACT']),
-                "observe_count": len([log for log in workflow_log if log.get('stage') == 'OBSERVE']),
-                "status": "completed_successfully"
+                # 阶段耗时记录不是ReACT阶段，不计入
+                "total_stages": len([entry for entry in workflow_log if entry.get('stage') != 'TIMING']),
+                "think_count": len([entry for entry in workflow_log if entry.get('stage') == 'THINK']),
+                "act_count": len([entry for entry in workflow_log if entry.get('stage') == 'ACT']),
+                "observe_count": len([entry for entry in workflow_log if entry.get('stage') == 'OBSERVE']),
+                "stage_timings": stage_timings,
+                "status": status
             }
         }
+        if final is not None:
+            result.update({
+                "ppt_url": final.get("ppt_url"),
+                "timed_out": not final["finished"],
+                "final_status": _progress_payload(final)
+            })
+        return result
+    
+    except WorkflowStageFailed as e:
+        await log_timings()
+        return {
+            "success": False,
+            "error": e.error,
+            "workflow_log": workflow_log,
+            **e.extra
+        }
         
     except Exception as e:
-        workflow_log.append({
+        await log({
             "stage": "ERROR",
             "action": "工作流异常",
             "error": str(e),
@@ -1025,6 +4009,7 @@ async def execute_react_ppt_workflow(client: AIPPTClient, topic: str, requiremen
 
 async def run_stdio_server():
     """运行 stdio 传输服务器"""
+    _start_job_recovery()
     async with stdio_server() as (read_stream, write_stream):
         await server.run(
             read_stream,
@@ -1041,6 +4026,7 @@ async def run_stdio_server():
 
 async def run_http_server(host: str = "localhost", port: int = 8000):
     """运行 HTTP 传输服务器"""
+    _start_job_recovery()
     try:
         from starlette.applications import Starlette
         from starlette.routing import Route
@@ -1050,6 +4036,7 @@ async def run_http_server(host: str = "localhost", port: int = 8000):
         
         async def handle_mcp_request(request: Request):
             """处理MCP HTTP请求"""
+            _request_tenant.set(_http_request_tenant(request))
             try:
                 if request.method == "POST":
                     body = await request.json()
@@ -1070,7 +4057,14 @@ async def run_http_server(host: str = "localhost", port: int = 8000):
                         tool_name = params.get("name")
                         arguments = params.get("arguments", {})
                         
-                        result = await handle_call_tool(tool_name, arguments)
+                        try:
+                            release = _acquire_http_tool_quota(request, tool_name)
+                        except QuotaExceeded as e:
+                            return JSONResponse(_quota_error_response(body.get("id"), e))
+                        try:
+                            result = await handle_call_tool(tool_name, arguments)
+                        finally:
+                            release()
                         return JSONResponse({
                             "jsonrpc": "2.0",
                             "id": body.get("id"),
@@ -1104,9 +4098,11 @@ async def run_http_server(host: str = "localhost", port: int = 8000):
                                 <li>get_theme_list - 获取PPT模板列表</li>
                                 <li>create_ppt_task - 创建PPT生成任务</li>
                                 <li>get_task_progress - 查询任务进度</li>
+                                <li>wait_for_task - 等待任务完成（推送进度）</li>
                                 <li>create_outline - 创建PPT大纲</li>
                                 <li>create_outline_by_doc - 从文档创建大纲</li>
                                 <li>create_ppt_by_outline - 根据大纲创建PPT</li>
+                                <li>create_ppt_batch - 批量生成PPT</li>
                             </ul>
                             <h3>使用方法:</h3>
                             <p>发送POST请求到此端点，格式为JSON-RPC 2.0</p>
@@ -1140,6 +4136,8 @@ async def run_http_server(host: str = "localhost", port: int = 8000):
 
 async def run_sse_server(host: str = "localhost", port: int = 8001):
     """运行 SSE 传输服务器"""
+    _start_job_recovery()
+    _guard_call_tool_quota()
     try:
         from starlette.applications import Starlette
         from starlette.routing import Route, Mount
@@ -1202,9 +4200,11 @@ async def run_sse_server(host: str = "localhost", port: int = 8001):
                         <li>get_theme_list - 获取PPT模板列表</li>
                         <li>create_ppt_task - 创建PPT生成任务</li>
                         <li>get_task_progress - 查询任务进度</li>
+                        <li>wait_for_task - 等待任务完成（推送进度）</li>
                         <li>create_outline - 创建PPT大纲</li>
                         <li>create_outline_by_doc - 从文档创建大纲</li>
                         <li>create_ppt_by_outline - 根据大纲创建PPT</li>
+                        <li>create_ppt_batch - 批量生成PPT</li>
                     </ul>
                     <h3>测试连接:</h3>
                     <button onclick="testSSE()">测试SSE连接</button>
@@ -1260,6 +4260,7 @@ async def run_sse_server(host: str = "localhost", port: int = 8001):
 
 async def run_http_stream_server(host: str = "localhost", port: int = 8002):
     """运行 HTTP Stream 传输服务器 (MCP 2025-03-26)"""
+    _start_job_recovery()
     try:
         from http_stream_transport import create_http_stream_transport
         
@@ -1280,10 +4281,11 @@ async def run_http_stream_server(host: str = "localhost", port: int = 8002):
 
 async def run_http_stream_server(host: str = "localhost", port: int = 8002):
     """运行 HTTP Stream 传输服务器（MCP 2025-03-26规范）"""
+    _start_job_recovery()
     try:
         from starlette.applications import Starlette
         from starlette.routing import Route
-        from starlette.responses import Response, JSONResponse
+        from starlette.responses import Response, JSONResponse, StreamingResponse
         from starlette.requests import Request
         import uvicorn
         import uuid
@@ -1292,8 +4294,56 @@ async def run_http_stream_server(host: str = "localhost", port: int = 8002):
         # 会话管理
         active_sessions = {}
         
+        async def stream_tool_call(body: dict, release):
+            """以SSE事件流执行工具调用，调用期间的任务进度作为JSON-RPC通知推送（结束后释放租户配额）"""
+            params = body.get("params", {})
+            progress_token = (params.get("_meta") or {}).get("progressToken")
+            queue: asyncio.Queue = asyncio.Queue()
+            
+            async def sink(snapshot: dict):
+                if progress_token is not None:
+                    await queue.put({
+                        "jsonrpc": "2.0",
+                        "method": "notifications/progress",
+                        "params": {
+                            "progressToken": progress_token,
+                            "progress": snapshot["progress"],
+                            "total": 100,
+                            "message": _progress_message(snapshot)
+                        }
+                    })
+                else:
+                    await queue.put({
+                        "jsonrpc": "2.0",
+                        "method": "notifications/message",
+                        "params": {"level": "info", "logger": "task_progress",
+                                   "data": _progress_payload(snapshot)}
+                    })
+            
+            async def call():
+                _progress_sink.set(sink)
+                try:
+                    result = await handle_call_tool(params.get("name"), params.get("arguments", {}))
+                    await queue.put({
+                        "jsonrpc": "2.0",
+                        "id": body.get("id"),
+                        "result": {"content": [content.model_dump() for content in result]}
+                    })
+                finally:
+                    await queue.put(None)
+            
+            call_task = asyncio.create_task(call())
+            try:
+                while (message := await queue.get()) is not None:
+                    yield f"event: message\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+            finally:
+                if not call_task.done():
+                    call_task.cancel()
+                release()
+        
         async def handle_mcp_request(request: Request):
             """处理MCP请求"""
+            _request_tenant.set(_http_request_tenant(request))
             if request.method == "POST":
                 try:
                     body = await request.json()
@@ -1334,7 +4384,21 @@ async def run_http_stream_server(host: str = "localhost", port: int = 8002):
                         tool_name = params.get("name")
                         arguments = params.get("arguments", {})
                         
-                        result = await handle_call_tool(tool_name, arguments)
+                        # 超出租户配额时直接返回JSON-RPC错误，不进入工作池
+                        try:
+                            release = _acquire_http_tool_quota(request, tool_name)
+                        except QuotaExceeded as e:
+                            return JSONResponse(_quota_error_response(body.get("id"), e))
+                        
+                        # 客户端接受SSE时以流式响应返回：先推送进度通知，最后返回结果
+                        if "text/event-stream" in request.headers.get("accept", ""):
+                            return StreamingResponse(stream_tool_call(body, release),
+                                                     media_type="text/event-stream")
+                        
+                        try:
+                            result = await handle_call_tool(tool_name, arguments)
+                        finally:
+                            release()
                         return JSONResponse({
                             "jsonrpc": "2.0",
                             "id": body.get("id"),
@@ -1385,9 +4449,11 @@ async def run_http_stream_server(host: str = "localhost", port: int = 8002):
                             <li>get_theme_list - 获取PPT模板列表</li>
                             <li>create_ppt_task - 创建PPT生成任务</li>
                             <li>get_task_progress - 查询任务进度</li>
+                            <li>wait_for_task - 等待任务完成（推送进度）</li>
                             <li>create_outline - 创建PPT大纲</li>
                             <li>create_outline_by_doc - 从文档创建大纲</li>
                             <li>create_ppt_by_outline - 根据大纲创建PPT</li>
+                            <li>create_ppt_batch - 批量生成PPT</li>
                             <li>create_full_ppt_workflow - ReACT模式完整工作流</li>
                         </ul>
                         
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PPT生成任务进度跟踪
+
+服务端集中轮询上游 /progress 接口（自适应轮询间隔），把进度变化推送给订阅者，
+并支持长轮询等待任务完成，客户端无需反复调用 get_task_progress。
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+# 上游任务状态中表示仍在进行中的取值
+BUILDING_STATUSES = {"building", "creating", "init", "pending"}
+FAILED_STATUSES = {"build_failed", "failed"}
+
+DEFAULT_TRACKER_CONFIG = {
+    "min_interval": 2.0,        # 最短轮询间隔（秒），有进度变化时回到该值
+    "max_interval": 15.0,       # 最长轮询间隔（秒）
+    "backoff": 1.5,             # 无进度变化时间隔的增长倍数
+    "max_errors": 5,            # 连续查询失败次数上限，超过后标记任务失败
+    "max_duration": 1800.0,     # 单个任务最长跟踪时间（秒）
+    "retention": 600.0          # 任务结束后保留结果的时间（秒），供后续wait_for_task直接返回
+}
+
+
+def summarize_progress(sid: str, response: dict) -> dict:
+    """把上游 /progress 响应整理为统一的进度快照"""
+    if response.get("code") != 0:
+        return {
+            "sid": sid,
+            "status": "error",
+            "progress": 0,
+            "finished": False,
+            "error": response.get("desc") or response.get("message") or f"code={response.get('code')}",
+            "response": response
+        }
+
+    data = response.get("data") or {}
+    ppt_status = data.get("pptStatus")
+    sub_statuses = [data.get("aiImageStatus"), data.get("cardNoteStatus")]
+    total_pages = data.get("totalPages") or 0
+    done_pages = data.get("donePages") or 0
+
+    if ppt_status in FAILED_STATUSES:
+        status = "failed"
+    elif ppt_status == "done" and not any(s in BUILDING_STATUSES for s in sub_statuses):
+        status = "done"
+    else:
+        status = "building"
+
+    if status == "done":
+        progress = 100
+    elif total_pages:
+        progress = min(99, int(done_pages * 100 / total_pages))
+    else:
+        progress = 0
+
+    return {
+        "sid": sid,
+        "status": status,
+        "progress": progress,
+        "finished": status in ("done", "failed"),
+        "ppt_status": ppt_status,
+        "ai_image_status": data.get("aiImageStatus"),
+        "card_note_status": data.get("cardNoteStatus"),
+        "total_pages": total_pages,
+        "done_pages": done_pages,
+        "ppt_url": data.get("pptUrl"),
+        "error": data.get("errMsg") if status == "failed" else None,
+        "response": response
+    }
+
+
+class TrackedTask:
+    """单个被跟踪的任务"""
+
+    def __init__(self, sid: str, interval: float):
+        self.sid = sid
+        self.snapshot: Optional[dict] = None
+        self.finished = False
+        self.subscribers: list = []
+        self.interval = interval
+        self.polls = 0
+        self.errors = 0
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.condition = asyncio.Condition()
+        self.runner: Optional[asyncio.Task] = None
+
+
+class TaskTracker:
+    """任务进度跟踪器
+
+    fetch_progress(sid, delay)为在delay秒后查询任务进度的协程函数
+    （如ProgressScheduler.poll，由调度器按到期时间统一排队），
+    每个sid只有一个后台轮询协程，多个等待者与订阅者共享同一份轮询结果。
+    on_change(snapshot)为可选的同步回调，所有任务的每次进度变化都会在线程池中调用（如写入任务存储），
+    同一任务的回调按顺序执行。
+    """
+
+    def __init__(self, fetch_progress: Callable[[str, float], Awaitable[dict]], config: dict = None,
+                 on_change: Callable[[dict], None] = None):
+        self.fetch_progress = fetch_progress
+        self.config = {**DEFAULT_TRACKER_CONFIG, **(config or {})}
+        self.on_change = on_change
+        self._tasks: dict[str, TrackedTask] = {}
+        self._stats = {"tracked": 0, "completed": 0, "failed": 0, "polls": 0, "notifications": 0}
+
+    def track(self, sid: str) -> TrackedTask:
+        """开始跟踪任务（已在跟踪中则直接返回），需在事件循环中调用"""
+        self._evict_expired()
+        tracked = self._tasks.get(sid)
+        if tracked is None:
+            tracked = TrackedTask(sid, self.config["min_interval"])
+            self._tasks[sid] = tracked
+            self._stats["tracked"] += 1
+            tracked.runner = asyncio.ensure_future(self._poll_loop(tracked))
+        return tracked
+
+    def subscribe(self, sid: str, callback: Callable[[dict], Awaitable[None]]) -> TrackedTask:
+        """订阅任务进度变化，callback(snapshot)在每次进度变化时调用，任务结束后自动取消订阅"""
+        tracked = self.track(sid)
+        if not tracked.finished:
+            tracked.subscribers.append(callback)
+        return tracked
+
+    def unsubscribe(self, sid: str, callback):
+        tracked = self._tasks.get(sid)
+        if tracked and callback in tracked.subscribers:
+            tracked.subscribers.remove(callback)
+
+    async def wait(self, sid: str, timeout: float,
+                   on_progress: Callable[[dict], Awaitable[None]] = None) -> dict:
+        """等待任务结束或超时，返回最新的进度快照（超时时finished为False）"""
+        tracked = self.subscribe(sid, on_progress) if on_progress else self.track(sid)
+        try:
+            async with tracked.condition:
+                await asyncio.wait_for(tracked.condition.wait_for(lambda: tracked.finished), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if on_progress:
+                self.unsubscribe(sid, on_progress)
+        return tracked.snapshot or {"sid": sid, "status": "pending", "progress": 0, "finished": False}
+
+    def get_snapshot(self, sid: str) -> Optional[dict]:
+        tracked = self._tasks.get(sid)
+        return tracked.snapshot if tracked else None
+
+    def _next_interval(self, tracked: TrackedTask, changed: bool) -> float:
+        """自适应轮询间隔：有进度变化时回到最短间隔，否则逐步拉长"""
+        if changed:
+            return self.config["min_interval"]
+        return min(self.config["max_interval"], tracked.interval * self.config["backoff"])
+
+    async def _poll_loop(self, tracked: TrackedTask):
+        deadline = tracked.created_at + self.config["max_duration"]
+        delay = 0.0
+        while not tracked.finished:
+            try:
+                response = await self.fetch_progress(tracked.sid, delay)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                response = {"code": -1, "desc": str(e)}
+            tracked.polls += 1
+            self._stats["polls"] += 1
+
+            snapshot = summarize_progress(tracked.sid, response)
+            if snapshot["status"] == "error":
+                tracked.errors += 1
+                if tracked.errors >= self.config["max_errors"]:
+                    snapshot.update(status="failed", finished=True)
+            else:
+                tracked.errors = 0
+            if not snapshot["finished"] and time.monotonic() >= deadline:
+                snapshot.update(status="failed", finished=True, error="跟踪超时")
+
+            previous = tracked.snapshot
+            changed = previous is None or any(
+                previous.get(field) != snapshot.get(field)
+                for field in ("status", "progress", "ppt_status", "ai_image_status", "card_note_status"))
+            tracked.snapshot = snapshot
+            if changed:
+                await self._publish(tracked, snapshot)
+            if snapshot["finished"]:
+                break
+            tracked.interval = self._next_interval(tracked, changed)
+            delay = tracked.interval
+
+        tracked.finished_at = time.monotonic()
+        self._stats["completed" if tracked.snapshot["status"] == "done" else "failed"] += 1
+
+    async def _publish(self, tracked: TrackedTask, snapshot: dict):
+        if snapshot["finished"]:
+            tracked.finished = True
+        if self.on_change is not None:
+            try:
+                await asyncio.to_thread(self.on_change, snapshot)
+            except Exception as e:
+                print(f"任务进度回调失败({tracked.sid}): {e}")
+        async with tracked.condition:
+            tracked.condition.notify_all()
+        subscribers = list(tracked.subscribers)
+        if snapshot["finished"]:
+            tracked.subscribers.clear()
+        for callback in subscribers:
+            try:
+                await callback(snapshot)
+                self._stats["notifications"] += 1
+            except Exception:
+                # 推送失败（如会话已断开）：取消该订阅，不影响其他订阅者
+                self.unsubscribe(tracked.sid, callback)
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = [sid for sid, tracked in self._tasks.items()
+                   if tracked.finished_at is not None
+                   and now - tracked.finished_at > self.config["retention"]]
+        for sid in expired:
+            del self._tasks[sid]
+
+    def get_stats(self) -> dict:
+        active = [t for t in self._tasks.values() if not t.finished]
+        return {
+            **self._stats,
+            "active": len(active),
+            "subscribers": sum(len(t.subscribers) for t in active)
+        }
+
+    async def aclose(self):
+        """停止所有后台轮询"""
+        runners = [t.runner for t in self._tasks.values() if t.runner and not t.runner.done()]
+        for runner in runners:
+            runner.cancel()
+        await asyncio.gather(*runners, return_exceptions=True)
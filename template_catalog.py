@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PPT模板目录本地索引
+
+后台一次性抓取全部模板（所有分页、免费与付费两种类型），在内存中建立按风格、颜色、
+行业的倒排索引并持久化到磁盘，get_theme_list可直接在本地完成任意条件组合的筛选与分页。
+之后按计划增量刷新：某一付费类型的模板总数不变且某页全部是未变化的已知模板时，不再抓取
+后续分页；每隔若干次刷新做一次全量抓取，纠正增量刷新发现不了的深层分页变化。
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+PAY_TYPES = ("free", "not_free")
+INDEXED_FIELDS = ("style", "color", "industry")
+CATALOG_FORMAT_VERSION = 1
+
+
+class TemplateCatalog:
+    """模板目录索引
+
+    fetch_page(pay_type, page_num, page_size)为请求上游 /template/list 的协程函数，
+    返回原始响应。索引每次刷新后整体替换，查询期间无需加锁。
+    """
+
+    def __init__(self, fetch_page: Callable[[str, int, int], Awaitable[dict]],
+                 path: Optional[str] = None, page_size: int = 100,
+                 refresh_interval: float = 6 * 3600, max_pages: int = 200,
+                 full_refresh_every: int = 4):
+        self.fetch_page = fetch_page
+        self.path = path
+        self.page_size = page_size
+        self.refresh_interval = refresh_interval
+        self.max_pages = max_pages
+        self.full_refresh_every = max(1, full_refresh_every)
+        self._since_full = 0  # 上次全量抓取之后的增量刷新次数
+        self._templates: dict[str, dict] = {}  # templateIndexId -> 模板
+        self._order: list[str] = []
+        self._index: dict[str, dict[str, set]] = {}
+        self._refreshed_at = 0.0
+        self._job: Optional[asyncio.Task] = None
+        self._stats = {"refreshes": 0, "refresh_errors": 0, "queries": 0,
+                       "full_refreshes": 0, "pages_fetched": 0,
+                       "added": 0, "updated": 0, "removed": 0, "last_error": None}
+        if path:
+            self.load()
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._order)
+
+    # ===== 索引 =====
+
+    def _rebuild(self, templates: dict[str, dict], order: list[str]):
+        index = {field: {} for field in INDEXED_FIELDS + ("payType",)}
+        for position, template_id in enumerate(order):
+            template = templates[template_id]
+            for field in index:
+                value = template.get(field)
+                if value:
+                    index[field].setdefault(value, set()).add(position)
+        # 整体替换，查询方不会看到半成品
+        self._templates, self._order, self._index = templates, order, index
+
+    def search(self, pay_type: str = None, style: str = None, color: str = None,
+               industry: str = None, page_num: int = 1, page_size: int = 10) -> dict:
+        """按任意条件组合筛选并分页，返回与 /template/list 相同结构的响应"""
+        self._stats["queries"] += 1
+        index, order, templates = self._index, self._order, self._templates
+        matched = None
+        for field, value in (("payType", pay_type), ("style", style),
+                             ("color", color), ("industry", industry)):
+            if not value:
+                continue
+            positions = index.get(field, {}).get(value, set())
+            matched = positions if matched is None else matched & positions
+            if not matched:
+                break
+
+        positions = range(len(order)) if matched is None else sorted(matched)
+        page_num, page_size = max(1, int(page_num)), max(1, int(page_size))
+        start = (page_num - 1) * page_size
+        page = [templates[order[i]] for i in positions[start:start + page_size]]
+        return {"code": 0, "desc": "success", "data": {"total": len(positions), "list": page},
+                "source": "local_catalog"}
+
+    def facets(self) -> dict:
+        """各筛选字段的可选值及模板数量"""
+        return {field: {value: len(positions) for value, positions in values.items()}
+                for field, values in self._index.items()}
+
+    # ===== 抓取与增量刷新 =====
+
+    async def _crawl(self, incremental: bool = False) -> tuple[dict[str, dict], list[str]]:
+        templates, order = {}, []
+        old = self._templates
+        for pay_type in PAY_TYPES:
+            known = [t for t in self._order if old[t].get("payType") == pay_type] if incremental else []
+            collected = 0
+            for page_num in range(1, self.max_pages + 1):
+                response = await self.fetch_page(pay_type, page_num, self.page_size)
+                self._stats["pages_fetched"] += 1
+                if response.get("code") != 0:
+                    raise RuntimeError(f"模板列表抓取失败({pay_type}第{page_num}页): "
+                                       f"{response.get('desc', response.get('code'))}")
+                data = response.get("data") or {}
+                page = data.get("list") or []
+                unchanged = True
+                for template in page:
+                    template_id = template.get("templateIndexId")
+                    if not template_id or template_id in templates:
+                        continue
+                    templates[template_id] = {**template, "payType": template.get("payType", pay_type)}
+                    order.append(template_id)
+                    unchanged = unchanged and old.get(template_id) == templates[template_id]
+                collected += len(page)
+                if not page or collected >= (data.get("total") or 0) or len(page) < self.page_size:
+                    break
+                if incremental and unchanged and data.get("total") == len(known):
+                    # 总数不变且本页全是未变化的已知模板：其余分页沿用现有索引
+                    for template_id in known:
+                        if template_id not in templates:
+                            templates[template_id] = old[template_id]
+                            order.append(template_id)
+                    break
+        return templates, order
+
+    async def refresh(self, full: Optional[bool] = None) -> dict:
+        """刷新目录，与现有索引比较后只在有变化时替换，返回变化统计
+
+        full为None时，目录为空或距上次全量抓取已满full_refresh_every次刷新则全量抓取，
+        否则增量刷新（见_crawl）。
+        """
+        if full is None:
+            full = not self.ready or self._since_full + 1 >= self.full_refresh_every
+        try:
+            templates, order = await self._crawl(incremental=not full)
+        except Exception as e:
+            self._stats["refresh_errors"] += 1
+            self._stats["last_error"] = str(e)
+            raise
+
+        old = self._templates
+        added = [t for t in order if t not in old]
+        updated = [t for t in order if t in old and old[t] != templates[t]]
+        removed = [t for t in old if t not in templates]
+        self._refreshed_at = time.time()
+        if added or updated or removed or order != self._order:
+            # 未变化的模板沿用旧对象，减少内存抖动
+            merged = {t: (old[t] if t in old and t not in updated else templates[t]) for t in order}
+            self._rebuild(merged, order)
+        await asyncio.to_thread(self.save)
+        self._since_full = 0 if full else self._since_full + 1
+        self._stats["refreshes"] += 1
+        self._stats["full_refreshes"] += int(full)
+        self._stats["last_error"] = None
+        self._stats["added"] += len(added)
+        self._stats["updated"] += len(updated)
+        self._stats["removed"] += len(removed)
+        return {"added": len(added), "updated": len(updated), "removed": len(removed),
+                "total": len(order)}
+
+    def ensure_started(self):
+        """启动后台抓取/定时刷新任务（需在事件循环中调用，重复调用无副作用）"""
+        if self._job is None or self._job.done():
+            self._job = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            age = time.time() - self._refreshed_at
+            if age >= self.refresh_interval or not self.ready:
+                try:
+                    result = await self.refresh()
+                    print(f"模板目录已刷新: {result}")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"模板目录刷新失败: {e}")
+                    await asyncio.sleep(min(60.0, self.refresh_interval))
+                    continue
+                age = 0.0
+            await asyncio.sleep(max(1.0, self.refresh_interval - age))
+
+    async def aclose(self):
+        if self._job is not None and not self._job.done():
+            self._job.cancel()
+            await asyncio.gather(self._job, return_exceptions=True)
+        self._job = None
+
+    # ===== 持久化 =====
+
+    def save(self):
+        """写入磁盘（先写临时文件再替换，避免中途退出留下损坏文件），异步代码中应通过asyncio.to_thread调用"""
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        payload = {
+            "version": CATALOG_FORMAT_VERSION,
+            "refreshed_at": self._refreshed_at,
+            "templates": [self._templates[t] for t in self._order]
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> bool:
+        """从磁盘加载上次的目录（热启动），文件不存在或格式不符时返回False"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+            if payload.get("version") != CATALOG_FORMAT_VERSION:
+                return False
+            templates = {t["templateIndexId"]: t for t in payload.get("templates", [])}
+            self._rebuild(templates, list(templates))
+            self._refreshed_at = payload.get("refreshed_at", 0.0)
+            return True
+        except (OSError, ValueError, KeyError) as e:
+            print(f"模板目录缓存读取失败，将重新抓取: {e}")
+            return False
+
+    def get_stats(self) -> dict:
+        return {
+            **self._stats,
+            "ready": self.ready,
+            "templates": len(self._order),
+            "age_seconds": round(time.time() - self._refreshed_at, 1) if self._refreshed_at else None,
+            "path": self.path
+        }
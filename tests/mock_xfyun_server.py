@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟的讯飞智文API服务器，用于离线测试；同时可作为file_url的文档下载服务器
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def handle_error(self, request, client_address):
+        # 客户端取消请求（如对冲请求的落后方）导致的断连不视为错误
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class MockXfyunServer:
+    """在后台线程中运行的模拟API服务器
+
+    用法:
+        with MockXfyunServer(delay=0.2) as mock:
+            client = AsyncAIPPTClient(key_pool=..., base_url=mock.base_url)
+    """
+
+    def __init__(self, delay: float = 0.0, host: str = "127.0.0.1"):
+        self.delay = delay
+        self.host = host
+        self.calls = []  # [(path, query)]
+        self.connections = set()  # 客户端连接地址，用于验证keep-alive复用
+        self.responses = {}  # path -> dict 或 callable(query, body) -> dict
+        self.files = {}  # 文件名 -> bytes，通过file_url(name)下载
+        self.redirects = {}  # 文件名 -> 重定向目标URL（302）
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self._httpd.server_address[1]}/api/ppt/v2"
+
+    def file_url(self, name: str) -> str:
+        """files中文档的下载地址"""
+        return f"http://{self.host}:{self._httpd.server_address[1]}/files/{name}"
+
+    def count(self, path: str) -> int:
+        """统计某个接口被调用的次数"""
+        with self._lock:
+            return len([c for c in self.calls if c[0] == path])
+
+    def _default_response(self, path: str, query: dict) -> dict:
+        if path == "/template/list":
+            page_size = int(query.get("pageSize", ["10"])[0])
+            return {"code": 0, "data": {"total": page_size, "list": [
+                {"templateIndexId": f"T{i}", "templateName": f"模板{i}",
+                 "style": query.get("style", ["简约"])[0],
+                 "industry": query.get("industry", ["通用"])[0]}
+                for i in range(page_size)
+            ]}}
+        if path == "/progress":
+            return {"code": 0, "data": {"pptStatus": "done", "aiImageStatus": "done",
+                                        "cardNoteStatus": "done", "totalPages": 10,
+                                        "donePages": 10, "pptUrl": "http://example.invalid/a.pptx"}}
+        if path in ("/createOutline", "/createOutlineByDoc"):
+            return {"code": 0, "data": {"sid": "outline-sid", "outline": {
+                "title": "测试大纲", "subTitle": "副标题",
+                "chapters": [{"chapterTitle": "第一章", "contents": ["要点1", "要点2"]}]}}}
+        if path == "/create":
+            return {"code": 0, "data": {"sid": f"sid-{time.time_ns()}", "title": "测试PPT",
+                                        "subTitle": "", "coverImgSrc": ""}}
+        return {"code": 404, "desc": "not found"}
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _handle(self):
+                parsed = urlparse(self.path)
+                path = parsed.path.replace("/api/ppt/v2", "", 1)
+                query = parse_qs(parsed.query)
+                length = int(self.headers.get("Content-Length", 0) or 0)
+                body = self.rfile.read(length) if length else b""
+                with mock._lock:
+                    mock.calls.append((path, query))
+                    mock.connections.add(self.client_address)
+                    response = mock.responses.get(path)
+                if path.startswith("/files/"):
+                    name = path[len("/files/"):]
+                    if name in mock.redirects:
+                        return self._send_redirect(mock.redirects[name])
+                    return self._send_file(mock.files.get(name))
+                if mock.delay:
+                    time.sleep(mock.delay)
+                if callable(response):
+                    response = response(query, body)
+                if response is None:
+                    response = mock._default_response(path, query)
+                response = dict(response)
+                status = response.pop("_status", 200)
+                raw = response.pop("_body", None)  # 非JSON响应体（如网关错误页）
+                if raw is None:
+                    payload = json.dumps(response, ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json; charset=utf-8"
+                else:
+                    payload = raw.encode("utf-8")
+                    content_type = "text/html; charset=utf-8"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_redirect(self, location):
+                self.send_response(302)
+                self.send_header("Location", location)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def _send_file(self, content):
+                if mock.delay:
+                    time.sleep(mock.delay)
+                if content is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = _handle
+            do_POST = _handle
+
+        return Handler
+
+    def start(self):
+        self._httpd = _Server((self.host, 0), self._make_handler())
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
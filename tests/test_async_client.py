@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试异步客户端AsyncAIPPTClient（使用本地模拟服务器，无需网络）
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+import asyncio
+import tempfile
+import time
+
+from main import AIPPTClient, AsyncAIPPTClient, AsyncTTLCache, execute_react_ppt_workflow
+from disk_cache import DiskCache
+from mock_xfyun_server import MockXfyunServer
+
+TEST_KEY_POOL = [
+    {
+        "app_id": "test_app",
+        "api_secret": "test_secret",
+        "name": "测试密钥",
+        "max_concurrent": 50,
+        "enabled": True
+    }
+]
+
+
+def test_async_methods():
+    """测试异步客户端各接口"""
+    print("🧪 测试1：异步客户端接口")
+    print("=" * 40)
+
+    async def run(base_url):
+        client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=base_url)
+        try:
+            themes = await client.get_theme_list(page_size=3)
+            assert themes["code"] == 0 and len(themes["data"]["list"]) == 3
+            outline = await client.create_outline(text="人工智能")
+            assert outline["data"]["outline"]["title"] == "测试大纲"
+            task = await client.create_ppt_by_outline(
+                text="人工智能", outline=outline["data"]["outline"], template_id="T0")
+            progress = await client.get_task_progress(task["data"]["sid"])
+            assert progress["data"]["pptStatus"] == "done"
+        finally:
+            await client.aclose()
+
+    with MockXfyunServer() as mock:
+        asyncio.run(run(mock.base_url))
+    print("✅ 异步接口调用正常")
+
+
+def test_async_concurrency():
+    """测试慢请求不会串行阻塞：20个0.3秒的请求应并发完成"""
+    print("\n🧪 测试2：异步并发")
+    print("=" * 40)
+
+    async def run(base_url):
+        client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=base_url)
+        try:
+            start = time.monotonic()
+            results = await asyncio.gather(*[client.create_outline(text=f"主题{i}") for i in range(20)])
+            return time.monotonic() - start, results
+        finally:
+            await client.aclose()
+
+    with MockXfyunServer(delay=0.3) as mock:
+        elapsed, results = asyncio.run(run(mock.base_url))
+    print(f"20个请求耗时: {elapsed:.2f}s")
+    assert all(r["code"] == 0 for r in results)
+    assert elapsed < 0.3 * 20 / 2, "异步请求未能并发执行"
+    print("✅ 请求并发执行，未阻塞事件循环")
+
+
+def test_sync_client_compat():
+    """测试同步客户端仍可正常使用"""
+    print("\n🧪 测试3：同步客户端兼容性")
+    print("=" * 40)
+
+    with MockXfyunServer() as mock:
+        client = AIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+        result = client.get_theme_list(page_size=2)
+        assert result["code"] == 0 and len(result["data"]["list"]) == 2
+    print("✅ 同步客户端正常")
+
+
+def test_connection_reuse():
+    """测试连接池：连续轮询复用同一条keep-alive连接"""
+    print("\n🧪 测试4：连接池复用")
+    print("=" * 40)
+
+    async def run(base_url):
+        client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=base_url)
+        try:
+            for _ in range(5):
+                await client.get_task_progress("sid-1")
+        finally:
+            await client.aclose()
+
+    with MockXfyunServer() as mock:
+        asyncio.run(run(mock.base_url))
+        async_connections = len(mock.connections)
+
+    with MockXfyunServer() as mock:
+        client = AIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+        for _ in range(5):
+            client.get_task_progress("sid-1")
+        client.close()
+        sync_connections = len(mock.connections)
+
+    print(f"异步客户端连接数: {async_connections}, 同步客户端连接数: {sync_connections}")
+    assert async_connections == 1 and sync_connections == 1
+    print("✅ 5次轮询只建立1条连接")
+
+
+def test_react_workflow():
+    """测试ReACT工作流使用异步客户端"""
+    print("\n🧪 测试5：ReACT工作流")
+    print("=" * 40)
+
+    async def run(base_url):
+        client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=base_url)
+        try:
+            return await execute_react_ppt_workflow(client, topic="人工智能在教育中的应用")
+        finally:
+            await client.aclose()
+
+    with MockXfyunServer() as mock:
+        result = asyncio.run(run(mock.base_url))
+    assert result["success"], result
+    print(f"✅ 工作流完成，任务ID: {result['task_id']}")
+
+
+def test_theme_cache():
+    """测试模板列表缓存：命中、并发未命中合并、过期后先返回旧值并后台刷新、失败不缓存"""
+    print("\n🧪 测试6：模板列表缓存")
+    print("=" * 40)
+
+    async def run(mock):
+        client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+        client.theme_cache = AsyncTTLCache(ttl=0.2, stale_ttl=5, max_entries=2,
+                                           cacheable=lambda result: result.get("code") == 0)
+        try:
+            await asyncio.gather(*[client.get_theme_list(style="简约") for _ in range(5)])
+            start = time.monotonic()
+            for _ in range(100):
+                await client.get_theme_list(style="简约")
+            hit_time = (time.monotonic() - start) / 100
+            assert mock.count("/template/list") == 1
+
+            await asyncio.sleep(0.25)
+            stale = await client.get_theme_list(style="简约")
+            assert stale["code"] == 0
+            await asyncio.sleep(0.05)
+            assert mock.count("/template/list") == 2, "过期后应在后台刷新一次"
+
+            mock.responses["/template/list"] = {"code": 10001, "desc": "参数错误"}
+            for _ in range(2):
+                await client.get_theme_list(style="商务")
+            assert mock.count("/template/list") == 4, "失败响应不应被缓存"
+
+            mock.responses.pop("/template/list")
+            for style in ("商务", "科技", "简约"):
+                await client.get_theme_list(style=style)
+            return hit_time, client.get_pool_stats()["theme_cache"]
+        finally:
+            await client.aclose()
+
+    with MockXfyunServer() as mock:
+        hit_time, stats = asyncio.run(run(mock))
+    print(f"缓存命中平均耗时 {hit_time * 1e6:.1f}μs, 统计: {stats}")
+    assert stats["size"] == 2 and stats["evictions"] >= 1
+    assert stats["stale_hits"] == 1 and stats["refreshes"] == 1
+    print("✅ 缓存命中无需请求上游，过期后后台刷新")
+
+
+def test_outline_singleflight():
+    """测试相同的进行中大纲请求只调用一次上游，个别调用方取消不影响其他调用方"""
+    print("\n🧪 测试7：大纲请求合并")
+    print("=" * 40)
+
+    async def run(base_url):
+        client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=base_url)
+        try:
+            impatient = asyncio.ensure_future(client.create_outline(text="人工智能"))
+            others = [client.create_outline(text="人工智能") for _ in range(9)]
+            await asyncio.sleep(0.05)
+            impatient.cancel()
+            results = await asyncio.gather(*others, client.create_outline(text="机器学习"))
+            return results, client.get_pool_stats()["outline_singleflight"]
+        finally:
+            await client.aclose()
+
+    with MockXfyunServer(delay=0.3) as mock:
+        results, stats = asyncio.run(run(mock.base_url))
+        upstream = mock.count("/createOutline")
+    print(f"上游请求 {upstream} 次, 统计: {stats}")
+    assert all(r["code"] == 0 for r in results)
+    assert upstream == 2
+    assert stats["upstream_calls_saved"] == 9
+    print("✅ 10个相同请求只调用一次上游")
+
+
+def test_outline_disk_cache():
+    """测试大纲磁盘缓存：相同内容命中缓存，重启后仍有效，use_cache=False强制重新生成"""
+    print("\n🧪 测试8：大纲磁盘缓存")
+    print("=" * 40)
+
+    with MockXfyunServer() as mock, tempfile.TemporaryDirectory() as tmp:
+        cache_config = {"path": os.path.join(tmp, "outlines")}
+        doc_a, doc_b = os.path.join(tmp, "a.txt"), os.path.join(tmp, "b.txt")
+        for path in (doc_a, doc_b):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("同一份教学大纲")
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url,
+                                      outline_cache_config=cache_config)
+            try:
+                first = await client.create_outline(text="人工智能")
+                second = await client.create_outline(text="人工智能")
+                forced = await client.create_outline(text="人工智能", use_cache=False)
+                # 关闭本地文本提取，验证上传文档时按内容命中缓存
+                await client.create_outline_by_doc(file_name="a.txt", text="课程", file_path=doc_a,
+                                                   preprocess=False)
+                # 同一份文档以不同文件名上传同样命中（按原文件上传与本地提取文本两种方式）
+                same_doc = await client.create_outline_by_doc(file_name="b.txt", text="课程", file_path=doc_b,
+                                                              preprocess=False)
+                await client.create_outline_by_doc(file_name="a.txt", text="课程", file_path=doc_a)
+                same_text = await client.create_outline_by_doc(file_name="副本.txt", text="课程", file_path=doc_b)
+            finally:
+                await client.aclose()
+            # 模拟重启
+            restarted = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url,
+                                         outline_cache_config=cache_config)
+            try:
+                after_restart = await restarted.create_outline(text="人工智能")
+                return (first, second, forced, same_doc, same_text, after_restart,
+                        restarted.get_pool_stats()["outline_cache"])
+            finally:
+                await restarted.aclose()
+
+        first, second, forced, same_doc, same_text, after_restart, stats = asyncio.run(run())
+        assert "cache_hit" not in first and second["cache_hit"] and "cache_hit" not in forced
+        assert same_doc["cache_hit"] and same_text["cache_hit"] and after_restart["cache_hit"]
+        assert second["data"] == first["data"]
+        assert mock.count("/createOutline") == 3 and mock.count("/createOutlineByDoc") == 1
+    print(f"缓存统计: {stats}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = DiskCache(tmp, max_bytes=300)
+        for i in range(5):
+            cache.put(f"{i:02d}" * 32, {"code": 0, "data": "x" * 80})
+            time.sleep(0.01)
+        stats = cache.get_stats()
+        assert stats["bytes"] <= 300 and stats["evictions"] >= 2
+        assert cache.get("04" * 32) is not None and cache.get("00" * 32) is None
+
+    # 有效期从写入时计算：频繁读取不会延长，重启后同样按写入时间过期
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = DiskCache(tmp, max_age=0.3)
+        cache.put("aa" * 32, {"code": 0})
+        hits = 0
+        for _ in range(6):
+            time.sleep(0.1)
+            hits += cache.get("aa" * 32) is not None
+        assert 1 <= hits < 6 and cache.get("aa" * 32) is None
+        cache.put("bb" * 32, {"code": 0})
+        time.sleep(0.2)
+        assert cache.get("bb" * 32) is not None
+        time.sleep(0.15)
+        assert DiskCache(tmp, max_age=0.3).get("bb" * 32) is None
+    print("✅ 相同内容不再请求上游，缓存超出容量时淘汰最久未访问的条目，有效期不因读取而延长")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 异步客户端测试")
+    print("=" * 50)
+    test_async_methods()
+    test_async_concurrency()
+    test_sync_client_compat()
+    test_connection_reuse()
+    test_react_workflow()
+    test_theme_cache()
+    test_outline_singleflight()
+    test_outline_disk_cache()
+    print("\n🎉 异步客户端测试完成!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试批量生成create_ppt_batch：并行度受密钥池容量限制、跟踪每个任务到完成、逐个推送结果（离线）
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+import asyncio
+import threading
+import time
+
+from main import AIPPTClient, AsyncAIPPTClient, BATCH_CONFIG
+from mock_xfyun_server import MockXfyunServer
+from task_tracker import TaskTracker
+
+TEST_KEY_POOL = [
+    {"app_id": "test_app_1", "api_secret": "secret_1", "name": "测试密钥1", "max_concurrent": 2, "enabled": True},
+    {"app_id": "test_app_2", "api_secret": "secret_2", "name": "测试密钥2", "max_concurrent": 3, "enabled": True},
+]
+
+
+class DeckBackend:
+    """模拟PPT生成：/create返回新sid，每个sid查询两次进度后完成；统计同时生成中的PPT数"""
+
+    def __init__(self, fail_texts=()):
+        self.fail_texts = set(fail_texts)
+        self.lock = threading.Lock()
+        self.polls = {}
+        self.active = 0
+        self.max_active = 0
+        self.counter = 0
+
+    def create(self, query, body):
+        time.sleep(0.02)
+        if any(text.encode("utf-8") in body for text in self.fail_texts):
+            return {"code": 20001, "desc": "模板不存在"}
+        with self.lock:
+            self.counter += 1
+            sid = f"batch-{self.counter}"
+            self.polls[sid] = 0
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        return {"code": 0, "data": {"sid": sid, "title": "测试PPT", "subTitle": "", "coverImgSrc": ""}}
+
+    def progress(self, query, body):
+        sid = query["sid"][0]
+        with self.lock:
+            self.polls[sid] += 1
+            done = self.polls[sid] >= 2
+            if done and self.polls[sid] == 2:
+                self.active -= 1
+        status = "done" if done else "building"
+        return {"code": 0, "data": {"pptStatus": status, "aiImageStatus": "done", "cardNoteStatus": "done",
+                                    "totalPages": 10, "donePages": 10 if done else 5,
+                                    "pptUrl": f"http://example.invalid/{sid}.pptx" if done else ""}}
+
+    def install(self, mock):
+        mock.responses["/create"] = self.create
+        mock.responses["/progress"] = self.progress
+
+
+def test_bounded_batch():
+    """测试20个任务在容量为5的密钥池上执行：同时生成的PPT不超过5个，全部跟踪到完成"""
+    print("🧪 测试1：并行度受密钥池容量限制")
+    print("=" * 40)
+
+    backend = DeckBackend(fail_texts=["无效任务"])
+    jobs = [{"text": f"课程{i}", "template_id": "T1"} for i in range(19)]
+    jobs.append({"text": "无效任务", "template_id": "bad"})
+    streamed = []
+
+    async def on_result(result):
+        streamed.append(result)
+
+    with MockXfyunServer() as mock:
+        backend.install(mock)
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+            client.progress_scheduler.freshness = 0.0
+            tracker = TaskTracker(client.progress_scheduler.poll, {"min_interval": 0.02, "max_interval": 0.05})
+            try:
+                return await client.create_ppt_batch(jobs, tracker=tracker, on_result=on_result)
+            finally:
+                await tracker.aclose()
+                await client.aclose()
+
+        result = asyncio.run(run())
+
+    print(f"总计 {result['total']}，成功 {result['succeeded']}，失败 {result['failed']}，"
+          f"耗时 {result['elapsed']}秒，同时生成最多 {backend.max_active} 个")
+    assert result["status_counts"] == {"done": 19, "submit_failed": 1}
+    assert [r["index"] for r in result["results"]] == list(range(20))
+    assert all(r["ppt_url"] == f"http://example.invalid/{r['sid']}.pptx" for r in result["results"][:19])
+    assert result["results"][19]["error"] == "模板不存在"
+    assert 1 < backend.max_active <= 5
+    assert len(streamed) == 20
+    print("✅ 同时生成的任务数不超过密钥池容量，每个任务完成即推送结果")
+
+
+def test_validation():
+    """测试任务参数在提交前校验"""
+    print("\n🧪 测试2：任务参数校验")
+    print("=" * 40)
+
+    client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url="http://127.0.0.1:9")
+    for jobs in ([], [{"text": "缺少模板"}], [{"text": "a", "template_id": "T", "color": "红色"}]):
+        try:
+            asyncio.run(client.create_ppt_batch(jobs))
+            raise AssertionError(f"应拒绝: {jobs}")
+        except ValueError as e:
+            print(f"已拒绝: {e}")
+    print("✅ 不合法的任务列表在任何请求之前被拒绝")
+
+
+def test_sync_batch():
+    """测试同步客户端的批量生成"""
+    print("\n🧪 测试3：同步客户端批量生成")
+    print("=" * 40)
+
+    backend = DeckBackend()
+    original_interval = BATCH_CONFIG["poll_interval"]
+    BATCH_CONFIG["poll_interval"] = 0.01
+    try:
+        with MockXfyunServer() as mock:
+            backend.install(mock)
+            client = AIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+            finished = []
+            result = client.create_ppt_batch([{"text": f"周报{i}", "template_id": "T1"} for i in range(8)],
+                                             max_parallel=2, on_result=finished.append)
+            submitted = client.create_ppt_batch([{"text": "只提交", "template_id": "T1"}],
+                                                wait_for_completion=False)
+            client.close()
+    finally:
+        BATCH_CONFIG["poll_interval"] = original_interval
+
+    print(f"状态统计: {result['status_counts']}，同时生成最多 {backend.max_active} 个")
+    assert result["succeeded"] == 8 and len(finished) == 8
+    assert backend.max_active <= 2
+    assert submitted["results"][0]["status"] == "submitted" and submitted["results"][0]["sid"]
+    print("✅ 同步批量生成按max_parallel限制并行度")
+
+
+def test_job_error_isolated():
+    """测试单个任务等待完成时出错只影响该任务的结果，其余任务正常完成"""
+    print("\n🧪 测试4：单个任务出错不影响整批")
+    print("=" * 40)
+
+    class FlakyTracker(TaskTracker):
+        async def wait(self, sid, timeout, on_progress=None):
+            if sid == "batch-2":
+                raise RuntimeError("进度回调异常")
+            return await super().wait(sid, timeout, on_progress)
+
+    backend = DeckBackend()
+    with MockXfyunServer() as mock:
+        backend.install(mock)
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+            client.progress_scheduler.freshness = 0.0
+            tracker = FlakyTracker(client.progress_scheduler.poll, {"min_interval": 0.02, "max_interval": 0.05})
+            try:
+                return await client.create_ppt_batch([{"text": f"课程{i}", "template_id": "T1"} for i in range(4)],
+                                                     max_parallel=1, tracker=tracker)
+            finally:
+                await tracker.aclose()
+                await client.aclose()
+
+        result = asyncio.run(run())
+
+    print(f"状态统计: {result['status_counts']}")
+    assert result["status_counts"] == {"done": 3, "error": 1}
+    failed = result["results"][1]
+    assert failed["sid"] == "batch-2" and failed["error"] == "进度回调异常" and not failed["success"]
+    print("✅ 出错的任务记为error，整批结果照常返回")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 批量生成测试")
+    print("=" * 50)
+    test_bounded_batch()
+    test_validation()
+    test_sync_batch()
+    test_job_error_isolated()
+    print("\n🎉 批量生成测试完成!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试create_outline_by_doc的文档上传：上传前校验、流式发送、重试复用、文件句柄释放与本地文本预处理（离线）
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+import asyncio
+import tempfile
+import time
+import zipfile
+
+from document_text import DocumentTooLong, condense_text, count_chars, extract_text, truncate_text
+from main import AIPPTClient, AsyncAIPPTClient, DocumentUpload, RetryBudget, RetryPolicy
+from mock_xfyun_server import MockXfyunServer
+
+TEST_KEY_POOL = [
+    {"app_id": "test_app", "api_secret": "test_secret", "name": "测试密钥", "max_concurrent": 50, "enabled": True}
+]
+
+
+def open_fds(directory: str) -> int:
+    """统计指向directory内文件的描述符（不计模拟服务器尚未关闭的套接字）"""
+    if not os.path.isdir("/proc/self/fd"):
+        return 0
+    count = 0
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            count += os.readlink(f"/proc/self/fd/{fd}").startswith(directory)
+        except OSError:
+            continue
+    return count
+
+
+def write_file(directory, name, content: bytes) -> str:
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def make_docx(paragraphs) -> bytes:
+    """生成只包含word/document.xml的最小docx，paragraphs为[(样式, 文本)]"""
+    body = "".join(
+        f'<w:p>{f"<w:pPr><w:pStyle w:val=\"{style}\"/></w:pPr>" if style else ""}<w:r><w:t>{text}</w:t></w:r></w:p>'
+        for style, text in paragraphs)
+    xml = ('<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+           f'<w:body>{body}</w:body></w:document>')
+    path = tempfile.mktemp(suffix=".docx")
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("word/document.xml", xml)
+    with open(path, "rb") as f:
+        data = f.read()
+    os.remove(path)
+    return data
+
+
+def test_validation_before_network():
+    """测试类型、大小、文件头校验在任何网络请求之前完成"""
+    print("🧪 测试1：上传前校验")
+    print("=" * 40)
+
+    with MockXfyunServer() as mock, tempfile.TemporaryDirectory() as tmp:
+        cases = {
+            "类型不支持": write_file(tmp, "a.exe", b"MZ"),
+            "文档为空": write_file(tmp, "b.txt", b""),
+            "扩展名不符": write_file(tmp, "c.pdf", b"not a pdf"),
+            "超过大小": write_file(tmp, "d.txt", b"x" * (10 * 1024 * 1024 + 1)),
+        }
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+            errors = {}
+            try:
+                for case, path in cases.items():
+                    try:
+                        await client.create_outline_by_doc(file_name=os.path.basename(path), text="x",
+                                                           file_path=path)
+                    except ValueError as e:
+                        errors[case] = str(e)
+            finally:
+                await client.aclose()
+            return errors
+
+        errors = asyncio.run(run())
+        for case, message in errors.items():
+            print(f"{case}: {message}")
+        assert set(errors) == set(cases)
+        assert mock.count("/createOutlineByDoc") == 0
+    print("✅ 不合规文档在发出请求前被拒绝")
+
+
+def test_streaming_and_retry_reuse():
+    """测试文档完整上传，5xx重试时复用同一份映射，结束后句柄全部释放"""
+    print("\n🧪 测试2：流式上传与重试复用")
+    print("=" * 40)
+
+    content = b"%PDF-1.4\n" + os.urandom(512 * 1024)
+    bodies = []
+
+    def capture(query, body):
+        bodies.append(body)
+        return {"_status": 503, "code": -1} if len(bodies) == 1 else None
+
+    with MockXfyunServer() as mock, tempfile.TemporaryDirectory() as tmp:
+        mock.responses["/createOutlineByDoc"] = capture
+        path = write_file(tmp, "syllabus.pdf", content)
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+            client.retry_policy = RetryPolicy({"base_delay": 0.01}, budget=RetryBudget(0.2, 1.0, 100.0))
+            try:
+                return await client.create_outline_by_doc(file_name="syllabus.pdf", text="课程", file_path=path,
+                                                          preprocess=False)
+            finally:
+                await client.aclose()
+
+        fds_before = open_fds(tmp)
+        result = asyncio.run(run())
+        assert result["code"] == 0 and len(bodies) == 2
+        assert all(content in body for body in bodies), "每次重试都应发送完整文档"
+
+        # 同步客户端同样确定性关闭文件
+        client = AIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+        for _ in range(20):
+            assert client.create_outline_by_doc(file_name="syllabus.pdf", text="课程", file_path=path)["code"] == 0
+        client.close()
+        fds_after = open_fds(tmp)
+    print(f"上传前后打开的文件描述符: {fds_before} -> {fds_after}")
+    assert fds_after <= fds_before
+    print("✅ 文档完整上传，重试复用内存映射，无文件句柄泄漏")
+
+
+def test_document_upload_lifecycle():
+    """测试DocumentUpload的独立读取游标与关闭"""
+    print("\n🧪 测试3：DocumentUpload生命周期")
+    print("=" * 40)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_file(tmp, "a.md", b"# title\n" * 1000)
+        with DocumentUpload(path) as upload:
+            first, second = upload.reader(), upload.reader()
+            assert first.read(8) == b"# title\n"
+            assert second.read() == b"# title\n" * 1000
+            assert first.len == upload.size - 8
+        assert upload.view is None
+    print("✅ 每次请求使用独立游标，退出with后映射与文件均已关闭")
+
+
+def test_text_extraction():
+    """测试txt/md/docx文本提取，以及截断、压缩的字数控制"""
+    print("\n🧪 测试4：文本提取与字数控制")
+    print("=" * 40)
+
+    assert extract_text("# 标题\n\n\n正文  内容".encode("gb18030"), "md") == "# 标题\n正文 内容"
+    docx = make_docx([("Heading1", "第一章 概述"), (None, "人工智能是一门学科。它研究智能。"), (None, "")])
+    assert extract_text(docx, "docx") == "# 第一章 概述\n人工智能是一门学科。它研究智能。"
+    assert extract_text(b"\xd0\xcf\x11\xe0", "doc") is None
+    assert extract_text(b"not a zip", "docx") is None
+
+    sections = "\n".join(f"# 第{i}节\n" + "这是第一句。" + "补充说明内容。" * 40 for i in range(60))
+    condensed = condense_text(sections, 8000)
+    truncated = truncate_text(sections, 8000)
+    print(f"原文 {count_chars(sections)} 字 -> 压缩 {count_chars(condensed)} 字，截断 {count_chars(truncated)} 字")
+    assert count_chars(condensed) <= 8000 and count_chars(truncated) <= 8000
+    assert all(f"# 第{i}节" in condensed for i in range(60)), "压缩后应保留全部标题"
+    assert truncated.endswith("。") and sections.startswith(truncated)
+    print("✅ 提取结果规整，截断与压缩后均在字数限制内")
+
+
+def test_preprocess_submits_text():
+    """测试本地文档以文本方式提交、超长文档在请求前被拒绝"""
+    print("\n🧪 测试5：本地预处理后以文本方式生成大纲")
+    print("=" * 40)
+
+    queries = []
+
+    def capture(query, body):
+        queries.append(body)
+        return None
+
+    with MockXfyunServer() as mock, tempfile.TemporaryDirectory() as tmp:
+        mock.responses["/createOutline"] = capture
+        docx_path = write_file(tmp, "plan.docx", make_docx([("Heading1", "教学目标"), (None, "掌握机器学习基础。")]))
+        long_path = write_file(tmp, "long.txt", ("很长的课程资料。" * 2000).encode("utf-8"))
+        # 文档本身未超限，但加上text与引导语后超过8000字
+        edge_path = write_file(tmp, "edge.txt", ("字" * 7995).encode("utf-8"))
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+            try:
+                result = await client.create_outline_by_doc(file_name="plan.docx", text="课程", file_path=docx_path,
+                                                            use_cache=False)
+                try:
+                    await client.create_outline_by_doc(file_name="long.txt", text="课程", file_path=long_path)
+                    rejected = False
+                except DocumentTooLong as e:
+                    print(f"超长文档: {e}")
+                    rejected = True
+                truncated = await client.create_outline_by_doc(file_name="long.txt", text="课程", file_path=long_path,
+                                                               overflow="truncate", use_cache=False)
+                rejected_with_text = []
+                for text, overflow in (("课程大纲", "error"), ("要求" * 4000, "truncate")):
+                    try:
+                        await client.create_outline_by_doc(file_name="edge.txt", text=text, file_path=edge_path,
+                                                           overflow=overflow, use_cache=False)
+                    except DocumentTooLong as e:
+                        print(f"合计超长: {e}")
+                        rejected_with_text.append(e.chars > e.max_chars == 8000)
+                return result, rejected, truncated, rejected_with_text, client.get_pool_stats()["doc_preprocess"]
+            finally:
+                await client.aclose()
+
+        fds_before = open_fds(tmp)
+        result, rejected, truncated, rejected_with_text, stats = asyncio.run(run())
+        fds_after = open_fds(tmp)
+        assert result["code"] == 0 and result["preprocess"]["mode"] == "text"
+        assert "掌握机器学习基础" in queries[0].decode("utf-8")
+        assert rejected and len(queries) == 2
+        assert truncated["preprocess"]["overflow_handling"] == "truncate"
+        assert truncated["preprocess"]["submitted_chars"] <= 8000 < truncated["preprocess"]["original_chars"]
+        # 上限针对整个提交内容（text+引导语+文档）
+        submitted = queries[1].decode("utf-8")
+        assert "以下是文档的内容" in submitted and "long.txt" not in submitted
+        assert truncated["preprocess"]["submitted_chars"] > 7900
+        assert rejected_with_text == [True, True]
+        assert mock.count("/createOutlineByDoc") == 0
+        assert fds_after <= fds_before
+    print(f"预处理统计: {stats}")
+    assert stats["as_text"] == 2 and stats["rejected"] == 3 and stats["truncated"] == 1
+    print("✅ 文档以文本方式提交，超长文档未产生任何上游请求")
+
+
+def test_file_url_prefetch():
+    """测试file_url预取：同一URL并发下载合并、不同URL相同内容复用大纲、下载并发有界"""
+    print("\n🧪 测试6：file_url预取与按内容去重")
+    print("=" * 40)
+
+    content = b"%PDF-1.4\n" + os.urandom(64 * 1024)
+    with MockXfyunServer(delay=0.1) as mock, tempfile.TemporaryDirectory() as tmp:
+        mock.files.update({"a.pdf": content, "mirror.pdf": content})
+        mock.files.update({f"other{i}.pdf": b"%PDF-1.4\n" + os.urandom(1024) for i in range(6)})
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url,
+                                      outline_cache_config={"path": os.path.join(tmp, "outlines")},
+                                      prefetch_config={"enabled": True, "max_concurrent": 2,
+                                                       "allowed_private_hosts": ["127.0.0.1"]})
+            try:
+                same_url = await asyncio.gather(*[
+                    client.create_outline_by_doc(file_name="a.pdf", text="课程", file_url=mock.file_url("a.pdf"))
+                    for _ in range(5)])
+                mirror = await client.create_outline_by_doc(file_name="a.pdf", text="课程",
+                                                            file_url=mock.file_url("mirror.pdf"))
+                errors = []
+                try:
+                    await client.create_outline_by_doc(file_name="missing.pdf", text="课程",
+                                                       file_url=mock.file_url("missing.pdf"))
+                except ValueError as e:
+                    errors.append(str(e))
+
+                started = time.perf_counter()
+                await asyncio.gather(*[client.document_fetcher.fetch(mock.file_url(f"other{i}.pdf"))
+                                       for i in range(6)])
+                bounded_elapsed = time.perf_counter() - started
+                return same_url, mirror, errors, bounded_elapsed, client.get_pool_stats()["doc_prefetch"]
+            finally:
+                await client.aclose()
+
+        same_url, mirror, errors, bounded_elapsed, stats = asyncio.run(run())
+        print(f"预取统计: {stats}")
+        print(f"6个下载（并发上限2，每个0.1秒）耗时: {bounded_elapsed:.2f}秒")
+        assert all(r["code"] == 0 for r in same_url) and mirror["cache_hit"]
+        assert mock.count("/files/a.pdf") == 1 and mock.count("/files/mirror.pdf") == 1
+        assert mock.count("/createOutlineByDoc") == 1, "相同内容只应生成一次大纲"
+        assert errors and "HTTP 404" in errors[0]
+        assert stats["coalesced"] == 4 and stats["duplicate_content"] >= 1
+        assert bounded_elapsed >= 0.3
+    print("✅ 相同URL只下载一次，相同内容只生成一次大纲，下载并发受限")
+
+
+def test_prefetch_blocks_internal_addresses():
+    """测试file_url预取不会访问内网：调用参数不能开启预取，内网地址与重定向到内网的地址都被拒绝"""
+    print("\n🧪 测试7：预取拒绝内网地址")
+    print("=" * 40)
+
+    content = b"%PDF-1.4\n" + os.urandom(1024)
+    with MockXfyunServer() as mock:
+        port = mock.file_url("a.pdf").split(":")[2].split("/")[0]
+        mock.files["a.pdf"] = content
+        # 允许的内网主机重定向到同一台机器的其他主机名，第二跳同样要检查
+        mock.redirects["hop.pdf"] = f"http://localhost:{port}/files/a.pdf"
+        mock.redirects["ok.pdf"] = "/files/a.pdf"
+
+        async def run():
+            disabled = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+            enabled = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url,
+                                       prefetch_config={"enabled": True,
+                                                        "allowed_private_hosts": ["127.0.0.1"]})
+            strict = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url,
+                                      prefetch_config={"enabled": True})
+            errors = {}
+            try:
+                # 服务端未启用预取时，prefetch=True不会让服务端下载file_url
+                passthrough = await disabled.create_outline_by_doc(
+                    file_name="a.pdf", text="课程", file_url=mock.file_url("a.pdf"), prefetch=True)
+                for case, url, client in (
+                        ("回环地址", mock.file_url("a.pdf"), strict),
+                        ("元数据地址", "http://169.254.169.254/latest/meta-data/", strict),
+                        ("非http协议", "file:///etc/passwd", strict),
+                        ("重定向到内网", mock.file_url("hop.pdf"), enabled)):
+                    try:
+                        await client.document_fetcher.fetch(url)
+                    except ValueError as e:
+                        errors[case] = str(e)
+                followed = await enabled.document_fetcher.fetch(mock.file_url("ok.pdf"))
+                return passthrough, errors, followed, strict.get_pool_stats()["doc_prefetch"]
+            finally:
+                for client in (disabled, enabled, strict):
+                    await client.aclose()
+
+        passthrough, errors, followed, stats = asyncio.run(run())
+        for case, message in errors.items():
+            print(f"{case}: {message}")
+        assert passthrough["code"] == 0 and mock.count("/createOutlineByDoc") == 1
+        assert set(errors) == {"回环地址", "元数据地址", "非http协议", "重定向到内网"}
+        assert "localhost" in errors["重定向到内网"]
+        assert followed == content
+        # 只有允许的主机上的两次请求（ok.pdf及其重定向目标）与被拒绝前的第一跳真正发出
+        assert mock.count("/files/a.pdf") == 1 and mock.count("/files/hop.pdf") == 1
+        assert stats["blocked"] == 2
+    print("✅ 调用参数不能开启预取，内网与重定向到内网的地址在连接前被拒绝")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 文档上传测试")
+    print("=" * 50)
+    test_validation_before_network()
+    test_streaming_and_retry_reuse()
+    test_document_upload_lifecycle()
+    test_text_extraction()
+    test_preprocess_submits_text()
+    test_file_url_prefetch()
+    test_prefetch_blocks_internal_addresses()
+    print("\n🎉 文档上传测试完成!")
+
+
+if __name__ == "__main__":
+    main()
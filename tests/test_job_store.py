@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试生成任务持久化存储JobStore：记录sid与密钥、重启后继续跟踪与重新提交（离线）
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+import asyncio
+import socket
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+
+from main import AsyncAIPPTClient
+from job_store import JobStore
+from mock_xfyun_server import MockXfyunServer
+from task_tracker import TaskTracker
+from test_batch import DeckBackend, TEST_KEY_POOL
+
+TRACKER_CONFIG = {"min_interval": 0.02, "max_interval": 0.05}
+
+
+def test_store_lifecycle():
+    """测试任务状态流转、重新打开后数据仍在、过期记录清理"""
+    print("🧪 测试1：任务状态流转与持久化")
+    print("=" * 40)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "jobs.sqlite3")
+        store = JobStore(path)
+        queued = store.add_queued("create_ppt_batch", {"text": "课程1", "template_id": "T1"})
+        rejected = store.add_queued("create_ppt_batch", {"text": "课程2", "template_id": "bad"})
+        store.mark_submitted(queued, "create_ppt_batch", {}, "sid-1", "测试密钥1")
+        store.mark_submitted(None, "create_ppt_task", {"text": "单个"}, "sid-2", "测试密钥2")
+        store.mark_submit_failed(rejected, "模板不存在")
+        store.update_progress({"sid": "sid-1", "status": "building", "progress": 40, "finished": False})
+        # 单次查询失败不覆盖已有状态
+        store.update_progress({"sid": "sid-1", "status": "error", "progress": 40, "finished": False,
+                               "error": "timeout"})
+        store.update_progress({"sid": "sid-2", "status": "done", "progress": 100, "finished": True,
+                               "ppt_url": "http://example.invalid/2.pptx"})
+        store.update_progress({"sid": "sid-2", "status": "building", "progress": 50, "finished": False})
+        batch_ids = store.add_queued_many("create_ppt_batch", [{"text": f"批量{i}"} for i in range(3)])
+        assert batch_ids == [queued + 3, queued + 4, queued + 5]
+        store.mark_submitted(batch_ids[0], "create_ppt_batch", {}, "sid-3", "测试密钥1")
+        assert store.cancel_queued(batch_ids) == 2
+        store.update_progress({"sid": "sid-3", "status": "done", "progress": 100, "finished": True})
+        store.close()
+
+        reopened = JobStore(path)
+        pending = reopened.pending()
+        print(f"重新打开后未结束的任务: {[(job['sid'], job['status']) for job in pending]}")
+        assert [(job["sid"], job["status"], job["key_name"]) for job in pending] == \
+            [("sid-1", "building", "测试密钥1")]
+        assert pending[0]["params"] == {"text": "课程1", "template_id": "T1"}
+        assert reopened.get("sid-2")["status"] == "done"
+        assert reopened.get("sid-2")["ppt_url"] == "http://example.invalid/2.pptx"
+        assert reopened.get_stats()["jobs"] == {"building": 1, "done": 2, "submit_failed": 1, "cancelled": 2}
+
+        reopened.retention = 0
+        time.sleep(0.01)
+        assert reopened.prune() == 5
+        assert reopened.get_stats()["jobs"] == {"building": 1}
+        reopened.close()
+    print("✅ 状态按进度快照更新，重新打开后保持不变")
+
+
+def test_client_records_jobs():
+    """测试客户端提交任务时记录sid与实际使用的密钥，跟踪器更新最终状态"""
+    print("\n🧪 测试2：提交与跟踪写入任务存储")
+    print("=" * 40)
+
+    backend = DeckBackend()
+    with MockXfyunServer() as mock, tempfile.TemporaryDirectory() as tmp:
+        backend.install(mock)
+        path = os.path.join(tmp, "jobs.sqlite3")
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url,
+                                      job_store_config={"path": path})
+            client.progress_scheduler.freshness = 0.0
+            tracker = TaskTracker(client.progress_scheduler.poll, TRACKER_CONFIG,
+                                  on_change=client.job_store.update_progress)
+            try:
+                single = await client.create_ppt_task("单个任务", "T1")
+                batch = await client.create_ppt_batch(
+                    [{"text": f"课程{i}", "template_id": "T1"} for i in range(3)], tracker=tracker)
+                await tracker.wait(single["data"]["sid"], 5)
+                return single, batch, client.get_pool_stats()["job_store"]
+            finally:
+                await tracker.aclose()
+                await client.aclose()
+
+        single, batch, stats = asyncio.run(run())
+        store = JobStore(path)
+        record = store.get(single["data"]["sid"])
+        store.close()
+
+    print(f"任务存储统计: {stats['jobs']}")
+    assert batch["succeeded"] == 3
+    assert stats["jobs"] == {"done": 4}
+    assert record["kind"] == "create_ppt_task" and record["params"]["text"] == "单个任务"
+    assert record["key_name"] in ("测试密钥1", "测试密钥2")
+    assert record["ppt_url"] == f"http://example.invalid/{record['sid']}.pptx"
+    print("✅ 每个任务的sid、密钥与最终状态都已落盘")
+
+
+def test_resume_after_restart():
+    """测试模拟重启：继续跟踪已提交的任务，重新提交排队中的任务，已提交的不会重复提交"""
+    print("\n🧪 测试3：重启后恢复任务")
+    print("=" * 40)
+
+    backend = DeckBackend()
+    with MockXfyunServer() as mock, tempfile.TemporaryDirectory() as tmp:
+        backend.install(mock)
+        path = os.path.join(tmp, "jobs.sqlite3")
+
+        # 上一次运行：提交了两个任务（尚未完成），另有两个批量任务还在排队时进程退出
+        async def first_run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url,
+                                      job_store_config={"path": path})
+            try:
+                return [await client.create_ppt_task(f"进行中{i}", "T1") for i in range(2)]
+            finally:
+                await client.aclose()
+
+        submitted = asyncio.run(first_run())
+        store = JobStore(path)
+        for i in range(2):
+            store.add_queued("create_ppt_batch", {"text": f"排队{i}", "template_id": "T1"})
+        store.close()
+        creates_before = mock.count("/create")
+
+        async def second_run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url,
+                                      job_store_config={"path": path})
+            client.progress_scheduler.freshness = 0.0
+            tracker = TaskTracker(client.progress_scheduler.poll, TRACKER_CONFIG,
+                                  on_change=client.job_store.update_progress)
+            try:
+                resumed = await client.resume_jobs(tracker)
+                while client.job_store.pending():
+                    await asyncio.sleep(0.02)
+                return resumed, client.job_store.get_stats()
+            finally:
+                await tracker.aclose()
+                await client.aclose()
+
+        resumed, stats = asyncio.run(asyncio.wait_for(second_run(), 10))
+        creates_after = mock.count("/create")
+
+    print(f"恢复结果: {resumed}，任务存储统计: {stats['jobs']}")
+    assert all(result["code"] == 0 for result in submitted)
+    assert resumed == {"tracked": 2, "resubmitted": 2}
+    assert creates_after - creates_before == 2
+    assert stats["jobs"] == {"done": 4}
+    print("✅ 重启后进行中的任务继续跟踪到完成，只有排队中的任务被重新提交")
+
+
+def test_cancelled_batch_not_resumed():
+    """测试批量调用被取消时未提交的任务标记为已取消，重启后不会被重新提交"""
+    print("\n🧪 测试4：取消的批量任务")
+    print("=" * 40)
+
+    backend = DeckBackend()
+    with MockXfyunServer() as mock, tempfile.TemporaryDirectory() as tmp:
+        backend.install(mock)
+        path = os.path.join(tmp, "jobs.sqlite3")
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url,
+                                      job_store_config={"path": path})
+            tracker = TaskTracker(client.progress_scheduler.poll, {"min_interval": 5, "max_interval": 5})
+            try:
+                batch = asyncio.create_task(client.create_ppt_batch(
+                    [{"text": f"课程{i}", "template_id": "T1"} for i in range(12)], max_parallel=2,
+                    tracker=tracker))
+                # 等前两个任务提交后（此后它们在等待生成完成）取消整个批量调用
+                while mock.count("/create") < 2:
+                    await asyncio.sleep(0.01)
+                await asyncio.sleep(0.05)
+                batch.cancel()
+                await asyncio.gather(batch, return_exceptions=True)
+                stats = client.job_store.get_stats()["jobs"]
+                resumed = await client.resume_jobs(tracker)
+                return stats, resumed
+            finally:
+                await tracker.aclose()
+                await client.aclose()
+
+        stats, resumed = asyncio.run(run())
+        creates = mock.count("/create")
+
+    print(f"取消后任务存储统计: {stats}，恢复结果: {resumed}")
+    assert stats == {"submitted": 2, "cancelled": 10}
+    assert resumed == {"tracked": 2, "resubmitted": 0}
+    assert creates == 2
+    print("✅ 已提交的任务继续跟踪，未提交的任务不会被重新提交")
+
+
+def test_claim_across_processes():
+    """测试多个进程共用存储文件：存活进程的排队任务不被接手，所属进程退出或租约过期后每个任务只被认领一次"""
+    print("\n🧪 测试5：跨进程认领排队任务")
+    print("=" * 40)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "jobs.sqlite3")
+        # 旧版本的存储文件（没有owner、lease_until列）中遗留的排队任务
+        legacy = sqlite3.connect(path)
+        legacy.executescript("""
+            CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, params TEXT NOT NULL,
+                status TEXT NOT NULL, sid TEXT UNIQUE, key_name TEXT, progress INTEGER NOT NULL DEFAULT 0,
+                ppt_url TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL);
+            INSERT INTO jobs (kind, params, status, created_at, updated_at)
+                VALUES ('create_ppt_batch', '{"text": "旧任务"}', 'queued', 0, 0);
+        """)
+        legacy.commit()
+        legacy.close()
+
+        owner = JobStore(path, lease=0.3)
+        other, third = JobStore(path), JobStore(path)
+        job_ids = owner.add_queued_many("create_ppt_batch", [{"text": f"排队{i}"} for i in range(6)])
+
+        # 所属进程存活且租约有效：只有无所属进程的旧任务可以认领
+        legacy_claim = other.claim_queued()
+        assert [job["params"]["text"] for job in legacy_claim] == ["旧任务"]
+        assert legacy_claim[0]["status"] == "resubmitting"
+        assert third.claim_queued() == []
+
+        # 同一主机上已退出的进程：无需等待租约过期
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        db = sqlite3.connect(path)
+        db.execute("UPDATE jobs SET owner = ?, lease_until = ? WHERE id = ?",
+                   (f"{socket.gethostname()}:{dead.pid}:0", time.time() + 3600, job_ids[0]))
+        db.commit()
+        db.close()
+        assert [job["id"] for job in third.claim_queued()] == [job_ids[0]]
+
+        # 所属进程续约期间不会被接手
+        for _ in range(3):
+            time.sleep(0.15)
+            assert owner.renew_leases() == 5
+            assert other.claim_queued() == []
+
+        # 租约过期后两个进程同时认领：每个任务只归其中一个
+        time.sleep(0.4)
+        barrier = threading.Barrier(2)
+        claims = {}
+
+        def claim(name, store):
+            barrier.wait()
+            claims[name] = [job["id"] for job in store.claim_queued()]
+
+        threads = [threading.Thread(target=claim, args=(name, store))
+                   for name, store in (("other", other), ("third", third))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(f"认领结果: {claims}")
+        assert sorted(claims["other"] + claims["third"]) == job_ids[1:]
+        # 已被其他进程认领的任务，原所属进程也不会再续约
+        assert owner.renew_leases() == 0
+        for store in (owner, other, third):
+            store.close()
+    print("✅ 排队任务按所属进程与租约认领，不会被两个进程重复提交")
+
+
+def test_concurrent_resume():
+    """测试两个服务进程同时从同一个存储文件恢复，排队任务只被重新提交一次"""
+    print("\n🧪 测试6：同时恢复")
+    print("=" * 40)
+
+    backend = DeckBackend()
+    with MockXfyunServer() as mock, tempfile.TemporaryDirectory() as tmp:
+        backend.install(mock)
+        path = os.path.join(tmp, "jobs.sqlite3")
+        store = JobStore(path)
+        store.add_queued_many("create_ppt_batch", [{"text": f"排队{i}", "template_id": "T1"} for i in range(8)])
+        store.close()
+
+        async def run():
+            clients = [AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url,
+                                        job_store_config={"path": path}) for _ in range(2)]
+            trackers = [TaskTracker(client.progress_scheduler.poll, {"min_interval": 5, "max_interval": 5})
+                        for client in clients]
+            try:
+                return await asyncio.gather(*(client.resume_jobs(tracker)
+                                              for client, tracker in zip(clients, trackers)))
+            finally:
+                for client, tracker in zip(clients, trackers):
+                    await tracker.aclose()
+                    await client.aclose()
+
+        resumed = asyncio.run(asyncio.wait_for(run(), 10))
+        creates = mock.count("/create")
+
+    print(f"两个进程的恢复结果: {resumed}")
+    assert sum(result["resubmitted"] for result in resumed) == 8
+    assert creates == 8
+    print("✅ 每个排队任务只被一个进程重新提交")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 任务存储测试")
+    print("=" * 50)
+    test_store_lifecycle()
+    test_client_records_jobs()
+    test_resume_after_restart()
+    test_cancelled_batch_not_resumed()
+    test_claim_across_processes()
+    test_concurrent_resume()
+    print("\n🎉 任务存储测试完成!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试APIKeyPool的并发安全、密钥选择与排队获取（离线，无需网络）
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+import asyncio
+import random
+import threading
+import time
+
+from main import APIKeyPool, KeyPoolTimeout
+
+
+def make_keys(count, max_concurrent=10):
+    return [
+        {
+            "app_id": f"app_{i}",
+            "api_secret": f"secret_{i}",
+            "name": f"密钥{i}",
+            "max_concurrent": max_concurrent,
+            "enabled": True
+        }
+        for i in range(count)
+    ]
+
+
+def test_best_key_selection():
+    """测试最优密钥选择：低负载、低错误率优先，饱和密钥被跳过"""
+    print("🧪 测试1：最优密钥选择")
+    print("=" * 40)
+
+    pool = APIKeyPool(make_keys(3, max_concurrent=2))
+    assert pool.get_best_key()[0] == 0
+
+    pool.mark_request_start(0)
+    assert pool.get_best_key()[0] == 1
+
+    # 密钥1出错后，评分变差
+    pool.mark_request_start(1)
+    pool.mark_request_end(1, success=False)
+    assert pool.get_best_key()[0] == 2
+
+    # 密钥0、2饱和后只剩密钥1
+    pool.mark_request_start(0)
+    pool.mark_request_start(2)
+    pool.mark_request_start(2)
+    assert pool.get_best_key()[0] == 1
+    print("✅ 选择结果符合评分规则")
+
+
+def test_thread_safety():
+    """测试多线程并发标记后计数不漂移"""
+    print("\n🧪 测试2：多线程计数一致性")
+    print("=" * 40)
+
+    pool = APIKeyPool(make_keys(8, max_concurrent=1000))
+    threads_count, per_thread = 16, 2000
+
+    def worker():
+        for _ in range(per_thread):
+            key_index, _ = pool.get_best_key()
+            pool.mark_request_start(key_index)
+            pool.mark_request_end(key_index, success=random.random() > 0.1)
+
+    threads = [threading.Thread(target=worker) for _ in range(threads_count)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    stats = pool.get_stats()["usage_stats"]
+    total_requests = sum(s["requests"] for s in stats.values())
+    print(f"{threads_count * per_thread}次选择+标记耗时 {elapsed:.2f}s")
+    assert total_requests == threads_count * per_thread
+    assert all(s["concurrent"] == 0 for s in stats.values())
+    assert len(pool._heap) <= 4 * len(pool.key_pool) + 16
+    print("✅ 请求数与并发数无漂移")
+
+
+def test_acquire_backpressure():
+    """测试所有密钥饱和时acquire排队等待而不是超额占用，且按FIFO顺序获得密钥"""
+    print("\n🧪 测试3：饱和时排队等待")
+    print("=" * 40)
+
+    pool = APIKeyPool(make_keys(2, max_concurrent=1))
+    held = [pool.acquire(timeout=1)[0], pool.acquire(timeout=1)[0]]
+    assert sorted(held) == [0, 1]
+
+    # 所有密钥饱和：超时而非超额使用
+    try:
+        pool.acquire(timeout=0.05)
+        assert False, "应当超时"
+    except KeyPoolTimeout:
+        pass
+
+    order = []
+
+    def waiter(name):
+        key_index, _ = pool.acquire(timeout=2)
+        order.append(name)
+        time.sleep(0.05)
+        pool.release(key_index)
+
+    threads = []
+    for name in ("A", "B", "C"):
+        thread = threading.Thread(target=waiter, args=(name,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.05)  # 保证入队顺序
+
+    assert pool.get_stats()["waiting"] == 3
+    for key_index in held:
+        pool.release(key_index)
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+
+    stats = pool.get_stats()
+    print(f"获得密钥顺序: {order}")
+    assert order == ["A", "B", "C"]
+    assert all(s["concurrent"] == 0 for s in stats["usage_stats"].values())
+    print("✅ 排队者按FIFO顺序获得密钥，并发从未超过上限")
+
+
+def test_async_lease():
+    """测试异步上下文管理器在协程间的排队"""
+    print("\n🧪 测试4：异步lease")
+    print("=" * 40)
+
+    pool = APIKeyPool(make_keys(1, max_concurrent=2))
+    peak = 0
+
+    async def job():
+        nonlocal peak
+        async with pool.lease_async(timeout=5):
+            peak = max(peak, pool.get_stats()["usage_stats"][0]["concurrent"])
+            await asyncio.sleep(0.02)
+
+    async def run():
+        await asyncio.gather(*[job() for _ in range(10)])
+
+    asyncio.run(run())
+    assert peak == 2
+    assert pool.get_stats()["usage_stats"][0]["concurrent"] == 0
+    print("✅ 10个协程共享2个并发名额，峰值并发为2")
+
+
+def test_circuit_breaker():
+    """测试熔断：连续失败的密钥被摘除，冷却后半开探测，探测成功恢复"""
+    print("\n🧪 测试5：熔断与恢复")
+    print("=" * 40)
+
+    pool = APIKeyPool(make_keys(2), health_config={"failure_threshold": 3, "open_seconds": 0.2})
+    for _ in range(3):
+        pool.mark_request_start(0)
+        pool.mark_request_end(0, success=False, latency=0.5)
+
+    health = pool.get_stats()["key_info"][0]["health"]
+    print(f"熔断后状态: {health}")
+    assert health["state"] == "open"
+    assert all(pool.acquire(timeout=1)[0] == 1 for _ in range(5))
+    for _ in range(5):
+        pool.release(1)
+
+    # 只剩熔断密钥时，等待者在冷却结束后拿到探测名额
+    pool_single = APIKeyPool(make_keys(1), health_config={"failure_threshold": 1, "open_seconds": 0.2})
+    pool_single.mark_request_start(0)
+    pool_single.mark_request_end(0, success=False)
+    start = time.monotonic()
+    key_index, _ = pool_single.acquire(timeout=2)
+    waited = time.monotonic() - start
+    assert 0.15 < waited < 1.0
+    assert pool_single.get_stats()["key_info"][0]["health"]["state"] == "half_open"
+    pool_single.release(key_index, success=True)
+    assert pool_single.get_stats()["key_info"][0]["health"]["state"] == "closed"
+    print(f"✅ 冷却{waited:.2f}秒后半开探测，探测成功后恢复closed")
+
+
+def test_error_rate_decay():
+    """测试错误率随时间衰减，旧错误不会永久惩罚密钥"""
+    print("\n🧪 测试6：错误率时间衰减")
+    print("=" * 40)
+
+    pool = APIKeyPool(make_keys(2), health_config={"half_life": 0.1, "failure_threshold": 100,
+                                                   "min_samples": 1000})
+    for _ in range(10):
+        pool.mark_request_start(0)
+        pool.mark_request_end(0, success=False)
+    assert pool.get_best_key()[0] == 1
+    time.sleep(0.6)
+    rate = pool.get_stats()["key_info"][0]["health"]["error_rate"]
+    # 没有新请求时比值不变，但旧样本的总权重已衰减到约1/64
+    print(f"0.6秒后衰减错误率: {rate}")
+    # 一次成功请求后权重几乎全部来自新样本
+    pool.mark_request_start(0)
+    pool.mark_request_end(0, success=True)
+    assert pool.get_stats()["key_info"][0]["health"]["error_rate"] < 0.5
+    print("✅ 旧错误权重按半衰期衰减")
+
+
+def test_token_bucket():
+    """测试令牌桶：QPS限流时排队等待令牌，每日配额耗尽的密钥不再被选中"""
+    print("\n🧪 测试7：令牌桶限流")
+    print("=" * 40)
+
+    keys = make_keys(1, max_concurrent=100)
+    keys[0].update({"qps": 20, "burst": 2})
+    pool = APIKeyPool(keys)
+    start = time.monotonic()
+    for _ in range(12):
+        key_index, _ = pool.acquire(timeout=5)
+        pool.release(key_index)
+    elapsed = time.monotonic() - start
+    print(f"QPS=20、burst=2时12次获取耗时 {elapsed:.2f}s")
+    assert 0.4 < elapsed < 1.5
+
+    keys = make_keys(2)
+    keys[0]["daily_quota"] = 2
+    pool = APIKeyPool(keys)
+    chosen = []
+    for _ in range(4):
+        key_index, _ = pool.acquire(timeout=1)
+        chosen.append(key_index)
+        pool.release(key_index)
+    print(f"选择顺序: {chosen}, 限流状态: {pool.get_stats()['key_info'][0]['rate_limit']}")
+    assert chosen.count(0) == 2 and chosen[2:] == [1, 1]
+    print("✅ 配额耗尽的密钥被跳过，无需请求上游")
+
+
+def test_cancel_not_recorded():
+    """测试调用方取消时归还密钥但不记录健康样本：半开状态不会被取消的请求关闭"""
+    print("\n🧪 测试8：取消不计入健康度")
+    print("=" * 40)
+
+    pool = APIKeyPool(make_keys(1, max_concurrent=1), health_config={"failure_threshold": 2, "open_seconds": 0.1})
+    pool.mark_request_start(0)
+    pool.mark_request_end(0, success=False)
+    assert pool.get_stats()["key_info"][0]["health"]["consecutive_failures"] == 1
+
+    async def probe():
+        async with pool.lease_async(timeout=1):
+            await asyncio.sleep(10)
+
+    async def run():
+        # 占满唯一的名额，排队者在分配到密钥后、使用之前被取消
+        holder = asyncio.create_task(probe())
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(pool.acquire_async(timeout=5))
+        await asyncio.sleep(0.01)
+        holder.cancel()
+        waiter.cancel()
+        await asyncio.gather(holder, waiter, return_exceptions=True)
+
+    asyncio.run(run())
+    health = pool.get_stats()["key_info"][0]["health"]
+    print(f"取消后状态: {health}")
+    assert health["consecutive_failures"] == 1 and health["error_rate"] == 1.0
+    assert pool.get_stats()["usage_stats"][0]["concurrent"] == 0
+
+    # 熔断后的半开探测被取消，仍保持半开，等待真正的探测结果
+    pool.mark_request_start(0)
+    pool.mark_request_end(0, success=False)
+    assert pool.get_stats()["key_info"][0]["health"]["state"] == "open"
+    time.sleep(0.12)
+
+    async def cancelled_probe():
+        task = asyncio.create_task(probe())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(cancelled_probe())
+    assert pool.get_stats()["key_info"][0]["health"]["state"] == "half_open"
+    print("✅ 取消的请求只归还名额，不改变错误率与熔断状态")
+
+
+def test_stale_lease_ignored():
+    """测试熔断前发出的请求在半开状态下才结束时，其成功结果不会关闭熔断器，只有探测请求的结果算数"""
+    print("\n🧪 测试9：熔断前的请求不代替探测")
+    print("=" * 40)
+
+    pool = APIKeyPool(make_keys(1, max_concurrent=2), health_config={"failure_threshold": 1, "open_seconds": 0.1})
+    slow, _ = pool.acquire(timeout=1)
+    failing, _ = pool.acquire(timeout=1)
+    pool.release(failing, success=False)
+    assert pool.get_stats()["key_info"][0]["health"]["state"] == "open"
+    time.sleep(0.12)
+    # 熔断前发出的慢请求在冷却结束后成功返回：仍保持半开
+    assert pool.try_acquire() is None
+    pool.release(slow, success=True)
+    health = pool.get_stats()["key_info"][0]["health"]
+    print(f"熔断前的请求结束后状态: {health}")
+    assert health["state"] == "half_open"
+
+    # 真正的探测请求失败则再次熔断，成功则恢复
+    probe, _ = pool.acquire(timeout=1)
+    assert pool.try_acquire() is None
+    pool.release(probe, success=False)
+    assert pool.get_stats()["key_info"][0]["health"]["state"] == "open"
+    time.sleep(0.25)
+    probe, _ = pool.acquire(timeout=1)
+    pool.release(probe, success=True)
+    assert pool.get_stats()["key_info"][0]["health"]["state"] == "closed"
+    print("✅ 只有半开状态下发出的探测请求决定熔断器是否恢复")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 密钥池离线测试")
+    print("=" * 50)
+    test_best_key_selection()
+    test_thread_safety()
+    test_acquire_backpressure()
+    test_async_lease()
+    test_circuit_breaker()
+    test_error_rate_decay()
+    test_token_bucket()
+    test_cancel_not_recorded()
+    test_stale_lease_ignored()
+    print("\n🎉 密钥池离线测试完成!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试重试策略：错误码分类、指数退避、总时限（含工具调用总时限）、重试预算与对冲请求（使用本地模拟服务器）
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+import asyncio
+import time
+
+from main import (AsyncAIPPTClient, CallDeadline, RetryBudget, RetryPolicy, RequestDeadlineExceeded,
+                  ToolWorkerPool, UpstreamHTTPError, _call_deadline)
+from mock_xfyun_server import MockXfyunServer
+
+TEST_KEY_POOL = [
+    {"app_id": "app_a", "api_secret": "secret_a", "name": "密钥A", "max_concurrent": 5, "enabled": True},
+    {"app_id": "app_b", "api_secret": "secret_b", "name": "密钥B", "max_concurrent": 5, "enabled": True}
+]
+
+
+def sequence(*responses):
+    """按顺序返回预设响应，之后返回默认响应"""
+    pending = list(responses)
+
+    def handler(query, body):
+        return pending.pop(0) if pending else None
+    return handler
+
+
+def make_client(base_url, **retry_config):
+    client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=base_url)
+    client.retry_policy = RetryPolicy({"base_delay": 0.05, **retry_config},
+                                      budget=RetryBudget(0.2, 1.0, 100.0))
+    return client
+
+
+def policy_kind(status_code: int, text: str) -> str:
+    """按客户端的响应检查与重试策略对一个HTTP响应分类"""
+    client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL)
+    try:
+        client._check_response(status_code, text)
+        error = None
+    except UpstreamHTTPError as e:
+        error = e
+    return RetryPolicy().classify(error=error).kind
+
+
+def test_classify():
+    """测试按响应code分类"""
+    print("🧪 测试1：错误分类")
+    print("=" * 40)
+
+    policy = RetryPolicy()
+    assert policy.classify({"code": 0}).kind == RetryPolicy.SUCCESS
+    assert policy.classify({"code": 11202, "desc": "秒级流控"}).kind == RetryPolicy.RATE_LIMITED
+    assert policy.classify({"code": 11200}).kind == RetryPolicy.KEY_ERROR
+    assert policy.classify({"code": 10001, "desc": "参数错误"}).kind == RetryPolicy.FATAL
+    assert policy.classify(error=ValueError("bad")).kind == RetryPolicy.FATAL
+    # 异常文本中包含"rate"不再被误判为限流
+    assert policy.classify(error=RuntimeError("separate error")).kind == RetryPolicy.FATAL
+    print("✅ 分类基于响应code而不是异常文本")
+
+
+def test_rate_limited_switches_key():
+    """测试流控错误换密钥重试，且当前密钥被暂停"""
+    print("\n🧪 测试2：流控后换密钥重试")
+    print("=" * 40)
+
+    with MockXfyunServer() as mock:
+        mock.responses["/progress"] = sequence({"code": 11202, "desc": "秒级流控超限"})
+        client = make_client(mock.base_url)
+
+        async def run():
+            try:
+                return await client.get_task_progress("sid-1")
+            finally:
+                await client.aclose()
+
+        result = asyncio.run(run())
+        assert result["code"] == 0
+        assert mock.count("/progress") == 2
+    stats = client.get_pool_stats()
+    assert all(s["errors"] == 0 for s in stats["usage_stats"].values())
+    print("✅ 第二次请求成功，流控不计入密钥错误")
+
+
+def test_transient_backoff():
+    """测试5xx错误指数退避后重试，最终返回成功"""
+    print("\n🧪 测试3：5xx退避重试")
+    print("=" * 40)
+
+    with MockXfyunServer() as mock:
+        mock.responses["/template/list"] = sequence({"_status": 503, "code": -1}, {"_status": 502, "code": -1})
+        client = make_client(mock.base_url)
+
+        async def run():
+            try:
+                return await client.get_theme_list(page_size=1)
+            finally:
+                await client.aclose()
+
+        result = asyncio.run(run())
+        assert result["code"] == 0 and mock.count("/template/list") == 3
+    print("✅ 两次5xx后第三次成功")
+
+
+def test_fatal_not_retried():
+    """测试不可重试的业务错误只请求一次并原样返回，非JSON响应体的4xx也不重试"""
+    print("\n🧪 测试4：业务错误不重试")
+    print("=" * 40)
+
+    with MockXfyunServer() as mock:
+        mock.responses["/createOutline"] = {"code": 10001, "desc": "参数错误"}
+        client = make_client(mock.base_url)
+
+        async def run():
+            try:
+                return await client.create_outline(text="x")
+            finally:
+                await client.aclose()
+
+        result = asyncio.run(run())
+        assert result["code"] == 10001 and mock.count("/createOutline") == 1
+
+        # 响应体不是JSON的4xx（如网关返回的错误页）同样不重试
+        mock.responses["/create"] = {"_status": 403, "_body": "<html>Forbidden</html>"}
+        client = make_client(mock.base_url)
+
+        async def run_create():
+            try:
+                return await client.create_ppt_task("课程", "T1")
+            finally:
+                await client.aclose()
+
+        try:
+            asyncio.run(run_create())
+            raise AssertionError("应抛出客户端错误")
+        except UpstreamHTTPError as e:
+            print(f"错误信息: {e}")
+            assert e.status_code == 403
+        assert mock.count("/create") == 1
+    assert policy_kind(403, "<html>Forbidden</html>") == RetryPolicy.FATAL
+    assert policy_kind(400, "") == RetryPolicy.FATAL
+    assert policy_kind(502, "<html>Bad Gateway</html>") == RetryPolicy.TRANSIENT
+    print("✅ 只请求一次")
+
+
+def test_deadline():
+    """测试总时限：慢请求在时限到达时被取消"""
+    print("\n🧪 测试5：总时限")
+    print("=" * 40)
+
+    with MockXfyunServer(delay=1.0) as mock:
+        client = make_client(mock.base_url, deadline=0.3)
+
+        async def run():
+            try:
+                return await client.get_task_progress("sid-1")
+            finally:
+                await client.aclose()
+
+        start = time.monotonic()
+        try:
+            asyncio.run(run())
+            assert False, "应当超时"
+        except RequestDeadlineExceeded as e:
+            print(f"超时信息: {e}")
+        assert time.monotonic() - start < 0.9
+    print("✅ 超过总时限立即返回")
+
+
+def test_call_deadline_shared():
+    """测试工具调用总时限：同一次工具调用中的多次上游请求共用截止时间，不会每个请求重新计时"""
+    print("\n🧪 测试6：工具调用总时限")
+    print("=" * 40)
+
+    with MockXfyunServer(delay=0.2) as mock:
+        client = make_client(mock.base_url, deadline=1.0)
+
+        async def tool_call():
+            # 与handle_call_tool相同：在工具调用入口设置一次截止时间
+            _call_deadline.set(CallDeadline(0.3))
+            first = await client.create_ppt_task("课程1", "T1")
+            try:
+                await client.create_ppt_task("课程2", "T1")
+                raise AssertionError("第二个请求应受工具调用总时限约束")
+            except RequestDeadlineExceeded as e:
+                print(f"超时信息: {e}")
+            return first
+
+        async def run():
+            try:
+                start = time.monotonic()
+                # 每次工具调用在各自的任务中处理
+                first = await asyncio.create_task(tool_call())
+                elapsed = time.monotonic() - start
+                # 截止时间只作用于本次调用，之后的请求按各自的时限计时
+                later = await client.create_ppt_task("课程3", "T1")
+                return first, elapsed, later
+            finally:
+                await client.aclose()
+
+        first, elapsed, later = asyncio.run(asyncio.wait_for(run(), 5))
+    print(f"工具调用耗时 {elapsed:.2f}s")
+    assert first["code"] == 0 and later["code"] == 0
+    assert elapsed < 0.5
+    assert all(k["concurrent"] == 0 for k in client.get_pool_stats()["key_info"])
+
+    # 在工作池中排队的时间不计入总时限：排队0.3秒后放行的调用仍有完整的0.2秒
+    pool = ToolWorkerPool(max_workers=1)
+
+    async def queued_call():
+        _call_deadline.set(CallDeadline(0.2))
+
+        async def remaining():
+            return _call_deadline.get().expires() - time.monotonic()
+        return await pool.run(remaining)
+
+    async def run_queued():
+        holder = asyncio.create_task(pool.run(asyncio.sleep, 0.3))
+        await asyncio.sleep(0.01)
+        return await asyncio.create_task(queued_call()), await holder
+
+    remaining, _ = asyncio.run(run_queued())
+    print(f"排队后放行时剩余时限: {remaining:.2f}s")
+    assert remaining > 0.15
+    print("✅ 多次上游请求共用工具调用的总时限，排队时间不计入")
+
+
+def test_budget():
+    """测试重试预算耗尽后不再重试"""
+    print("\n🧪 测试7：重试预算")
+    print("=" * 40)
+
+    budget = RetryBudget(ratio=0.0, min_per_second=0.0, max_tokens=1.0)
+    assert budget.try_spend() is True
+    assert budget.try_spend() is False
+    assert budget.get_stats()["exhausted"] == 1
+    print("✅ 预算耗尽后拒绝重试")
+
+
+def test_hedged_request():
+    """测试对冲请求：主请求变慢时在另一个密钥上重发，取先返回的结果"""
+    print("\n🧪 测试8：对冲请求")
+    print("=" * 40)
+
+    calls = []
+
+    def slow_first(query, body):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            time.sleep(1.0)
+        return None
+
+    with MockXfyunServer() as mock:
+        mock.responses["/progress"] = slow_first
+        client = make_client(mock.base_url)
+        client.hedge_config.update({"enabled": True, "delay": 0.1})
+
+        async def run():
+            try:
+                start = time.monotonic()
+                result = await client.get_task_progress("sid-1")
+                return result, time.monotonic() - start
+            finally:
+                await client.aclose()
+
+        result, elapsed = asyncio.run(run())
+        assert result["code"] == 0 and mock.count("/progress") == 2
+    stats = client.get_pool_stats()
+    print(f"耗时 {elapsed:.2f}s, 对冲统计: {stats['hedging']}")
+    assert elapsed < 0.6
+    assert stats["hedging"]["fired"] == 1 and stats["hedging"]["won"] == 1
+    assert all(k["concurrent"] == 0 for k in stats["key_info"])
+    # 被取消的落后请求不记录健康样本，只有对冲请求的结果计入
+    assert sorted(h.total_weight > 0 for h in client.key_pool_manager.health) == [False, True]
+    print("✅ 对冲请求先返回，落后请求被取消且密钥已释放（不计入健康度）")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 重试策略测试")
+    print("=" * 50)
+    test_classify()
+    test_rate_limited_switches_key()
+    test_transient_backoff()
+    test_fatal_not_retried()
+    test_deadline()
+    test_call_deadline_shared()
+    test_budget()
+    test_hedged_request()
+    print("\n🎉 重试策略测试完成!")
+
+
+if __name__ == "__main__":
+    main()
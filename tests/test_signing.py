@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试请求签名RequestSigner：签名正确性、按（密钥, 秒）缓存，以及签名开销的微基准（离线）
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+import base64
+import hashlib
+import hmac
+import time
+import timeit
+
+from main import AsyncAIPPTClient, RequestSigner
+
+KEY_A = ("test_app_1", "secret_1")
+KEY_B = ("test_app_2", "secret_2")
+
+
+def reference_signature(app_id: str, api_secret: str, timestamp: int) -> str:
+    """讯飞智文文档中的签名算法：base64(HMAC-SHA1(api_secret, MD5(app_id + timestamp)))"""
+    auth = hashlib.md5((app_id + str(timestamp)).encode("utf-8")).hexdigest()
+    return base64.b64encode(hmac.new(api_secret.encode("utf-8"), auth.encode("utf-8"),
+                                     hashlib.sha1).digest()).decode("utf-8")
+
+
+class FakeClock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_signature_matches_reference():
+    """测试签名与参考实现一致，请求头字段不变"""
+    print("🧪 测试1：签名正确性")
+    print("=" * 40)
+
+    signer = RequestSigner()
+    for timestamp in (0, 1700000000, 1700000001):
+        for app_id, secret in (KEY_A, KEY_B, ("应用", "密钥")):
+            assert signer.signature(app_id, secret, timestamp) == reference_signature(app_id, secret, timestamp)
+
+    client = AsyncAIPPTClient(key_pool=[{"app_id": KEY_A[0], "api_secret": KEY_A[1], "name": "测试密钥",
+                                         "max_concurrent": 2, "enabled": True}])
+    headers = client._get_headers({"app_id": KEY_A[0], "api_secret": KEY_A[1]})
+    print(f"请求头: {headers}")
+    assert set(headers) == {"appId", "timestamp", "signature", "Content-Type"}
+    assert headers["signature"] == reference_signature(*KEY_A, int(headers["timestamp"]))
+    assert headers["Content-Type"] == "application/json; charset=utf-8"
+    print("✅ 签名与参考实现一致")
+
+
+def test_cache_per_key_and_second():
+    """测试同一密钥同一秒内复用签名，换秒或换密钥时重新计算，返回的请求头互不影响"""
+    print("\n🧪 测试2：按（密钥, 秒）缓存")
+    print("=" * 40)
+
+    clock = FakeClock(1700000000.2)
+    signer = RequestSigner(clock=clock)
+    first = signer.headers(*KEY_A, "application/json")
+    first["Content-Length"] = "10"  # 调用方修改请求头不影响缓存
+    clock.now = 1700000000.9
+    second = signer.headers(*KEY_A, "multipart/form-data; boundary=x")
+    other_key = signer.headers(*KEY_B, "application/json")
+    clock.now = 1700000001.0
+    next_second = signer.headers(*KEY_A, "application/json")
+
+    assert "Content-Length" not in second
+    assert second["signature"] == first["signature"] and second["Content-Type"].startswith("multipart")
+    assert other_key["signature"] == reference_signature(*KEY_B, 1700000000)
+    assert next_second["timestamp"] == "1700000001"
+    assert next_second["signature"] == reference_signature(*KEY_A, 1700000001)
+    stats = signer.get_stats()
+    print(f"统计: {stats}")
+    assert stats == {"hits": 1, "misses": 3, "keys": 2}
+    print("✅ 同一秒内只计算一次签名，时间戳变化后立即更新")
+
+
+def test_signing_microbenchmark():
+    """微基准：轮询热路径上每次请求构建签名请求头的开销"""
+    print("\n🧪 测试3：签名开销微基准")
+    print("=" * 40)
+
+    signer = RequestSigner()
+    number = 20000
+
+    def uncached():
+        timestamp = int(time.time())
+        return {"appId": KEY_A[0], "timestamp": str(timestamp),
+                "signature": reference_signature(*KEY_A, timestamp), "Content-Type": "application/json"}
+
+    def cached():
+        return signer.headers(*KEY_A, "application/json")
+
+    uncached_time = min(timeit.repeat(uncached, number=number, repeat=3)) / number
+    cached_time = min(timeit.repeat(cached, number=number, repeat=3)) / number
+    print(f"每次重新计算: {uncached_time * 1e6:.2f}μs/次")
+    print(f"按秒缓存:     {cached_time * 1e6:.2f}μs/次（{uncached_time / cached_time:.1f}倍）")
+    print(f"缓存统计: {signer.get_stats()}")
+    assert cached_time < uncached_time
+    print("✅ 缓存命中时签名开销只剩构建请求头字典")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 请求签名测试")
+    print("=" * 50)
+    test_signature_matches_reference()
+    test_cache_per_key_and_second()
+    test_signing_microbenchmark()
+    print("\n🎉 请求签名测试完成!")
+
+
+if __name__ == "__main__":
+    main()
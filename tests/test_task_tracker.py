@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试任务进度跟踪器TaskTracker与进度查询调度器（离线，无需网络）
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+import asyncio
+import time
+
+from main import AsyncAIPPTClient
+from mock_xfyun_server import MockXfyunServer
+from task_tracker import TaskTracker, summarize_progress
+
+FAST_CONFIG = {"min_interval": 0.02, "max_interval": 0.1}
+
+
+def progress_response(ppt_status, done_pages=0, total_pages=10):
+    return {"code": 0, "data": {"pptStatus": ppt_status, "aiImageStatus": "done",
+                                "cardNoteStatus": "done", "totalPages": total_pages,
+                                "donePages": done_pages, "pptUrl": "http://example.invalid/a.pptx"}}
+
+
+def scripted_fetch(responses):
+    """按顺序返回预设进度，用完后一直返回最后一个"""
+    calls = []
+
+    async def fetch(sid, delay=0.0):
+        await asyncio.sleep(delay)
+        calls.append(sid)
+        return responses[min(len(calls), len(responses)) - 1]
+    return fetch, calls
+
+
+def test_summarize():
+    """测试进度快照的状态判断"""
+    print("🧪 测试1：进度快照")
+    print("=" * 40)
+
+    assert summarize_progress("s", progress_response("building", 3))["progress"] == 30
+    done = summarize_progress("s", progress_response("done", 10))
+    assert done["finished"] and done["status"] == "done" and done["ppt_url"]
+    assert summarize_progress("s", progress_response("build_failed"))["status"] == "failed"
+    assert summarize_progress("s", {"code": 20002, "desc": "任务不存在"})["status"] == "error"
+    print("✅ 状态与进度百分比正确")
+
+
+def test_shared_polling():
+    """测试多个等待者共享同一个轮询协程，任务完成后立即返回"""
+    print("\n🧪 测试2：共享轮询与长轮询等待")
+    print("=" * 40)
+
+    fetch, calls = scripted_fetch([progress_response("building", 2), progress_response("building", 6),
+                                   progress_response("done", 10)])
+
+    async def run():
+        tracker = TaskTracker(fetch, FAST_CONFIG)
+        events = []
+
+        async def on_progress(snapshot):
+            events.append(snapshot["progress"])
+
+        results = await asyncio.gather(
+            tracker.wait("sid-1", 5, on_progress=on_progress),
+            tracker.wait("sid-1", 5),
+            tracker.wait("sid-1", 5))
+        return results, events, tracker.get_stats()
+
+    results, events, stats = asyncio.run(run())
+    print(f"进度事件: {events}, 统计: {stats}")
+    assert all(r["status"] == "done" for r in results)
+    assert len(calls) == 3, "三个等待者应只产生一组上游查询"
+    assert events == [20, 60, 100]
+    assert stats["completed"] == 1 and stats["active"] == 0
+    print("✅ 三个等待者共享3次上游查询")
+
+
+def test_wait_timeout_and_backoff():
+    """测试等待超时返回当前进度，无进度变化时轮询间隔逐步拉长"""
+    print("\n🧪 测试3：超时与自适应间隔")
+    print("=" * 40)
+
+    fetch, calls = scripted_fetch([progress_response("building", 1)])
+
+    async def run():
+        tracker = TaskTracker(fetch, FAST_CONFIG)
+        start = time.monotonic()
+        snapshot = await tracker.wait("sid-2", 0.5)
+        elapsed = time.monotonic() - start
+        interval = tracker._tasks["sid-2"].interval
+        await tracker.aclose()
+        return snapshot, elapsed, interval
+
+    snapshot, elapsed, interval = asyncio.run(run())
+    print(f"等待 {elapsed:.2f}s, 上游查询 {len(calls)} 次, 当前间隔 {interval}s")
+    assert not snapshot["finished"] and snapshot["progress"] == 10
+    assert interval == FAST_CONFIG["max_interval"]
+    assert len(calls) < 0.5 / FAST_CONFIG["min_interval"]
+    print("✅ 超时返回当前进度，间隔拉长减少无效查询")
+
+
+def test_tracker_with_client():
+    """测试跟踪器通过异步客户端查询模拟服务器"""
+    print("\n🧪 测试4：结合异步客户端")
+    print("=" * 40)
+
+    responses = [progress_response("building", 5), progress_response("done", 10)]
+    with MockXfyunServer() as mock:
+        mock.responses["/progress"] = lambda query, body: responses.pop(0) if len(responses) > 1 else responses[0]
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=[{"app_id": "app", "api_secret": "secret", "name": "测试",
+                                                 "max_concurrent": 5, "enabled": True}],
+                                      base_url=mock.base_url)
+            tracker = TaskTracker(client.progress_scheduler.poll, FAST_CONFIG)
+            try:
+                return await tracker.wait("sid-3", 5)
+            finally:
+                await client.aclose()
+
+        snapshot = asyncio.run(run())
+        assert snapshot["status"] == "done" and mock.count("/progress") == 2
+    print(f"✅ 任务完成，下载地址: {snapshot['ppt_url']}")
+
+
+def test_scheduler_coalescing():
+    """测试进度调度器：同一sid的并发查询合并，提前到期，查询均匀分布到各密钥"""
+    print("\n🧪 测试5：进度查询合并调度")
+    print("=" * 40)
+
+    keys = [{"app_id": f"app_{i}", "api_secret": f"secret_{i}", "name": f"密钥{i}",
+             "max_concurrent": 10, "enabled": True} for i in range(3)]
+
+    async def run(base_url):
+        client = AsyncAIPPTClient(key_pool=keys, base_url=base_url)
+        try:
+            # 10个会话同时查询同一个sid
+            same = await asyncio.gather(*[client.get_task_progress("sid-same") for _ in range(10)])
+            # 已排在1秒后的查询被新的即时查询提前
+            start = time.monotonic()
+            scheduled = asyncio.ensure_future(client.progress_scheduler.poll("sid-late", delay=1.0))
+            await asyncio.sleep(0.01)
+            await client.get_task_progress("sid-late")
+            await scheduled
+            early = time.monotonic() - start
+            # 不同sid并发查询
+            await asyncio.gather(*[client.get_task_progress(f"sid-{i}") for i in range(6)])
+            return same, early, client.get_pool_stats()
+        finally:
+            await client.aclose()
+
+    with MockXfyunServer(delay=0.1) as mock:
+        same, early, stats = asyncio.run(run(mock.base_url))
+        upstream = mock.count("/progress")
+    per_key = [s["requests"] for s in stats["usage_stats"].values()]
+    print(f"上游查询 {upstream} 次, 调度统计: {stats['progress_scheduler']}, 各密钥请求数: {per_key}")
+    assert all(r["code"] == 0 for r in same)
+    assert upstream == 1 + 1 + 6
+    assert early < 0.5
+    assert stats["progress_scheduler"]["coalesced"] == 10
+    assert max(per_key) - min(per_key) <= 2
+    print("✅ 并发查询合并为一次上游请求，查询分布均匀")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 任务进度跟踪测试")
+    print("=" * 50)
+    test_summarize()
+    test_shared_polling()
+    test_wait_timeout_and_backoff()
+    test_tracker_with_client()
+    test_scheduler_coalescing()
+    print("\n🎉 任务进度跟踪测试完成!")
+
+
+if __name__ == "__main__":
+    main()
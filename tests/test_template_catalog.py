@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试本地模板目录索引TemplateCatalog（使用本地模拟服务器，无需网络）
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+import asyncio
+import tempfile
+
+from main import AsyncAIPPTClient
+from mock_xfyun_server import MockXfyunServer
+from template_catalog import TemplateCatalog
+
+TEST_KEY_POOL = [
+    {"app_id": "test_app", "api_secret": "test_secret", "name": "测试密钥", "max_concurrent": 10, "enabled": True}
+]
+
+STYLES = ["简约", "商务", "科技"]
+COLORS = ["红色", "蓝色"]
+INDUSTRIES = ["教育培训", "金融", "通用", "医疗"]
+
+
+def make_catalog(free_count=30, paid_count=220):
+    """生成模拟模板数据：{pay_type: [模板]}"""
+    catalog = {}
+    for pay_type, count in (("free", free_count), ("not_free", paid_count)):
+        catalog[pay_type] = [
+            {"templateIndexId": f"{pay_type}-{i}", "templateName": f"模板{i}",
+             "style": STYLES[i % 3], "color": COLORS[i % 2], "industry": INDUSTRIES[i % 4]}
+            for i in range(count)
+        ]
+    return catalog
+
+
+def paged_handler(catalog):
+    """按payType/pageNum/pageSize分页返回模板"""
+    def handler(query, body):
+        templates = catalog[query["payType"][0]]
+        page_num, page_size = int(query["pageNum"][0]), int(query["pageSize"][0])
+        start = (page_num - 1) * page_size
+        return {"code": 0, "data": {"total": len(templates), "list": templates[start:start + page_size]}}
+    return handler
+
+
+def test_crawl_and_search():
+    """测试全量抓取后在本地任意条件组合筛选与分页"""
+    print("🧪 测试1：全量抓取与本地筛选")
+    print("=" * 40)
+
+    data = make_catalog()
+    with MockXfyunServer() as mock, tempfile.TemporaryDirectory() as tmp:
+        mock.responses["/template/list"] = paged_handler(data)
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+            catalog = TemplateCatalog(client._fetch_theme_page, os.path.join(tmp, "catalog.json"), page_size=100)
+            try:
+                return catalog, await catalog.refresh()
+            finally:
+                await client.aclose()
+
+        catalog, result = asyncio.run(run())
+        print(f"抓取结果: {result}, 上游请求 {mock.count('/template/list')} 次")
+        assert result["total"] == 250
+        assert mock.count("/template/list") == 1 + 3
+
+        paid_tech_blue = [t for t in data["not_free"] if t["style"] == "科技" and t["color"] == "蓝色"]
+        page = catalog.search(pay_type="not_free", style="科技", color="蓝色", page_num=2, page_size=5)
+        assert page["data"]["total"] == len(paid_tech_blue)
+        assert [t["templateIndexId"] for t in page["data"]["list"]] == \
+            [t["templateIndexId"] for t in paid_tech_blue[5:10]]
+        assert catalog.search(industry="金融")["data"]["total"] == \
+            sum(1 for templates in data.values() for t in templates if t["industry"] == "金融")
+        assert catalog.search(style="不存在")["data"]["total"] == 0
+    print("✅ 筛选与分页结果与全量数据一致")
+
+
+def test_persist_and_incremental_refresh():
+    """测试持久化热启动与增量刷新"""
+    print("\n🧪 测试2：热启动与增量刷新")
+    print("=" * 40)
+
+    data = make_catalog(free_count=5, paid_count=5)
+    with MockXfyunServer() as mock, tempfile.TemporaryDirectory() as tmp:
+        mock.responses["/template/list"] = paged_handler(data)
+        path = os.path.join(tmp, "catalog.json")
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+            try:
+                await TemplateCatalog(client._fetch_theme_page, path).refresh()
+                # 重启：从磁盘加载，无需请求上游即可查询
+                requests_before = mock.count("/template/list")
+                warm = TemplateCatalog(client._fetch_theme_page, path)
+                assert warm.ready and warm.search()["data"]["total"] == 10
+                assert mock.count("/template/list") == requests_before
+
+                data["free"].pop(0)
+                data["not_free"].append({"templateIndexId": "not_free-new", "style": "简约",
+                                         "color": "红色", "industry": "金融"})
+                data["not_free"][0] = {**data["not_free"][0], "templateName": "改名"}
+                return await warm.refresh(), warm
+            finally:
+                await client.aclose()
+
+        result, warm = asyncio.run(run())
+    print(f"增量刷新结果: {result}")
+    assert result == {"added": 1, "updated": 1, "removed": 1, "total": 10}
+    assert warm.search(industry="金融", color="红色", pay_type="not_free")["data"]["total"] >= 1
+    print("✅ 重启后直接可用，刷新只替换变化的模板")
+
+
+def test_incremental_stops_early():
+    """测试增量刷新遇到全是未变化模板的分页时停止抓取，定期全量抓取发现深层分页的变化"""
+    print("\n🧪 测试3：增量刷新提前停止")
+    print("=" * 40)
+
+    data = make_catalog(free_count=30, paid_count=220)
+    with MockXfyunServer() as mock:
+        mock.responses["/template/list"] = paged_handler(data)
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+            catalog = TemplateCatalog(client._fetch_theme_page, page_size=100, full_refresh_every=3)
+            try:
+                await catalog.refresh()
+                # 第3页的模板改名（总数不变），增量刷新只抓取每种类型的第1页
+                data["not_free"][210] = {**data["not_free"][210], "templateName": "改名"}
+                counts = []
+                for _ in range(3):
+                    before = mock.count("/template/list")
+                    result = await catalog.refresh()
+                    counts.append((mock.count("/template/list") - before, result["updated"], result["total"]))
+                return catalog, counts
+            finally:
+                await client.aclose()
+
+        catalog, counts = asyncio.run(run())
+    print(f"每次刷新的上游请求数、更新数与总数: {counts}，统计: {catalog.get_stats()}")
+    assert counts == [(2, 0, 250), (2, 0, 250), (1 + 3, 1, 250)]
+    assert catalog.search(pay_type="not_free", page_num=22, page_size=10)["data"]["list"][0]["templateName"] == "改名"
+    assert catalog.get_stats()["full_refreshes"] == 2
+    print("✅ 未变化的分页不再抓取，定期全量抓取补上深层分页的变化")
+
+
+def test_client_uses_catalog():
+    """测试客户端在目录就绪后由本地索引回答get_theme_list"""
+    print("\n🧪 测试4：get_theme_list使用本地目录")
+    print("=" * 40)
+
+    data = make_catalog(free_count=3, paid_count=12)
+    with MockXfyunServer() as mock, tempfile.TemporaryDirectory() as tmp:
+        mock.responses["/template/list"] = paged_handler(data)
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url,
+                                      template_catalog_config={"path": os.path.join(tmp, "catalog.json")})
+            try:
+                # 目录未就绪时请求上游，同时在后台开始抓取
+                first = await client.get_theme_list(page_size=2)
+                while not client.template_catalog.ready:
+                    await asyncio.sleep(0.01)
+                requests_before = mock.count("/template/list")
+                results = [await client.get_theme_list(style="商务", page_size=50) for _ in range(20)]
+                return first, results, mock.count("/template/list") - requests_before
+            finally:
+                await client.aclose()
+
+        first, results, extra_requests = asyncio.run(run())
+    assert first["code"] == 0 and "source" not in first
+    assert all(r["source"] == "local_catalog" for r in results)
+    assert results[0]["data"]["total"] == 4  # 默认pay_type为not_free
+    assert extra_requests == 0
+    print("✅ 目录就绪后查询不再请求上游")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 本地模板目录测试")
+    print("=" * 50)
+    test_crawl_and_search()
+    test_persist_and_incremental_refresh()
+    test_incremental_stops_early()
+    test_client_uses_catalog()
+    print("\n🎉 本地模板目录测试完成!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试租户配额TenantQuotas：并发与频率限制、按租户覆盖、tools/call返回JSON-RPC错误、HTTP租户认证（离线）
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+import asyncio
+import time
+
+import main as mcp_server
+from main import (DEFAULT_TENANT, QUOTA_EXCEEDED_CODE, TENANT_QUOTA_CONFIG, QuotaExceeded, TenantQuotas,
+                  TenantRequired, _acquire_http_tool_quota, _guard_call_tool_quota, _http_request_tenant, server)
+from mcp.shared.exceptions import McpError
+import mcp.types as types
+from starlette.requests import Request
+
+
+def http_request(headers: dict) -> Request:
+    return Request({"type": "http", "method": "POST", "path": "/mcp", "client": ("10.0.0.1", 50000),
+                    "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+
+
+def test_concurrency_limit():
+    """测试每个租户的并发上限互不影响，释放后可再次调用"""
+    print("🧪 测试1：租户并发上限")
+    print("=" * 40)
+
+    quotas = TenantQuotas(max_concurrent=2, exempt_tools=["get_api_pool_stats"],
+                          overrides={"vip": {"max_concurrent": 3}})
+    held = [quotas.try_acquire("agent-a", "create_ppt_task") for _ in range(2)]
+    try:
+        quotas.try_acquire("agent-a", "get_theme_list")
+        raise AssertionError("应拒绝第3个并发调用")
+    except QuotaExceeded as e:
+        print(f"拒绝信息: {e}")
+        assert e.reason == "concurrency" and e.limit == 2
+    # 其他租户与不计配额的工具不受影响
+    others = [quotas.try_acquire("vip", "create_ppt_task") for _ in range(3)]
+    quotas.try_acquire("agent-a", "get_api_pool_stats")()
+
+    held[0]()
+    held[0]()  # 重复释放无效
+    with quotas.hold("agent-a", "get_theme_list"):
+        pass
+    stats = quotas.get_stats()
+    print(f"统计: {stats}")
+    assert stats["rejected_concurrency"] == 1 and stats["admitted"] == 6
+    assert stats["top_tenants"]["agent-a"]["active"] == 1
+    for release in held[1:] + others:
+        release()
+    print("✅ 超出并发上限的调用被立即拒绝，其他租户不受影响")
+
+
+def test_rate_limit():
+    """测试令牌桶：突发用完后按速率恢复，拒绝时给出重试等待时间"""
+    print("\n🧪 测试2：租户调用频率")
+    print("=" * 40)
+
+    quotas = TenantQuotas(rate_per_minute=600, burst=3)
+    for _ in range(3):
+        quotas.try_acquire("agent-a")()
+    try:
+        quotas.try_acquire("agent-a")
+        raise AssertionError("突发额度用完后应拒绝")
+    except QuotaExceeded as e:
+        print(f"拒绝信息: {e}")
+        assert e.reason == "rate" and 0 < e.retry_after <= 0.1
+        error = e.to_error()
+    assert error["code"] == QUOTA_EXCEEDED_CODE and error["data"]["tenant"] == "agent-a"
+    quotas.try_acquire("agent-b")()
+    time.sleep(0.12)
+    quotas.try_acquire("agent-a")()
+    assert quotas.get_stats()["rejected_rate"] == 1
+    print("✅ 频率超限时返回重试等待时间，令牌按速率恢复")
+
+
+def test_call_tool_json_rpc_error():
+    """测试SSE传输的MCP会话在超出配额时，tools/call返回JSON-RPC错误而不是工具错误结果"""
+    print("\n🧪 测试3：tools/call的JSON-RPC错误")
+    print("=" * 40)
+
+    # 默认不检查配额（stdio）；开启配额并像run_sse_server一样安装检查
+    assert mcp_server.tenant_quotas is None
+    original = server.request_handlers[types.CallToolRequest]
+    tenant_quotas = mcp_server.tenant_quotas = TenantQuotas(max_concurrent=2, exempt_tools=["get_api_pool_stats"])
+    _guard_call_tool_quota()
+    handler = server.request_handlers[types.CallToolRequest]
+    request = types.CallToolRequest(method="tools/call",
+                                    params=types.CallToolRequestParams(name="get_api_pool_stats", arguments={}))
+    blocked = types.CallToolRequest(method="tools/call",
+                                    params=types.CallToolRequestParams(name="get_task_progress",
+                                                                       arguments={"sid": "x"}))
+    # 占满默认租户（会话之外调用时的租户）的并发配额
+    held = [tenant_quotas.try_acquire(DEFAULT_TENANT, "get_task_progress")
+            for _ in range(tenant_quotas.max_concurrent)]
+    try:
+        # 不计配额的工具在租户已满时仍可调用
+        result = asyncio.run(handler(request))
+        assert not result.root.isError
+        try:
+            asyncio.run(handler(blocked))
+            raise AssertionError("应返回JSON-RPC错误")
+        except McpError as e:
+            print(f"错误响应: {e.error.model_dump()}")
+            assert e.error.code == QUOTA_EXCEEDED_CODE
+            assert e.error.data["reason"] == "concurrency"
+    finally:
+        for release in held:
+            release()
+        server.request_handlers[types.CallToolRequest] = original
+        mcp_server.tenant_quotas = None
+    assert tenant_quotas.get_stats()["top_tenants"][DEFAULT_TENANT]["active"] == 0
+    print("✅ 超出配额的调用在进入工作池之前被拒绝")
+
+
+def expect_rejected(request, tool_name: str, reason: str):
+    try:
+        _acquire_http_tool_quota(request, tool_name)
+    except QuotaExceeded as e:
+        print(f"拒绝信息: {e}")
+        assert e.reason == reason, e.reason
+        return e
+    raise AssertionError(f"应以{reason}拒绝")
+
+
+def test_http_tenant_auth():
+    """测试HTTP类传输：开启配额时按租户令牌计配额，X-Tenant-Id请求头不能冒充租户；未开启时不检查"""
+    print("\n🧪 测试4：HTTP租户认证")
+    print("=" * 40)
+
+    _acquire_http_tool_quota(http_request({}), "create_ppt_task")()
+    saved = dict(TENANT_QUOTA_CONFIG)
+    TENANT_QUOTA_CONFIG["tenant_tokens"] = {"token-a": "agent-a", "token-b": "agent-b"}
+    mcp_server.tenant_quotas = TenantQuotas(max_concurrent=1, exempt_tools=["get_api_pool_stats"])
+    try:
+        error = expect_rejected(http_request({}), "create_ppt_task", "tenant_required")
+        assert isinstance(error, TenantRequired)
+        assert error.to_error()["code"] == types.INVALID_REQUEST
+        assert error.to_error()["data"]["reason"] == "tenant_required"
+        _acquire_http_tool_quota(http_request({}), "get_api_pool_stats")()
+        expect_rejected(http_request({"Authorization": "Bearer forged"}), "create_ppt_task", "invalid_token")
+
+        # 同一客户端地址后面的两个租户各自计配额
+        held = _acquire_http_tool_quota(http_request({"Authorization": "Bearer token-a"}), "create_ppt_task")
+        _acquire_http_tool_quota(http_request({"Authorization": "Bearer token-b"}), "create_ppt_task")()
+        error = expect_rejected(http_request({"Authorization": "Bearer token-a"}), "create_ppt_task", "concurrency")
+        assert error.tenant == "agent-a"
+
+        # 客户端自行设置的X-Tenant-Id：不能换值绕过配额，也不能冒用其他租户（占用对方的配额或权重）
+        for tenant in ("agent-b", "fresh-1", "fresh-2"):
+            expect_rejected(http_request({"X-Tenant-Id": tenant}), "create_ppt_task", "tenant_required")
+        expect_rejected(http_request({"Authorization": "Bearer forged", "X-Tenant-Id": "agent-b"}),
+                        "create_ppt_task", "invalid_token")
+        assert _http_request_tenant(http_request({"X-Tenant-Id": "agent-b"})) == "client-10.0.0.1"
+        assert _http_request_tenant(http_request({"Mcp-Session-Id": "agent-b"})) == "session-agent-b"
+        assert _http_request_tenant(http_request({"Authorization": "Bearer token-b"})) == "agent-b"
+        held()
+        top_tenants = mcp_server.tenant_quotas.get_stats()["top_tenants"]
+        assert set(top_tenants) == {"agent-a", "agent-b"}
+        assert top_tenants["agent-b"]["calls"] == 1
+
+        # 前置认证代理覆盖X-Tenant-Id时才信任该请求头
+        TENANT_QUOTA_CONFIG["tenant_tokens"] = {}
+        TENANT_QUOTA_CONFIG["trust_tenant_header"] = True
+        _acquire_http_tool_quota(http_request({"X-Tenant-Id": "agent-c"}), "create_ppt_task")()
+        assert "agent-c" in mcp_server.tenant_quotas.get_stats()["top_tenants"]
+    finally:
+        TENANT_QUOTA_CONFIG.clear()
+        TENANT_QUOTA_CONFIG.update(saved)
+        mcp_server.tenant_quotas = None
+    print("✅ 开启配额时按租户令牌计配额，伪造或缺少令牌的调用被拒绝")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 租户配额测试")
+    print("=" * 50)
+    test_concurrency_limit()
+    test_rate_limit()
+    test_call_tool_json_rpc_error()
+    test_http_tenant_auth()
+    print("\n🎉 租户配额测试完成!")
+
+
+if __name__ == "__main__":
+    main()
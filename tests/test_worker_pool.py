@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试工具调用工作池ToolWorkerPool（并发上限、拒绝策略、优先级与租户公平排队，离线）
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+import asyncio
+import time
+
+from main import ToolWorkerPool, WorkerPoolRejected
+
+
+def test_bounded_concurrency():
+    """测试并发上限与排队统计"""
+    print("🧪 测试1：并发上限与排队")
+    print("=" * 40)
+
+    async def run():
+        pool = ToolWorkerPool(max_workers=2)
+        peak = 0
+
+        async def job():
+            nonlocal peak
+            peak = max(peak, pool.get_stats()["active"])
+            await asyncio.sleep(0.1)
+            return "ok"
+
+        results = await asyncio.gather(*[pool.run(job) for _ in range(6)])
+        return pool.get_stats(), peak, results
+
+    stats, peak, results = asyncio.run(run())
+    print(f"统计: {stats}")
+    assert results == ["ok"] * 6
+    assert peak == 2
+    assert stats["max_queue_depth"] >= 4
+    assert stats["max_wait_time"] > 0.15
+    print("✅ 同时执行数不超过上限，超出部分排队等待")
+
+
+def test_fail_fast():
+    """测试fail_fast策略立即拒绝"""
+    print("\n🧪 测试2：fail_fast拒绝策略")
+    print("=" * 40)
+
+    async def run():
+        pool = ToolWorkerPool(max_workers=1, rejection_policy="fail_fast")
+        slow = asyncio.create_task(pool.run(asyncio.sleep, 0.2))
+        await asyncio.sleep(0.01)
+        try:
+            await pool.run(asyncio.sleep, 0)
+            rejected = False
+        except WorkerPoolRejected as e:
+            print(f"拒绝信息: {e}")
+            rejected = True
+        await slow
+        return rejected, pool.get_stats()
+
+    rejected, stats = asyncio.run(run())
+    assert rejected and stats["rejected"] == 1
+    print("✅ 工作池满时立即拒绝")
+
+
+def test_blocking_offload():
+    """测试阻塞函数在线程池中执行，不阻塞事件循环"""
+    print("\n🧪 测试3：阻塞调用卸载到线程池")
+    print("=" * 40)
+
+    async def run():
+        pool = ToolWorkerPool(max_workers=4)
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            for _ in range(5):
+                await asyncio.sleep(0.02)
+                ticks += 1
+
+        await asyncio.gather(pool.run(time.sleep, 0.2), heartbeat())
+        pool.shutdown()
+        return ticks
+
+    ticks = asyncio.run(run())
+    assert ticks == 5
+    print("✅ 阻塞调用期间事件循环仍正常响应")
+
+
+def test_priority_classes():
+    """测试工作池满时交互查询优先于排队中的批量提交"""
+    print("\n🧪 测试4：优先级类别")
+    print("=" * 40)
+
+    async def run():
+        pool = ToolWorkerPool(max_workers=1)
+        order = []
+
+        async def job(label):
+            order.append(label)
+            await asyncio.sleep(0.01)
+
+        busy = asyncio.create_task(pool.run_as("generation", "A", job, "running"))
+        await asyncio.sleep(0)
+        batch = [asyncio.create_task(pool.run_as("batch", "A", job, f"batch{i}")) for i in range(10)]
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(pool.run_as("interactive", "B", job, "interactive"))
+        outline = asyncio.create_task(pool.run_as("outline", "B", job, "outline"))
+        await asyncio.gather(busy, interactive, outline, *batch)
+        return order, pool.get_stats()
+
+    order, stats = asyncio.run(run())
+    print(f"执行顺序: {order}")
+    assert order[0] == "running"
+    assert order.index("interactive") == 1
+    assert order.index("outline") <= 3
+    assert stats["by_priority"]["batch"]["submitted"] == 10
+    assert stats["by_priority"]["interactive"]["max_wait_time"] < stats["by_priority"]["batch"]["max_wait_time"]
+    print("✅ 交互查询与大纲生成插到批量提交之前执行")
+
+
+def test_tenant_fairness():
+    """测试同一优先级下各租户按权重轮流获得名额"""
+    print("\n🧪 测试5：租户公平排队")
+    print("=" * 40)
+
+    async def run():
+        pool = ToolWorkerPool(max_workers=2, tenant_weights={"vip": 2})
+        order = []
+
+        async def job(label):
+            order.append(label)
+            await asyncio.sleep(0.005)
+
+        heavy = [asyncio.create_task(pool.run_as("batch", "heavy", job, "heavy")) for _ in range(30)]
+        await asyncio.sleep(0)
+        light = [asyncio.create_task(pool.run_as("batch", "light", job, "light")) for _ in range(3)]
+        vip = [asyncio.create_task(pool.run_as("batch", "vip", job, "vip")) for _ in range(4)]
+        await asyncio.gather(*heavy, *light, *vip)
+        return order
+
+    order = asyncio.run(run())
+    print(f"前12次执行: {order[:12]}")
+    # 前两个名额被heavy立即占用，之后三个租户按1:1:2的权重交替
+    assert order[:12].count("light") == 3
+    assert order[:12].count("vip") == 4
+    assert len(order) == 37
+    print("✅ 单个租户的大量请求不会饿死其他租户")
+
+
+def test_queue_timeout_releases_slot():
+    """测试排队超时的请求不占用名额"""
+    print("\n🧪 测试6：排队超时")
+    print("=" * 40)
+
+    async def run():
+        pool = ToolWorkerPool(max_workers=1, queue_timeout=0.05)
+        slow = asyncio.create_task(pool.run(asyncio.sleep, 0.1))
+        await asyncio.sleep(0)
+        try:
+            await pool.run_as("batch", "A", asyncio.sleep, 0)
+            timed_out = False
+        except WorkerPoolRejected:
+            timed_out = True
+        await slow
+        await pool.run_as("interactive", "B", asyncio.sleep, 0)
+        return timed_out, pool.get_stats()
+
+    timed_out, stats = asyncio.run(run())
+    assert timed_out and stats["queue_depth"] == 0 and stats["active"] == 0
+    assert stats["completed"] == 2
+    print("✅ 超时请求移出队列，后续请求正常执行")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 工具调用工作池测试")
+    print("=" * 50)
+    test_bounded_concurrency()
+    test_fail_fast()
+    test_blocking_offload()
+    test_priority_classes()
+    test_tenant_fairness()
+    test_queue_timeout_releases_slot()
+    print("\n🎉 工作池测试完成!")
+
+
+if __name__ == "__main__":
+    main()
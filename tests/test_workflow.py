@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试ReACT工作流DAG：模板选择与大纲生成并发执行、阶段耗时记录、阶段失败处理、等待完成并推送阶段事件（离线）
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+import asyncio
+import time
+
+from main import AsyncAIPPTClient, execute_react_ppt_workflow
+from mock_xfyun_server import MockXfyunServer
+from task_tracker import TaskTracker
+
+TEST_KEY_POOL = [
+    {"app_id": "test_app", "api_secret": "test_secret", "name": "测试密钥", "max_concurrent": 10, "enabled": True}
+]
+
+STAGE_DELAY = 0.3
+
+
+def slow(response=None):
+    """延迟STAGE_DELAY秒后返回response（None表示默认响应）"""
+    def handler(query, body):
+        time.sleep(STAGE_DELAY)
+        return response
+    return handler
+
+
+def run_workflow(mock, **kwargs) -> dict:
+    async def run():
+        client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+        client.theme_cache = None  # 每次都实际请求模板列表
+        try:
+            return await execute_react_ppt_workflow(client, topic="人工智能导论", **kwargs)
+        finally:
+            await client.aclose()
+    return asyncio.run(run())
+
+
+def test_concurrent_stages():
+    """测试模板选择与大纲生成同时进行，端到端耗时约等于较慢的一个阶段"""
+    print("🧪 测试1：模板选择与大纲生成并发")
+    print("=" * 40)
+
+    with MockXfyunServer() as mock:
+        mock.responses["/template/list"] = slow()
+        mock.responses["/createOutline"] = slow()
+        started = time.perf_counter()
+        result = run_workflow(mock)
+        elapsed = time.perf_counter() - started
+
+    timings = result["react_summary"]["stage_timings"]
+    for stage, timing in timings.items():
+        print(f"{stage}: 开始 {timing['start_ms']}ms，耗时 {timing['duration_ms']}ms")
+    print(f"端到端耗时: {elapsed:.2f}秒")
+    assert result["success"], result
+    assert set(timings) == {"select_template", "generate_outline", "create_ppt"}
+    # 两个阶段的时间区间重叠
+    template, outline = timings["select_template"], timings["generate_outline"]
+    assert outline["start_ms"] < template["start_ms"] + template["duration_ms"]
+    assert timings["create_ppt"]["start_ms"] >= max(template["start_ms"] + template["duration_ms"],
+                                                     outline["start_ms"] + outline["duration_ms"]) - 1
+    assert elapsed < 2 * STAGE_DELAY
+    assert result["workflow_log"][-1]["stage"] == "TIMING"
+    assert result["react_summary"]["total_stages"] == len(result["workflow_log"]) - 1
+    assert all("elapsed_ms" in entry for entry in result["workflow_log"])
+    print("✅ 两个独立阶段并发执行，阶段耗时已记录在workflow_log中")
+
+
+def test_stage_failure_cancels_workflow():
+    """测试任一阶段失败时返回对应错误，且不会创建PPT"""
+    print("\n🧪 测试2：阶段失败")
+    print("=" * 40)
+
+    with MockXfyunServer() as mock:
+        mock.responses["/template/list"] = {"code": 10001, "desc": "模板服务不可用"}
+        mock.responses["/createOutline"] = slow()
+        result = run_workflow(mock)
+        create_calls = mock.count("/create")
+
+    print(f"结果: {result['error']}")
+    assert not result["success"] and result["error"] == "无法获取PPT模板"
+    assert create_calls == 0
+    failed = [entry for entry in result["workflow_log"] if entry.get("status") == "failed"]
+    assert failed and failed[0]["action"] == "模板获取失败"
+    assert "select_template" in result["workflow_log"][-1]["stages"]
+    print("✅ 模板阶段失败后其余阶段被取消，未提交PPT任务")
+
+
+def progress_script(statuses):
+    """按顺序返回预设的PPT生成进度（pptStatus, donePages），用完后一直返回最后一个"""
+    responses = [{"code": 0, "data": {"pptStatus": status, "aiImageStatus": "done", "cardNoteStatus": "done",
+                                      "totalPages": 10, "donePages": done,
+                                      "pptUrl": "http://example.invalid/deck.pptx" if status == "done" else ""}}
+                 for status, done in statuses]
+    return lambda query, body: responses.pop(0) if len(responses) > 1 else responses[0]
+
+
+def test_wait_for_completion_streams_events():
+    """测试wait_for_completion一次调用返回下载地址，阶段事件与生成进度按整体进度递增推送"""
+    print("\n🧪 测试3：等待完成并推送阶段事件")
+    print("=" * 40)
+
+    events = []
+
+    async def on_event(event):
+        events.append(event)
+
+    with MockXfyunServer() as mock:
+        mock.responses["/progress"] = progress_script([("building", 2), ("building", 6), ("done", 10)])
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+            client.progress_scheduler.freshness = 0.0
+            tracker = TaskTracker(client.progress_scheduler.poll, {"min_interval": 0.02, "max_interval": 0.1})
+            try:
+                return await execute_react_ppt_workflow(client, topic="人工智能导论", wait_for_completion=True,
+                                                        timeout=10, tracker=tracker, on_event=on_event)
+            finally:
+                await tracker.aclose()
+                await client.aclose()
+
+        result = asyncio.run(run())
+
+    for event in events:
+        print(f"{event['progress']:>5}% {event['status']}")
+    assert result["success"] and result["ppt_url"] == "http://example.invalid/deck.pptx"
+    assert result["react_summary"]["status"] == "deck_ready" and not result["timed_out"]
+    assert "wait_for_deck" in result["react_summary"]["stage_timings"]
+    progress = [event["progress"] for event in events]
+    assert all(a < b for a, b in zip(progress, progress[1:])) and progress[-1] == 100
+    assert {event["stage"] for event in events} == {"THINK", "ACT", "OBSERVE"}
+    assert any(event.get("deck_progress") for event in events), "应推送PPT生成进度"
+    print("✅ 一次调用返回下载地址，整体进度严格递增")
+
+
+def test_wait_for_completion_timeout():
+    """测试等待超时时返回task_id并提示继续使用wait_for_task"""
+    print("\n🧪 测试4：等待超时")
+    print("=" * 40)
+
+    with MockXfyunServer() as mock:
+        mock.responses["/progress"] = progress_script([("building", 3)])
+
+        async def run():
+            client = AsyncAIPPTClient(key_pool=TEST_KEY_POOL, base_url=mock.base_url)
+            tracker = TaskTracker(client.progress_scheduler.poll, {"min_interval": 0.02, "max_interval": 0.1})
+            try:
+                return await execute_react_ppt_workflow(client, topic="人工智能导论", wait_for_completion=True,
+                                                        timeout=0.3, tracker=tracker)
+            finally:
+                await tracker.aclose()
+                await client.aclose()
+
+        result = asyncio.run(run())
+
+    print(f"结果: {result['react_summary']['status']}, {result['next_steps'][0]}")
+    assert result["success"] and result["timed_out"] and result["task_id"]
+    assert result["react_summary"]["status"] == "wait_timed_out"
+    assert "wait_for_task" in result["next_steps"][0]
+    print("✅ 超时后返回task_id，可继续等待")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 ReACT工作流DAG测试")
+    print("=" * 50)
+    test_concurrent_stages()
+    test_stage_failure_cancels_workflow()
+    test_wait_for_completion_streams_events()
+    test_wait_for_completion_timeout()
+    print("\n🎉 ReACT工作流DAG测试完成!")
+
+
+if __name__ == "__main__":
+    main()